@@ -16,6 +16,17 @@
     const SERVER_URL = `http://localhost:${PORT}/content`;
     const RESPONSE_URL = `http://localhost:${PORT}/response`;
 
+    // Seconds each /content request waits for work, and how long an idle tab stays in the pool
+    const FETCH_WAIT = 25;
+    const POOL_IDLE_TIMEOUT = 10 * 60 * 1000;
+    // Job leased while idle, carried across the reload that starts a fresh conversation
+    const JOB_KEY = 'web-assistant-job';
+    // Set once this tab has answered a request, so tabs the user opened themselves never join the pool
+    const POOLED_KEY = 'web-assistant-pooled';
+    // Responses at least this long are gzipped when the server accepts it
+    const COMPRESS_MIN_BYTES = 1024;
+    let serverAcceptsGzip = false;
+
     // Show status notifications
     const showStatus = (() => {
         const el = document.createElement('div');
@@ -44,11 +55,13 @@
         }, 500);
     });
 
-    // Get content from local server
-    const fetchPageContent = () => new Promise((resolve, reject) => {
+    // Lease the next request from the local server; resolves null if none arrived in time.
+    // Pooled tabs only receive background requests, never another tab's view mode request.
+    const fetchPageContent = (pooled = false, wait = FETCH_WAIT) => new Promise((resolve, reject) => {
         GM_xmlhttpRequest({
             method: 'GET',
-            url: SERVER_URL,
+            url: `${SERVER_URL}?wait=${wait}${pooled ? '&pool=1' : ''}`,
+            timeout: (wait + 10) * 1000,
             onload: (response) => {
                 if (response.status === 200) {
                     try {
@@ -57,19 +70,57 @@
                             content: data.content,
                             prompt: data.prompt,
                             requestId: data.requestId,
-                            viewInChatGPT: data.viewInChatGPT || false
+                            viewInChatGPT: data.viewInChatGPT || false,
+                            message: data.message || null,
+                            gzip: (data.features || []).includes('gzip')
                         });
                     } catch (error) {
                         reject('Error parsing content: ' + error);
                     }
+                } else if (response.status === 404) {
+                    resolve(null);
                 } else {
                     reject(`Server error: ${response.status}`);
                 }
             },
+            ontimeout: () => resolve(null),
             onerror: (error) => reject('Connection error: ' + error)
         });
     });
 
+    // Stay open and wait for the next request instead of the server opening a new tab
+    const waitForNextJob = async () => {
+        const idleSince = Date.now();
+
+        while (Date.now() - idleSince < POOL_IDLE_TIMEOUT) {
+            showStatus('Waiting for the next page to analyze...');
+            let job = null;
+            const fetchStart = Date.now();
+            try {
+                job = await fetchPageContent(true);
+            } catch (err) {
+                console.error('Web Assistant error while idle:', err);
+                await new Promise(resolve => setTimeout(resolve, 5000));
+            }
+
+            // A busy server answers at once instead of holding the request open, so don't hammer it
+            if (!job && Date.now() - fetchStart < 1000) {
+                await new Promise(resolve => setTimeout(resolve, 2000));
+            }
+
+            if (job) {
+                // Start a fresh conversation for the new job; it is picked up after the reload
+                sessionStorage.setItem(JOB_KEY, JSON.stringify(job));
+                window.location.href = 'https://chatgpt.com/';
+                return;
+            }
+        }
+
+        sessionStorage.removeItem(POOLED_KEY);
+        showStatus('No more pages to analyze. This tab is about to close.');
+        setTimeout(() => window.close(), 3000);
+    };
+
     // Find the chat input field
     const findChatInput = () => {
         const selectors = [
@@ -250,63 +301,56 @@
         return responses[responses.length - 1].textContent;
     };
 
+    // Gzip a request body when the server accepts it; resolves to { data, headers }
+    const encodeBody = async (text) => {
+        const headers = { 'Content-Type': 'application/json' };
+        if (!serverAcceptsGzip || typeof CompressionStream === 'undefined' || text.length < COMPRESS_MIN_BYTES) {
+            return { data: text, headers };
+        }
+
+        try {
+            const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+            return { data: await new Response(stream).blob(), headers: { ...headers, 'Content-Encoding': 'gzip' } };
+        } catch (error) {
+            console.warn('Compression failed, sending uncompressed:', error);
+            return { data: text, headers };
+        }
+    };
+
     // Send the response back to the server
-    const sendResponseToServer = (response, requestId) => new Promise((resolve, reject) => {
-        GM_xmlhttpRequest({
-            method: 'POST',
-            url: RESPONSE_URL,
-            data: JSON.stringify({
-                response,
-                requestId
-            }),
-            headers: { 'Content-Type': 'application/json' },
-            onload: (response) => {
-                if (response.status === 200) resolve();
-                else reject(`Server error: ${response.status}`);
-            },
-            onerror: () => reject('Connection error')
+    const sendResponseToServer = async (response, requestId, isError = false) => {
+        const body = await encodeBody(JSON.stringify({
+            response,
+            requestId,
+            error: isError
+        }));
+
+        return new Promise((resolve, reject) => {
+            GM_xmlhttpRequest({
+                method: 'POST',
+                url: RESPONSE_URL,
+                data: body.data,
+                headers: body.headers,
+                onload: (response) => {
+                    if (response.status === 200) resolve();
+                    else reject(`Server error: ${response.status}`);
+                },
+                onerror: () => reject('Connection error')
+            });
         });
-    });
+    };
 
     // Process the page content
-    const processPageContent = async (content, prompt, requestId, viewInChatGPT) => {
+    const processPageContent = async (content, prompt, requestId, viewInChatGPT, message = null) => {
         try {
             showStatus('Preparing to analyze page content...');
 
-            // Format the query differently based on mode
-            let formattedPrompt;
-
-            if (viewInChatGPT) {
-                // Simple format for view-only mode
-                formattedPrompt = `
-User prompt: "${prompt || "Analyze this page content"}"
-
-I'll share content from a webpage below. Please answer the user's prompt based on this content.
-If the content doesn't contain information to answer the prompt, please state that clearly.
-
-Page content:
-${content}
-`;
-            } else {
-                // Format with instruction to format response for status bar
-                formattedPrompt = `
-User prompt: "${prompt || "Analyze this page content"}"
-
-I'll share content from a webpage below. Please answer the user's prompt based on this content.
-If the content doesn't contain information to answer the prompt, please state that clearly.
-
-IMPORTANT: Your response will be displayed in a small status bar, so please:
-1. Keep your response concise and to the point (ideally under 200 characters)
-2. Format it to be easily readable in a small space
-3. Focus on the most important insights or actionable information
-4. Avoid unnecessary explanations or verbosity
+            // The server words the message for each kind of request; older servers only send the content
+            const formattedPrompt = message || `User prompt: "${prompt || "Analyze this page content"}"
 
 Page content:
 ${content}
-
-Remember to provide ONLY the final, concise response formatted for display in a small status bar.
 `;
-            }
 
             // Submit the message to ChatGPT
             showStatus('Sending content to ChatGPT...');
@@ -324,10 +368,11 @@ Remember to provide ONLY the final, concise response formatted for display in a
                 showStatus('Sending response back to server...');
                 await sendResponseToServer(response, requestId);
 
-                showStatus('Analysis complete! This tab is about to close.');
+                showStatus('Analysis complete!');
 
-                // Close this tab automatically after a delay
-                setTimeout(() => window.close(), 3000);
+                // Keep this tab around for the next request
+                sessionStorage.setItem(POOLED_KEY, '1');
+                setTimeout(waitForNextJob, 1000);
             } else {
                 // In view-only mode, just show a status message
                 showStatus('Analysis complete in ChatGPT! This tab will remain open.');
@@ -341,7 +386,7 @@ Remember to provide ONLY the final, concise response formatted for display in a
             // If not in view-only mode, try to send an error message
             if (!viewInChatGPT) {
                 try {
-                    await sendResponseToServer(`Error processing content: ${error}`, requestId);
+                    await sendResponseToServer(`Error processing content: ${error}`, requestId, true);
                 } catch (e) {
                     console.error('Failed to send error to server:', e);
                 }
@@ -355,12 +400,27 @@ Remember to provide ONLY the final, concise response formatted for display in a
             await waitForChatGPT();
             showStatus('Fetching page content to analyze...');
 
-            const { content, prompt, requestId, viewInChatGPT } = await fetchPageContent();
+            // A job leased before this page reloaded, or the next one from the server
+            const stashedJob = sessionStorage.getItem(JOB_KEY);
+            sessionStorage.removeItem(JOB_KEY);
+            const job = stashedJob ? JSON.parse(stashedJob) : await fetchPageContent(false, 5);
+
+            if (!job) {
+                if (sessionStorage.getItem(POOLED_KEY)) {
+                    await waitForNextJob();
+                } else {
+                    showStatus('No pending request found', true);
+                }
+                return;
+            }
+
+            const { content, prompt, requestId, viewInChatGPT, message } = job;
+            serverAcceptsGzip = Boolean(job.gzip);
 
             const actionType = viewInChatGPT ? "viewing in ChatGPT" : "analyzing";
             showStatus(`${actionType} content with prompt: "${prompt || "No prompt (default analysis)"}"...`);
 
-            await processPageContent(content, prompt, requestId, viewInChatGPT);
+            await processPageContent(content, prompt, requestId, viewInChatGPT, message);
 
         } catch (err) {
             showStatus(`Error: ${err}`, true);
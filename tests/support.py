@@ -0,0 +1,17 @@
+"""Shared helpers for the tests"""
+
+import importlib.util
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_script(name):
+    """Import one of the repository's scripts, whose hyphenated file names can't be imported directly"""
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), ROOT / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+server = load_script('web-assistant-server')
@@ -0,0 +1,76 @@
+"""Splitting pages into blocks, hashing them like the userscript does, and diffing them"""
+
+import json
+import shutil
+import subprocess
+import unittest
+
+from tests.support import ROOT, server
+
+# Odd whitespace and non-ASCII text that Python and JavaScript could easily treat differently
+TEXT = ("Héllo  wörld 日本\r\nsecond\tline\x1cx\x85y\ufeffz w\rthird\n\n  \n"
+        "€ 💡 end    tail\n\ufeff\n")
+
+
+def hashes(*blocks):
+    return [server.block_hash(block) for block in blocks]
+
+
+class PageBlocksTest(unittest.TestCase):
+
+    def test_splits_lines_and_collapses_whitespace(self):
+        self.assertEqual(server.page_blocks(TEXT), [
+            'Héllo wörld 日本', 'second line\x1cx\x85y z w', 'third', '€ 💡 end tail'
+        ])
+
+    def test_empty_text(self):
+        self.assertEqual(server.page_blocks(''), [])
+        self.assertEqual(server.page_blocks(' \n\t\r\n'), [])
+
+
+class BlockHashTest(unittest.TestCase):
+
+    def test_known_values(self):
+        # CRC-32 then Adler-32 of the UTF-8 bytes
+        self.assertEqual(server.block_hash(''), '0000000000000001')
+        self.assertEqual(server.block_hash('a'), 'e8b7be4300620062')
+        self.assertNotEqual(server.block_hash('third'), server.block_hash('Third'))
+
+    @unittest.skipUnless(shutil.which('node'), "node is needed to run the userscript's code")
+    def test_matches_the_userscript(self):
+        source = (ROOT / 'web-assistant.user.js').read_text(encoding='utf-8')
+        start = source.index('    function pageBlocks(')
+        end = source.index('\n    }\n', source.index('    function blockHash(')) + len('\n    }\n')
+        script = source[start:end] + (f"\nconst blocks = pageBlocks({json.dumps(TEXT)});\n"
+                                      "console.log(JSON.stringify([blocks, blocks.map(blockHash)]));")
+
+        output = subprocess.run(['node', '-e', script], capture_output=True, text=True, check=True).stdout
+        blocks, block_hashes = json.loads(output)
+        self.assertEqual(blocks, server.page_blocks(TEXT))
+        self.assertEqual(block_hashes, hashes(*blocks))
+
+
+class DiffBlocksTest(unittest.TestCase):
+
+    def test_unchanged(self):
+        self.assertEqual(server.diff_blocks(hashes('a', 'b'), hashes('a', 'b')), ([], []))
+
+    def test_insert_delete_and_replace(self):
+        old = hashes('a', 'b', 'c', 'd')
+        self.assertEqual(server.diff_blocks(old, hashes('a', 'x', 'b', 'c', 'd')), ([], [1]))
+        self.assertEqual(server.diff_blocks(old, hashes('a', 'c', 'd')), ([1], []))
+        self.assertEqual(server.diff_blocks(old, hashes('a', 'B', 'c', 'd')), ([1], [1]))
+
+    def test_from_and_to_nothing(self):
+        self.assertEqual(server.diff_blocks([], hashes('a', 'b')), ([], [0, 1]))
+        self.assertEqual(server.diff_blocks(hashes('a', 'b'), []), ([0, 1], []))
+
+    def test_repeated_blocks(self):
+        # Pages repeat blocks such as separators, which a junk heuristic would ignore
+        old = hashes(*(['-'] * 300 + ['a']))
+        new = hashes(*(['-'] * 300 + ['b']))
+        self.assertEqual(server.diff_blocks(old, new), ([300], [300]))
+
+
+if __name__ == '__main__':
+    unittest.main()
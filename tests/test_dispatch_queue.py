@@ -0,0 +1,108 @@
+"""Leasing queued requests to ChatGPT connectors"""
+
+import threading
+import time
+import unittest
+
+from tests.support import server
+
+
+class DispatchQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = server.DispatchQueue(lease_timeout=60, max_attempts=2)
+
+    def expire(self):
+        return self.queue.requeue_expired(now=time.time() + 61)
+
+    def test_leases_in_priority_then_arrival_order(self):
+        self.queue.put('second', priority=1)
+        self.queue.put('third', priority=1)
+        self.queue.put('first', priority=0)
+
+        leased = [self.queue.lease()[0] for _ in range(3)]
+        self.assertEqual(leased, ['first', 'second', 'third'])
+        self.assertIsNone(self.queue.lease())
+
+    def test_put_reports_whether_a_connector_is_needed(self):
+        self.assertTrue(self.queue.put('a'))
+        self.assertFalse(self.queue.put('a'))  # Already queued
+
+        self.assertEqual(self.queue.lease()[0], 'a')
+        self.assertFalse(self.queue.put('a'))  # Already leased
+
+    def test_put_wakes_a_waiting_pooled_connector(self):
+        leased = []
+        connector = threading.Thread(target=lambda: leased.append(self.queue.lease(wait=5, pooled=True)))
+        connector.start()
+        deadline = time.time() + 5
+        while self.queue.stats()['idleConnectors'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertFalse(self.queue.put('a'))  # The idle connector takes it, no new tab needed
+        connector.join(5)
+        self.assertEqual(leased[0][0], 'a')
+        self.assertEqual(self.queue.stats()['idleConnectors'], 0)
+
+    def test_ack(self):
+        self.queue.put('leased')
+        self.queue.put('queued')
+        self.queue.lease()
+
+        self.assertTrue(self.queue.ack('leased'))
+        self.assertFalse(self.queue.ack('queued'))  # Dropped from the queue without having been leased
+        self.assertFalse(self.queue.ack('unknown'))
+        self.assertIsNone(self.queue.lease())
+        self.assertEqual(self.expire(), ([], []))
+        self.assertEqual(self.queue.stats(), {'queued': 0, 'leased': 0, 'idleConnectors': 0})
+
+    def test_requeues_expired_leases_then_abandons(self):
+        self.queue.put('a')
+        self.queue.lease()
+        self.assertEqual(self.queue.requeue_expired(), ([], []))  # Not expired yet
+        self.assertEqual(self.expire(), (['a'], []))
+
+        # The server puts requeued requests back on the queue
+        self.queue.put('a')
+        self.assertEqual(self.queue.lease()[0], 'a')
+        self.assertEqual(self.expire(), ([], ['a']))
+        self.assertEqual(self.queue.stats()['leased'], 0)
+
+    def test_ack_resets_attempts(self):
+        self.queue.put('a')
+        self.queue.lease()
+        self.queue.ack('a')
+        self.queue.put('a')
+        self.queue.lease()
+        self.assertEqual(self.expire(), (['a'], []))
+
+    def test_exclusive_requests_skip_pooled_connectors(self):
+        self.assertTrue(self.queue.put('view', exclusive=True))
+        self.queue.put('background')
+
+        self.assertEqual(self.queue.lease(pooled=True)[0], 'background')
+        self.assertEqual(self.queue.lease()[0], 'view')
+
+    def test_exclusive_requests_are_never_requeued(self):
+        # The connector never answers view mode requests, so they must not come back when a lease would expire
+        self.queue.put('view', exclusive=True)
+        request_id, lease_id = self.queue.lease()
+        self.assertEqual(request_id, 'view')
+        self.assertIsNotNone(lease_id)
+
+        self.assertEqual(self.queue.stats()['leased'], 0)
+        self.assertEqual(self.expire(), ([], []))
+        self.assertIsNone(self.queue.lease())
+
+    def test_stale_exclusive_entries_dont_hide_shared_work(self):
+        self.queue.put('view', exclusive=True)
+        self.queue.ack('view')
+        self.queue.put('background')
+
+        started = time.time()
+        self.assertEqual(self.queue.lease(wait=2)[0], 'background')
+        self.assertLess(time.time() - started, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Extracting the main content of a page from its HTML"""
+
+import unittest
+
+from tests.support import server
+
+
+def reduce(html, max_chars=50000):
+    reducer = server.ContentReducer(max_chars)
+    reducer.feed(html)
+    return reducer.text()
+
+
+ARTICLE = ''.join(f"<p>Paragraph {number} of the article explains one more detail.</p>" for number in range(200))
+SIDEBAR = ''.join(f"<p>Widget {number} text</p>" for number in range(40))
+
+
+class ContentReducerTest(unittest.TestCase):
+
+    def test_skips_boilerplate(self):
+        text = reduce('<body><nav><a href="/">Home</a></nav><div class="cookie-banner">We use cookies</div>'
+                      '<div id="comments">First!</div><p>Main text</p><footer>Copyright</footer></body>')
+        self.assertEqual(text, 'Main text')
+
+    def test_matches_whole_class_tokens_only(self):
+        for wrapper in ('site-content has-sidebar', 'header-fixed', 'no-comments', 'menu-open layout'):
+            with self.subTest(wrapper):
+                text = reduce(f'<div class="{wrapper}"><p>Main text</p></div>')
+                self.assertEqual(text, 'Main text')
+        for boilerplate in ('menu', 'main sidebar', 'social-share', 'Related_Posts related'):
+            with self.subTest(boilerplate):
+                self.assertEqual(reduce(f'<div class="{boilerplate}"><p>Hidden</p></div><p>Kept</p>'), 'Kept')
+
+    def test_never_skips_content_containers(self):
+        for tag in ('body', 'main', 'article'):
+            with self.subTest(tag):
+                text = reduce(f'<{tag} class="header" role="banner"><p>Main text</p></{tag}>')
+                self.assertEqual(text, 'Main text')
+
+    def test_unclosed_skipped_elements_end_with_their_parent(self):
+        text = reduce('<ul><li class="menu">Home<li class="menu">About</ul><p>Article text</p>')
+        self.assertEqual(text, 'Article text')
+
+    def test_implied_end_tags(self):
+        text = reduce('<ul><li class="menu">Menu<li>First point<li>Second point</ul>'
+                      '<table><tr><td class="ads">Ad<td>Cell<tr><td>Next row</table><p>After')
+        self.assertEqual(text, 'First point\n\nSecond point\n\nCell\n\nNext row\n\nAfter')
+
+    def test_nested_skipped_elements(self):
+        text = reduce('<div class="sidebar"><div><div>Deep</div></div>Still sidebar</div><p>Main</p>')
+        self.assertEqual(text, 'Main')
+
+    def test_stray_end_tags_are_ignored(self):
+        self.assertEqual(reduce('</div></li><p>Text</p></span>'), 'Text')
+
+    def test_skips_link_lists_and_repeats(self):
+        text = reduce('<div><a href="a">One</a> <a href="b">Two</a></div><p>Kept</p><p>Kept</p>')
+        self.assertEqual(text, 'Kept')
+
+    def test_budget(self):
+        reducer = server.ContentReducer(max_chars=30)
+        reducer.feed(ARTICLE)
+        self.assertEqual(len(reducer.text()), 30)
+        self.assertTrue(reducer.truncated)
+
+
+class FormatPageTest(unittest.TestCase):
+
+    def test_keeps_the_article_inside_hyphenated_wrappers(self):
+        html = (f'<body><div class="site-content has-sidebar"><article>{ARTICLE}</article></div>'
+                f'<div class="widget-area">{SIDEBAR}</div></body>')
+        text = reduce(html, max_chars=0)
+        content, source = server.format_page({'url': 'https://example.com'}, text, [html])
+
+        self.assertEqual(source, 'html')
+        self.assertIn('Paragraph 199 of the article', content)
+
+    def test_falls_back_to_text_when_the_html_yields_little(self):
+        html = f'<body><div class="menu"><article>{ARTICLE}</article></div><p>{"Short note. " * 20}</p></body>'
+        text = reduce(html.replace('class="menu"', ''), max_chars=0)
+        content, source = server.format_page({}, text, [html])
+
+        self.assertEqual(source, 'text')
+        self.assertIn('Paragraph 199 of the article', content)
+
+    def test_compares_with_the_budget_for_long_pages(self):
+        content, source = server.format_page({}, reduce(ARTICLE, max_chars=0), [ARTICLE], max_chars=1000)
+        self.assertEqual(source, 'html')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""SimHash fingerprints and the banded similarity index"""
+
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests.support import server
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi".split()
+
+
+def page(seed, words=400):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def flip(fingerprint, *bits):
+    for bit in bits:
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+class SimhashTest(unittest.TestCase):
+
+    def test_counts_shingles(self):
+        self.assertEqual(server.simhash('one two three four five')[1], 3)
+        self.assertEqual(server.simhash('one two')[1], 1)
+
+    def test_ignores_case_and_punctuation(self):
+        self.assertEqual(server.simhash('Hello, World! How are you?'), server.simhash('hello world how are you'))
+
+    def test_small_edit_moves_few_bits(self):
+        text = page(1)
+        edited = text.replace(text.split()[200], 'changed', 1)
+        distance = bin(server.simhash(text)[0] ^ server.simhash(edited)[0]).count('1')
+        self.assertLessEqual(distance, 6)
+
+    def test_unrelated_pages_are_far_apart(self):
+        distance = bin(server.simhash(page(1))[0] ^ server.simhash(page(2))[0]).count('1')
+        self.assertGreater(distance, 10)
+
+
+class SimilarityIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = server.ResultStore(Path(self.directory.name) / 'results.db')
+        self.index = server.SimilarityIndex(self.store, max_distance=3)
+        self.index.load()
+        self.fingerprint = server.simhash(page(1))[0]
+        self.index.add('original', self.fingerprint, 'Summarize')
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_short_content_has_no_fingerprint(self):
+        self.assertIsNone(self.index.fingerprint('too short to compare'))
+        self.assertIsNotNone(self.index.fingerprint(page(1)))
+
+    def test_finds_entries_up_to_max_distance(self):
+        self.assertEqual(self.index.lookup(self.fingerprint, 'Summarize'), ('original', 0))
+        # One flipped bit in each of three bands leaves the fourth band to match on
+        self.assertEqual(self.index.lookup(flip(self.fingerprint, 0, 16, 32), 'Summarize'), ('original', 3))
+        self.assertEqual(self.index.lookup(flip(self.fingerprint, 0, 1, 2), 'Summarize'), ('original', 3))
+
+    def test_misses_entries_past_max_distance(self):
+        self.assertIsNone(self.index.lookup(flip(self.fingerprint, 0, 16, 32, 48), 'Summarize'))
+        self.assertIsNone(self.index.lookup(flip(self.fingerprint, 0, 1, 2, 3), 'Summarize'))
+
+    def test_prefers_the_closest_entry(self):
+        self.index.add('closer', flip(self.fingerprint, 5), 'Summarize')
+        self.assertEqual(self.index.lookup(flip(self.fingerprint, 5, 6), 'Summarize'), ('closer', 1))
+
+    def test_prompt_must_match(self):
+        self.assertIsNone(self.index.lookup(self.fingerprint, 'Translate'))
+        self.assertEqual(self.index.lookup(self.fingerprint, '  summarize '), ('original', 0))
+
+    def test_reloads_from_the_store(self):
+        index = server.SimilarityIndex(self.store, max_distance=3)
+        index.load()
+        self.assertEqual(index.lookup(flip(self.fingerprint, 7), 'Summarize'), ('original', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
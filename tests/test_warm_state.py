@@ -0,0 +1,72 @@
+"""Saving and loading the binary warm-state snapshot"""
+
+import hashlib
+import struct
+import tempfile
+import unittest
+import zlib
+from pathlib import Path
+
+from tests.support import server
+
+
+def cache_entry(number):
+    return hashlib.sha256(str(number).encode()).hexdigest(), f"request-{number}", 1700000000.5 + number
+
+
+def similarity_entry(number):
+    return f"page-{number}-é", (0xfedcba9876543210 * (number + 1)) & ((1 << 64) - 1), f"{number:016x}", 1700000000.25
+
+
+class WarmStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'warm-state.bin'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def save(self, cache_entries=(), similarity_entries=(), saved_at=1700000123.75):
+        server.save_warm_state(self.path, saved_at, list(cache_entries), list(similarity_entries))
+        return self.path.read_bytes()
+
+    def test_round_trip(self):
+        cache_entries = [cache_entry(number) for number in range(50)]
+        similarity_entries = [similarity_entry(number) for number in range(80)]
+        self.save(cache_entries, similarity_entries)
+
+        self.assertEqual(server.load_warm_state(self.path), (1700000123.75, cache_entries, similarity_entries))
+        self.assertFalse(self.path.with_suffix('.tmp').exists())
+
+    def test_round_trip_empty(self):
+        self.save()
+        self.assertEqual(server.load_warm_state(self.path), (1700000123.75, [], []))
+
+    def test_missing_file(self):
+        self.assertIsNone(server.load_warm_state(self.path))
+
+    def test_corrupt_files_are_ignored(self):
+        data = self.save([cache_entry(1)], [similarity_entry(1)])
+        header = len(server.WARM_STATE_MAGIC) + struct.calcsize('<Hd')
+        flipped = bytearray(data)
+        flipped[header + 5] ^= 0xff
+
+        corrupt = {
+            'empty': b'',
+            'garbage': b'not a snapshot at all',
+            'wrong magic': b'XXXX' + data[4:],
+            'newer version': data[:4] + struct.pack('<H', server.WARM_STATE_VERSION + 1) + data[6:],
+            'truncated header': data[:header - 3],
+            'truncated body': data[:-4],
+            'flipped body byte': bytes(flipped),
+            'counts past the end': data[:header] + zlib.compress(struct.pack('<II', 3, 0) + b'\0' * 10),
+        }
+        for name, content in corrupt.items():
+            with self.subTest(name):
+                self.path.write_bytes(content)
+                self.assertIsNone(server.load_warm_state(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
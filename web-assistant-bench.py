@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the Web Page Assistant Server
+Replays the userscript's chunk protocol for many synthetic pages against an in-process server,
+with fake ChatGPT connectors answering from /content and browser opening stubbed out,
+or with the server's mock completion backend answering in place of the connectors
+"""
+
+import argparse
+import contextlib
+import gzip
+import http.client
+import importlib.util
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+from colorama import init, Fore, Style
+
+# Initialize colorama for colored terminal output
+init()
+
+WORDS = ("page content analysis assistant server request chunk browser connector result prompt "
+         "market report summary details product price review update release change section "
+         "table figure example method value system network service user account").split()
+
+
+def load_server_module():
+    """Import web-assistant-server.py, whose file name isn't a valid module name"""
+    path = Path(__file__).resolve().parent / "web-assistant-server.py"
+    spec = importlib.util.spec_from_file_location("web_assistant_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_page(index, size, rng, unique=True):
+    """Synthetic page content shaped like extractPageContent() in the userscript"""
+    paragraphs = []
+    length = 0
+    while length < size:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))).capitalize() + '.'
+        paragraphs.append(sentence)
+        length += len(sentence) + 1
+
+    if unique:
+        paragraphs[0] = f"Page {index}. " + paragraphs[0]
+
+    text = '\n'.join(paragraphs)
+    navigation = ''.join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(20))
+    html = (f'<html><head><title>Page {index}</title><script>var tracking = {index};</script></head><body>'
+            f'<nav><ul>{navigation}</ul></nav><main>'
+            + ''.join(f'<p>{p}</p>' for p in paragraphs) +
+            '</main><footer>Copyright</footer></body></html>')
+
+    return {
+        'url': f'https://example.com/page/{index}',
+        'title': f'Page {index}',
+        'text': text,
+        'html': html,
+        'description': f'Synthetic page {index}'
+    }
+
+
+def chunk_content(content, chunk_size):
+    """Split content the same way chunkContent() does in the userscript"""
+    if len(json.dumps(content)) <= chunk_size:
+        return [{'type': 'complete', 'content': content}]
+
+    chunks = []
+    metadata = {'url': content['url'], 'title': content['title'], 'description': content.get('description', '')}
+
+    text_chunk_size = chunk_size // 2
+    text = content['text']
+    pieces = [text[i:i + text_chunk_size] for i in range(0, len(text), text_chunk_size)] or ['']
+    for i, piece in enumerate(pieces):
+        chunks.append({
+            'type': 'text',
+            'chunkIndex': i,
+            'totalChunks': len(pieces),
+            'metadata': metadata if i == 0 else {'url': content['url']},
+            'content': piece
+        })
+
+    html = content['html']
+    pieces = [html[i:i + chunk_size] for i in range(0, len(html), chunk_size)]
+    for i, piece in enumerate(pieces):
+        chunks.append({
+            'type': 'html',
+            'chunkIndex': i,
+            'totalChunks': len(pieces),
+            'metadata': {'url': content['url']},
+            'content': piece
+        })
+
+    return chunks
+
+
+# One persistent connection per thread, like a browser reusing its keep-alive connections
+_connections = threading.local()
+
+
+def encode_body(data, compress=False):
+    """JSON-encode a request body, gzipped like the userscripts do; returns (body, headers)"""
+    body = json.dumps(data).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if compress:
+        body = gzip.compress(body, compresslevel=5)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+
+def send_request(base_url, path, body=None, headers=None, timeout=60, keep_alive=True):
+    """Send a request and return (status, parsed JSON body)"""
+    headers = dict(headers or {}, **{'Accept-Encoding': 'gzip'})
+    if not keep_alive:
+        headers['Connection'] = 'close'
+
+    for attempt in range(2):
+        connection = getattr(_connections, 'connection', None)
+        if connection is None:
+            url = urllib.parse.urlsplit(base_url)
+            connection = _connections.connection = http.client.HTTPConnection(url.hostname, url.port)
+        reused = connection.sock is not None
+        connection.timeout = timeout
+        if reused:
+            connection.sock.settimeout(timeout)
+
+        try:
+            connection.request('POST' if body is not None else 'GET', path, body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+            break
+        except (http.client.HTTPException, OSError) as e:
+            connection.close()
+            _connections.connection = None
+            # The server may have closed an idle connection just as it was reused; retry once, as browsers do
+            if not (reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError,
+                                              BrokenPipeError))) or attempt:
+                raise OSError(f"{path}: {e}") from e
+
+    if response.will_close or not keep_alive:
+        connection.close()
+        _connections.connection = None
+    if response.getheader('Content-Encoding') == 'gzip':
+        payload = gzip.decompress(payload)
+
+    try:
+        return response.status, json.loads(payload or b'null')
+    except ValueError:
+        return response.status, None
+
+
+def request_json(base_url, path, data=None, timeout=60, compress=False, keep_alive=True):
+    """Send a JSON request and return (status, parsed JSON body)"""
+    body, headers = encode_body(data, compress) if data is not None else (None, None)
+    return send_request(base_url, path, body, headers, timeout=timeout, keep_alive=keep_alive)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (server and load generator together)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Benchmark:
+    """Drives one LocalServer with synthetic pages, connectors and result pollers"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies = []
+        self.upload_bytes = 0
+        self.failures = 0
+        self.busy_retries = 0
+        self.lock = threading.Lock()
+        self.stop_connectors = threading.Event()
+        self.port = args.port or self._free_port()
+        self.base_url = f"http://localhost:{self.port}"
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as sock:
+            sock.bind(('', 0))
+            return sock.getsockname()[1]
+
+    def run(self):
+        module = load_server_module()
+
+        with tempfile.TemporaryDirectory(prefix='web-assistant-bench-') as cache_dir:
+            server = module.LocalServer(
+                port=self.port,
+                workers=self.args.workers,
+                cache_ttl=86400 if self.args.cache else 0,
+                cache_dir=cache_dir,
+                max_in_flight=self.args.max_in_flight,
+                retry_after=1,
+                backend=self.args.backend,
+                backend_concurrency=self.args.connectors,
+                mock_latency=self.args.think_time
+            )
+            # Connectors are simulated, never open a real browser
+            server.open_browser_in_background = lambda url, view_in_chatgpt=False: True
+
+            output = sys.stdout if self.args.verbose else open(os.devnull, 'w')
+            with contextlib.redirect_stdout(output):
+                server_thread = threading.Thread(target=server.start, daemon=True)
+                server_thread.start()
+                self._wait_for_server()
+                report = self._run_load()
+                report['server'] = request_json(self.base_url, '/status')[1]
+                server.server.shutdown()
+                # Let the server save its state before the cache directory goes away
+                server_thread.join(timeout=10)
+
+        return report
+
+    def _wait_for_server(self):
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                if request_json(self.base_url, '/status', timeout=1)[0] == 200:
+                    return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError(f"Server did not start on port {self.port}")
+
+    def _run_load(self):
+        pages = [chunk_content(make_page(i, self.args.page_size * 1024, self.rng, unique=not self.args.cache),
+                               self.args.chunk_size)
+                 for i in range(self.args.pages)]
+
+        # The mock backend answers inside the server, so only the browser backend needs fake connectors
+        connector_count = self.args.connectors if self.args.backend == 'browser' else 0
+        connectors = [threading.Thread(target=self._connector, daemon=True) for _ in range(connector_count)]
+        for connector in connectors:
+            connector.start()
+
+        next_page = iter(range(len(pages)))
+        next_page_lock = threading.Lock()
+
+        def client():
+            while True:
+                with next_page_lock:
+                    index = next(next_page, None)
+                if index is None:
+                    return
+                self._analyze_page(f"bench-{index}-{time.time()}", pages[index])
+
+        start = time.time()
+        clients = [threading.Thread(target=client) for _ in range(self.args.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.time() - start
+
+        self.stop_connectors.set()
+        for connector in connectors:
+            connector.join(timeout=5)
+
+        return {
+            'backend': self.args.backend,
+            'pages': self.args.pages,
+            'failures': self.failures,
+            'busyRetries': self.busy_retries,
+            'elapsed': elapsed,
+            'throughput': len(self.latencies) / elapsed if elapsed else 0.0,
+            'uploadMB': self.upload_bytes / (1024 * 1024),
+            'p50': percentile(self.latencies, 0.50),
+            'p99': percentile(self.latencies, 0.99),
+            'max': max(self.latencies, default=0.0),
+            'peakRssMB': peak_rss_mb()
+        }
+
+    def _analyze_page(self, request_id, chunks):
+        """Upload a page like the userscript does, then long-poll for the answer"""
+        start = time.time()
+        try:
+            for index, chunk in enumerate(chunks):
+                data = {
+                    'requestId': request_id,
+                    'prompt': self.args.prompt,
+                    'chunkIndex': index,
+                    'totalChunks': len(chunks),
+                    'isLastChunk': index == len(chunks) - 1,
+                    'viewInChatGPT': False,
+                    'chunk': chunk
+                }
+                body, headers = encode_body(data, compress=not self.args.plain)
+                status, result = send_request(self.base_url, '/analyze', body, headers, keep_alive=not self.args.plain)
+                # Back off while admission control turns the page away, as the userscript does
+                while status in (429, 503) and time.time() < start + self.args.result_timeout:
+                    with self.lock:
+                        self.busy_retries += 1
+                    time.sleep((result or {}).get('retryAfter') or 1)
+                    status, result = send_request(self.base_url, '/analyze', body, headers,
+                                                  keep_alive=not self.args.plain)
+                if status != 200:
+                    raise RuntimeError(f"/analyze returned {status}")
+                with self.lock:
+                    self.upload_bytes += len(body)
+
+            deadline = start + self.args.result_timeout
+            while time.time() < deadline:
+                status, result = request_json(self.base_url, f'/results/{request_id}?wait=30', timeout=40,
+                                              keep_alive=not self.args.plain)
+                if status == 200:
+                    with self.lock:
+                        self.latencies.append(time.time() - start)
+                    return
+                if status != 404:
+                    raise RuntimeError(f"/results returned {status}")
+            raise RuntimeError("timed out waiting for the result")
+
+        except (OSError, RuntimeError) as e:
+            with self.lock:
+                self.failures += 1
+            print(f"{Fore.RED}Request {request_id} failed: {e}{Style.RESET_ALL}", file=sys.stderr)
+
+    def _connector(self):
+        """Fake ChatGPT connector tab: lease content, 'think', post a response"""
+        while not self.stop_connectors.is_set():
+            try:
+                status, job = request_json(self.base_url, '/content?wait=1&pool=1', timeout=10,
+                                           keep_alive=not self.args.plain)
+            except OSError:
+                continue
+            if status != 200:
+                continue
+
+            time.sleep(self.args.think_time)
+            request_json(self.base_url, '/response', {
+                'requestId': job['requestId'],
+                'response': f"Summary of {len(job['content'])} characters for prompt: {job['prompt']}"
+            }, compress=not self.args.plain, keep_alive=not self.args.plain)
+
+
+def print_report(report):
+    print(f"\n{Fore.GREEN}{'=' * 80}{Style.RESET_ALL}")
+    print(f"{Fore.CYAN}Web Page Assistant Server benchmark{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}{'-' * 80}{Style.RESET_ALL}")
+    print(f"{Fore.YELLOW}Backend:{Style.RESET_ALL} {report['backend']}")
+    print(f"{Fore.YELLOW}Pages:{Style.RESET_ALL} {report['pages']} ({report['failures']} failed, {report['busyRetries']} busy retries)")
+    print(f"{Fore.YELLOW}Elapsed:{Style.RESET_ALL} {report['elapsed']:.2f} seconds")
+    print(f"{Fore.YELLOW}Throughput:{Style.RESET_ALL} {report['throughput']:.2f} pages/s")
+    print(f"{Fore.YELLOW}Uploaded:{Style.RESET_ALL} {report['uploadMB']:.2f} MB")
+    print(f"{Fore.YELLOW}Latency p50:{Style.RESET_ALL} {report['p50'] * 1000:.1f} ms")
+    print(f"{Fore.YELLOW}Latency p99:{Style.RESET_ALL} {report['p99'] * 1000:.1f} ms")
+    print(f"{Fore.YELLOW}Latency max:{Style.RESET_ALL} {report['max'] * 1000:.1f} ms")
+    print(f"{Fore.YELLOW}Peak RSS:{Style.RESET_ALL} {report['peakRssMB']:.1f} MB (server and load generator)")
+    print(f"{Fore.GREEN}{'=' * 80}{Style.RESET_ALL}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Web Page Assistant Server load benchmark")
+    parser.add_argument("--pages", type=int, default=200, help="Number of synthetic pages to analyze")
+    parser.add_argument("--page-size", type=int, default=200, help="Text size of each page, in KB")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Chunk size used by the userscript")
+    parser.add_argument("--concurrency", type=int, default=8, help="Pages analyzed at the same time")
+    parser.add_argument("--backend", choices=['browser', 'mock'], default='browser',
+                        help="Answer with fake ChatGPT connector tabs or the server's mock backend")
+    parser.add_argument("--connectors", type=int, default=4,
+                        help="Number of fake ChatGPT connector tabs, or mock backend concurrency")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Seconds a fake connector or the mock backend takes to answer")
+    parser.add_argument("--workers", type=int, default=16, help="Server worker threads")
+    parser.add_argument("--max-in-flight", type=int, default=50,
+                        help="Server admission limit on pages in progress")
+    parser.add_argument("--cache", action="store_true",
+                        help="Send identical pages with the response cache enabled")
+    parser.add_argument("--plain", action="store_true",
+                        help="Send uncompressed bodies on a new connection per request, like older userscripts")
+    parser.add_argument("--prompt", default="Summarize this page", help="Prompt sent with every page")
+    parser.add_argument("--result-timeout", type=float, default=120, help="Seconds to wait for each result")
+    parser.add_argument("--port", type=int, default=0, help="Port for the server (default: a free port)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the synthetic pages")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show the server's console output")
+
+    args = parser.parse_args()
+
+    report = Benchmark(args).run()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == "__main__":
+    main()
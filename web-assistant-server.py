@@ -5,61 +5,2185 @@ Handles page content with chunking, optional prompts, and background tab option
 """
 
 import argparse
+import contextlib
+import difflib
+import gzip
+import hashlib
+import heapq
+import html.parser
+import http.client
 import http.server
+import itertools
 import json
+import math
 import socketserver
+import sqlite3
+import struct
 import threading
 import time
 import webbrowser
 import urllib.parse
+import zlib
 import os
+import queue
+import re
+import signal
 import sys
 import subprocess
+import tempfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from colorama import init, Fore, Style
 
+try:
+    # Optional zstd Content-Encoding (Python 3.14+, or the zstandard package)
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
 # Initialize colorama for colored terminal output
 init()
 
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+
+def inflate_zstd(data, max_length):
+    """Decompress a zstd frame, stopping once max_length bytes have come out"""
+    if zstd.__name__ == 'zstandard':
+        pieces, size = [], 0
+        with zstd.ZstdDecompressor().stream_reader(data) as reader:
+            while size < max_length:
+                piece = reader.read(max_length - size)
+                if not piece:
+                    break
+                pieces.append(piece)
+                size += len(piece)
+        return b''.join(pieces)
+    return zstd.ZstdDecompressor().decompress(data, max_length)
+
+
+class AdmissionError(Exception):
+    """A request refused by admission control, with the HTTP status and Retry-After seconds to answer with"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class SnapshotMismatch(Exception):
+    """A delta upload refers to blocks the server no longer has; the page must be uploaded in full"""
+
+
+class ThreadPoolServer(socketserver.TCPServer):
+    """TCP server that hands each connection to a fixed pool of worker threads"""
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler, workers=16):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='web-assistant-worker')
+        super().__init__(server_address, handler)
+
+        self.connections = 0  # Accepted connections not yet closed, including those waiting for a worker
+        self.connections_lock = threading.Lock()
+
+    @property
+    def busy(self):
+        """True when connections are waiting for a worker, so kept-alive ones should be released"""
+        return self.connections > self.workers
+
+    def process_request(self, request, client_address):
+        # Queue the connection instead of handling it on the accept loop
+        with self.connections_lock:
+            self.connections += 1
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.connections_lock:
+                self.connections -= 1
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RequestStore:
+    """Thread-safe store of requests with entry/byte limits and per-status expiry"""
+
+    # Statuses whose results are already saved to disk, evicted first when over budget
+    FINISHED_STATUSES = ('completed', 'error')
+
+    def __init__(self, max_entries=500, max_bytes=200 * 1024 * 1024, ttls=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Seconds an entry may stay untouched in each status before it is evicted
+        self.ttls = {
+            'receiving': 120,
+            'complete': 600,
+            'pending_chatgpt': 600,
+            'completed': 600,
+            'error': 600
+        }
+        self.ttls.update(ttls or {})
+
+        self.lock = threading.RLock()
+        self._entries = OrderedDict()  # request_id -> entry, least recently touched first
+        self._sizes = {}
+        self._touched = {}
+        self.total_bytes = 0
+        self.evicted = 0
+
+    def __contains__(self, request_id):
+        with self.lock:
+            return request_id in self._entries
+
+    def __getitem__(self, request_id):
+        with self.lock:
+            return self._entries[request_id]
+
+    def __setitem__(self, request_id, entry):
+        with self.lock:
+            self._entries[request_id] = entry
+            self.touch(request_id)
+
+    def __delitem__(self, request_id):
+        with self.lock:
+            self._remove(request_id)
+
+    def __len__(self):
+        with self.lock:
+            return len(self._entries)
+
+    def get(self, request_id, default=None):
+        with self.lock:
+            return self._entries.get(request_id, default)
+
+    def items(self):
+        with self.lock:
+            return list(self._entries.items())
+
+    def touch(self, request_id):
+        """Record that an entry changed, re-measuring its size and enforcing the limits"""
+        with self.lock:
+            entry = self._entries.get(request_id)
+            if entry is None:
+                return
+            size = _estimate_size(entry)
+            self.total_bytes += size - self._sizes.get(request_id, 0)
+            self._sizes[request_id] = size
+            self._touched[request_id] = time.time()
+            self._entries.move_to_end(request_id)
+            self._enforce_limits(keep=request_id)
+
+    def evict_expired(self, now=None):
+        """Drop entries that outlived the TTL of their status and return them by request ID"""
+        now = now or time.time()
+        with self.lock:
+            expired = {request_id: entry for request_id, entry in self._entries.items()
+                       if now - self._touched[request_id] > self.ttls.get(entry.get('status'), self.ttls['completed'])}
+            for request_id in expired:
+                self._remove(request_id)
+            self.evicted += len(expired)
+            return expired
+
+    def stats(self):
+        """Current size of the store"""
+        with self.lock:
+            by_status = {}
+            for entry in self._entries.values():
+                by_status[entry.get('status')] = by_status.get(entry.get('status'), 0) + 1
+
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'maxEntries': self.max_entries,
+                'maxBytes': self.max_bytes,
+                'byStatus': by_status,
+                'evicted': self.evicted
+            }
+
+    def _enforce_limits(self, keep=None):
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            candidates = [request_id for request_id in self._entries if request_id != keep]
+            if not candidates:
+                break
+
+            # Finished results can be reloaded from disk, so they go before in-flight requests
+            finished = [request_id for request_id in candidates
+                        if self._entries[request_id].get('status') in self.FINISHED_STATUSES]
+            self._remove((finished or candidates)[0])
+            self.evicted += 1
+
+    def _remove(self, request_id):
+        if request_id not in self._entries:
+            return
+        assembler = self._entries.pop(request_id).get('assembler')
+        if assembler is not None:
+            assembler.close()
+        del self._touched[request_id]
+        self.total_bytes -= self._sizes.pop(request_id, 0)
+
+
+class ChunkAssembler:
+    """Assembles a request's chunks as they arrive, in any order
+
+    Text and HTML are appended to spooled buffers as soon as a chunk arrives, and a bitmap
+    records which chunk indexes have been received so clients can resume an upload.
+    """
+
+    def __init__(self, total_chunks, spool_size=1024 * 1024):
+        self.total_chunks = total_chunks
+        self.spool_size = spool_size
+        self.metadata = {}
+        self.received_count = 0
+        self.bytes_received = 0
+
+        self.lock = threading.Lock()
+        self._bitmap = bytearray((total_chunks + 7) // 8)
+        self._text = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._html = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._text_ranges = {}  # chunk index -> (offset, length) in the text buffer
+        self._html_ranges = {}
+
+    @property
+    def complete(self):
+        return self.received_count == self.total_chunks
+
+    @property
+    def memory_bytes(self):
+        """Bytes held in memory; buffers roll over to disk past spool_size"""
+        text_bytes = sum(length for _, length in self._text_ranges.values())
+        html_bytes = sum(length for _, length in self._html_ranges.values())
+        return sum(size if size <= self.spool_size else 0 for size in (text_bytes, html_bytes))
+
+    def has(self, chunk_index):
+        return bool(self._bitmap[chunk_index >> 3] & (1 << (chunk_index & 7)))
+
+    def add(self, chunk_index, chunk):
+        """Store a chunk; returns False if it was already received"""
+        if not 0 <= chunk_index < self.total_chunks:
+            raise ValueError(f"Chunk index {chunk_index} out of range for {self.total_chunks} chunks")
+
+        with self.lock:
+            if self.has(chunk_index):
+                return False
+
+            if chunk_index == 0:
+                if 'metadata' in chunk:
+                    self.metadata = chunk['metadata']
+                elif chunk.get('type') == 'complete':
+                    # Single complete content chunk
+                    self.metadata = {
+                        'url': chunk['content'].get('url', ''),
+                        'title': chunk['content'].get('title', '')
+                    }
+
+            if chunk.get('type') == 'text':
+                self._append(self._text, self._text_ranges, chunk_index, chunk.get('content', ''))
+            elif chunk.get('type') == 'html':
+                self._append(self._html, self._html_ranges, chunk_index, chunk.get('content', ''))
+            elif chunk.get('type') == 'complete':
+                self._append(self._text, self._text_ranges, chunk_index, chunk['content'].get('text', ''))
+                self._append(self._html, self._html_ranges, chunk_index, chunk['content'].get('html') or '')
+
+            self._bitmap[chunk_index >> 3] |= 1 << (chunk_index & 7)
+            self.received_count += 1
+            return True
+
+    def missing(self):
+        """Ranges of chunk indexes not yet received, as [start, end] pairs (inclusive)"""
+        ranges = []
+        with self.lock:
+            start = None
+            for chunk_index in range(self.total_chunks):
+                if not self.has(chunk_index):
+                    if start is None:
+                        start = chunk_index
+                elif start is not None:
+                    ranges.append([start, chunk_index - 1])
+                    start = None
+            if start is not None:
+                ranges.append([start, self.total_chunks - 1])
+        return ranges
+
+    def text(self):
+        """Text content of all received chunks in chunk order"""
+        pieces = []
+        with self.lock:
+            for chunk_index in sorted(self._text_ranges):
+                offset, length = self._text_ranges[chunk_index]
+                self._text.seek(offset)
+                pieces.append(self._text.read(length).decode('utf-8'))
+        return ''.join(pieces)
+
+    def iter_html(self):
+        """HTML content of all received chunks in chunk order, one chunk at a time"""
+        for chunk_index in sorted(self._html_ranges):
+            with self.lock:
+                offset, length = self._html_ranges[chunk_index]
+                self._html.seek(offset)
+                data = self._html.read(length)
+            yield data.decode('utf-8')
+
+    def close(self):
+        with self.lock:
+            self._text.close()
+            self._html.close()
+
+    def _append(self, buffer, ranges, chunk_index, content):
+        if not content:
+            return
+        data = content.encode('utf-8')
+        buffer.seek(0, os.SEEK_END)
+        ranges[chunk_index] = (buffer.tell(), len(data))
+        buffer.write(data)
+        self.bytes_received += len(data)
+
+
+class ContentReducer(html.parser.HTMLParser):
+    """Streaming HTML-to-text extractor that keeps the main content of a page
+
+    Scripts, styles, navigation, footers and other boilerplate are dropped, blocks made mostly
+    of links (menus) are skipped, repeated blocks are kept once, and output stops at max_chars.
+    HTML can be fed in arbitrary pieces, so chunks are parsed as they are read.
+    """
+
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe', 'head', 'nav',
+                 'footer', 'header', 'aside', 'form', 'button', 'select', 'dialog'}
+    BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'table',
+                  'tr', 'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'figcaption',
+                  'br', 'hr', 'body'}
+    VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source',
+                 'track', 'wbr'}
+    SKIP_ROLES = {'navigation', 'banner', 'contentinfo', 'complementary', 'search', 'menu', 'dialog'}
+    BOILERPLATE_WORDS = (r'nav|navbar|menu|footer|header|sidebar|breadcrumbs?|cookies?|banner|advert|ads?|social|'
+                         r'share|sharing|popup|modal|newsletter|subscribe|related|comments?')
+    # A class or id token is boilerplate when it is made only of those words, like "menu" or "cookie-banner";
+    # "site-content" or "has-sidebar" are not
+    BOILERPLATE_PATTERN = re.compile(rf'(?:{BOILERPLATE_WORDS})(?:[_-]+(?:{BOILERPLATE_WORDS}))*', re.IGNORECASE)
+    # Containers of the main content, never skipped whatever their attributes say
+    CONTENT_TAGS = {'html', 'body', 'main', 'article'}
+    # Start tags that close an open element implicitly (<li> closes the previous <li>), unless one of the
+    # listed containers is open inside it
+    IMPLIED_END = {
+        'li': ({'li'}, {'ul', 'ol', 'menu'}),
+        'dt': ({'dt', 'dd'}, {'dl'}),
+        'dd': ({'dt', 'dd'}, {'dl'}),
+        'tr': ({'tr'}, {'table', 'thead', 'tbody', 'tfoot'}),
+        'td': ({'td', 'th'}, {'tr', 'table'}),
+        'th': ({'td', 'th'}, {'tr', 'table'}),
+        'option': ({'option'}, {'select', 'datalist'})
+    }
+
+    def __init__(self, max_chars=50000):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.truncated = False
+
+        self._blocks = []
+        self._seen = set()
+        self._length = 0
+        self._current = []
+        self._link_chars = 0
+        self._link_depth = 0
+        self._open = []  # Tags of the open elements, outermost first
+        self._skip_level = None  # Position in _open of the element whose subtree is being skipped
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.IMPLIED_END:
+            closes, containers = self.IMPLIED_END[tag]
+            for position in range(len(self._open) - 1, -1, -1):
+                if self._open[position] in containers:
+                    break
+                if self._open[position] in closes:
+                    self._close(position)
+                    break
+        if tag in self.BLOCK_TAGS and self._open and self._open[-1] == 'p':
+            # A block start closes an open paragraph
+            self._close(len(self._open) - 1)
+
+        if tag in self.VOID_TAGS:
+            if tag in self.BLOCK_TAGS and self._skip_level is None:
+                self._flush()
+            return
+
+        self._open.append(tag)
+        if tag == 'a':
+            self._link_depth += 1
+        if self._skip_level is not None:
+            return
+
+        if self._is_boilerplate(tag, attrs):
+            self._flush()
+            self._skip_level = len(self._open) - 1
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        # An end tag closes its element and any element left open inside it; stray end tags are ignored
+        for position in range(len(self._open) - 1, -1, -1):
+            if self._open[position] == tag:
+                self._close(position)
+                return
+
+    def handle_data(self, data):
+        if self._skip_level is not None or self.truncated:
+            return
+        self._current.append(data)
+        if self._link_depth:
+            self._link_chars += len(data.strip())
+
+    def text(self):
+        """Finish parsing and return the extracted text"""
+        self.close()
+        self._flush()
+        return '\n\n'.join(self._blocks)
+
+    def _close(self, position):
+        """Close the element at `position` in _open and every element inside it"""
+        if position == len(self._open) - 1:
+            closed = (self._open.pop(),)  # The usual case: an end tag for the innermost element
+        else:
+            closed = self._open[position:]
+            del self._open[position:]
+        self._link_depth -= closed.count('a')
+
+        if self._skip_level is not None:
+            if position <= self._skip_level:
+                self._skip_level = None
+        elif not self.BLOCK_TAGS.isdisjoint(closed):
+            self._flush()
+
+    def _is_boilerplate(self, tag, attrs):
+        if tag in self.CONTENT_TAGS:
+            return False
+        if tag in self.SKIP_TAGS:
+            return True
+        attrs = dict(attrs)
+        if attrs.get('role') in self.SKIP_ROLES or 'hidden' in attrs or attrs.get('aria-hidden') == 'true':
+            return True
+        tokens = f"{attrs.get('id') or ''} {attrs.get('class') or ''}".split()
+        return any(self.BOILERPLATE_PATTERN.fullmatch(token) for token in tokens)
+
+    def _flush(self):
+        block = ' '.join(''.join(self._current).split())
+        link_chars = self._link_chars
+        self._current = []
+        self._link_chars = 0
+
+        # Skip empty blocks and blocks that are mostly links, like menus and tag clouds
+        if not block or self.truncated or link_chars > 0.6 * len(block):
+            return
+
+        # Keep repeated blocks only once
+        key = block.lower()
+        if key in self._seen:
+            return
+        self._seen.add(key)
+
+        if self.max_chars and self._length + len(block) > self.max_chars:
+            block = block[:max(self.max_chars - self._length, 0)]
+            self.truncated = True
+            if not block:
+                return
+
+        self._blocks.append(block)
+        self._length += len(block) + 2
+
+
+def reduce_text(text, max_chars=50000):
+    """Apply the ContentReducer's de-duplication and budget to plain text, one block per line"""
+    blocks, seen, length = [], set(), 0
+    for line in text.splitlines():
+        block = ' '.join(line.split())
+        if not block or block.lower() in seen:
+            continue
+        seen.add(block.lower())
+        if max_chars and length + len(block) > max_chars:
+            blocks.append(block[:max(max_chars - length, 0)])
+            break
+        blocks.append(block)
+        length += len(block) + 1
+    return '\n'.join(blocks)
+
+
+MIN_HTML_SHARE = 0.3  # Content extracted from the HTML must be at least this share of the visible text
+
+
+def format_page(metadata, text, html_pieces, max_chars=50000):
+    """Format a page for ChatGPT: metadata header plus the reduced main content.
+
+    Returns (formatted content, 'html' or 'text' depending on where the content came from).
+    """
+    parts = [
+        f"URL: {metadata.get('url', '')}\n",
+        f"Title: {metadata.get('title', '')}\n\n"
+    ]
+
+    if metadata.get('description'):
+        parts.append(f"Description: {metadata.get('description')}\n\n")
+
+    # Main content extracted from the HTML, or the page's visible text if there is no HTML or it
+    # yields only a small part of that text (pages rendered into canvas, unusual markup, content
+    # wrapped in elements that look like boilerplate)
+    reducer = ContentReducer(max_chars)
+    for piece in html_pieces:
+        reducer.feed(piece)
+    main_content = reducer.text()
+
+    visible = ' '.join(text.split())
+    if len(main_content) >= MIN_HTML_SHARE * min(len(visible), max_chars or len(visible)):
+        source = 'html'
+    else:
+        source = 'text'
+        main_content = reduce_text(text, max_chars)
+    parts.append(main_content)
+
+    return ''.join(parts), source
+
+
+CHARS_PER_TOKEN = 4  # Rough average for English text
+
+
+def split_into_segments(text, max_chars):
+    """Split text into pieces of at most max_chars, breaking at paragraph, line or sentence boundaries"""
+    segments, current, length = [], [], 0
+    for block in _split_blocks(text, max_chars):
+        if current and length + len(block) > max_chars:
+            segments.append(''.join(current))
+            current, length = [], 0
+        current.append(block)
+        length += len(block)
+
+    if current:
+        segments.append(''.join(current))
+    return segments
+
+
+def pack_documents(sizes, budget, max_documents):
+    """Group documents into as few prompts as fit the budget, first fit in submission order.
+
+    Returns lists of document indexes; a document larger than the budget gets a prompt of its own.
+    """
+    packs, totals = [], []
+    for index, size in enumerate(sizes):
+        for pack_index, pack in enumerate(packs):
+            if len(pack) < max_documents and totals[pack_index] + size <= budget:
+                pack.append(index)
+                totals[pack_index] += size
+                break
+        else:
+            packs.append([index])
+            totals.append(size)
+    return packs
+
+
+PAGE_MARKER = re.compile(r'\[\[\s*PAGE\s+(\d+)\s*\]\]', re.IGNORECASE)
+
+
+def split_batch_response(text, count):
+    """Split an answer covering several pages at its [[PAGE n]] markers; pages without an answer are None"""
+    answers = [None] * count
+    pieces = PAGE_MARKER.split(text)
+    for number, answer in zip(pieces[1::2], pieces[2::2]):
+        index = int(number) - 1
+        if 0 <= index < count and answer.strip() and answers[index] is None:
+            answers[index] = answer.strip()
+    return answers
+
+
+LINE_BREAK = re.compile(r'\r\n|\r|\n')
+# JavaScript's \s, which differs from Python's whitespace, so blocks split the same way as in the userscript
+JS_WHITESPACE = re.compile(r'[\t\n\v\f\r \u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000\ufeff]+')
+
+
+def page_blocks(text):
+    """Split page text into the blocks delta uploads are made of: non-empty lines with whitespace collapsed"""
+    return [block for block in (JS_WHITESPACE.sub(' ', line).strip(' ') for line in LINE_BREAK.split(text)) if block]
+
+
+def block_hash(block):
+    """CRC-32 and Adler-32 of a block's UTF-8 bytes as 16 hex digits, the same hash the userscript computes"""
+    data = block.encode('utf-8')
+    return f'{zlib.crc32(data):08x}{zlib.adler32(data):08x}'
+
+
+def diff_blocks(old_hashes, new_hashes):
+    """Indexes of the old blocks removed and of the new blocks added, as (removed, added)"""
+    removed, added = [], []
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag in ('replace', 'delete'):
+            removed.extend(range(old_start, old_end))
+        if tag in ('replace', 'insert'):
+            added.extend(range(new_start, new_end))
+    return removed, added
+
+
+def format_delta(metadata, previous_answer, removed, added, max_chars=50000):
+    """Format a re-analysis for ChatGPT: the previous answer plus the blocks removed and added since"""
+    parts = [
+        f"URL: {metadata.get('url', '')}\n",
+        f"Title: {metadata.get('title', '')}\n\n",
+        f"Previous answer:\n{previous_answer}\n\n"
+    ]
+
+    # What was added matters more than what was removed, so it gets most of the budget
+    if removed:
+        parts.append("Removed from the page:\n")
+        parts.append(reduce_text('\n'.join(removed), max_chars // 4) + '\n\n')
+    if added:
+        parts.append("Added to the page:\n")
+        parts.append(reduce_text('\n'.join(added), max_chars - max_chars // 4) + '\n')
+
+    return ''.join(parts)
+
+
+def _split_blocks(text, max_chars):
+    """Yield the largest boundary-aligned pieces of text that each fit in max_chars"""
+    for paragraph in re.split(r'(?<=\n\n)', text):
+        if len(paragraph) <= max_chars:
+            yield paragraph
+            continue
+        for line in paragraph.splitlines(keepends=True):
+            if len(line) <= max_chars:
+                yield line
+                continue
+            for sentence in re.split(r'(?<=[.!?] )', line):
+                while len(sentence) > max_chars:
+                    yield sentence[:max_chars]
+                    sentence = sentence[max_chars:]
+                yield sentence
+
+
+def _estimate_size(value):
+    """Rough number of bytes held by a JSON-like value"""
+    if isinstance(value, ChunkAssembler):
+        return value.memory_bytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_estimate_size(v) + len(k) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_size(v) for v in value) + 8 * len(value)
+    return 16
+
+
+class ResultStore:
+    """SQLite database (WAL mode) holding dispatched requests and their results
+
+    Replaces the per-request content/result JSON files: results stay available after
+    eviction from memory, requests still waiting for ChatGPT are recovered on restart,
+    and retention limits keep the database from growing without bound.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS requests (
+            request_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            prompt TEXT,
+            content TEXT,
+            view_in_chatgpt INTEGER NOT NULL DEFAULT 0,
+            cache_key TEXT,
+            result TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS requests_status ON requests (status);
+        CREATE INDEX IF NOT EXISTS requests_updated ON requests (updated);
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            request_id TEXT PRIMARY KEY,
+            fingerprint INTEGER NOT NULL,
+            prompt_key TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS snapshots (
+            url TEXT PRIMARY KEY,
+            request_id TEXT NOT NULL,
+            prompt_key TEXT NOT NULL,
+            blocks TEXT NOT NULL,
+            hashes TEXT NOT NULL,
+            answer TEXT,
+            updated REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path, retention=7 * 86400, max_rows=10000):
+        self.path = path
+        self.retention = retention  # Seconds a stored request is kept
+        self.max_rows = max_rows
+
+        self.lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._db.executescript(self.SCHEMA)
+
+    def save_pending(self, request_id, prompt, content, view_in_chatgpt=False, cache_key=None, created=None):
+        """Record a request that has been handed to ChatGPT"""
+        now = time.time()
+        with self.lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO requests (request_id, status, prompt, content, view_in_chatgpt, cache_key, "
+                "created, updated) VALUES (?, 'pending_chatgpt', ?, ?, ?, ?, ?, ?)",
+                (request_id, prompt, content, int(view_in_chatgpt), cache_key, created or now, now))
+
+    def save_result(self, request_id, result, status='completed'):
+        """Record the result of a request, dropping its content which is no longer needed"""
+        now = time.time()
+        with self.lock:
+            self._db.execute(
+                "INSERT INTO requests (request_id, status, result, created, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (request_id) DO UPDATE SET status = excluded.status, result = excluded.result, "
+                "content = NULL, updated = excluded.updated",
+                (request_id, status, result, now, now))
+
+    def save_late_result(self, request_id, result):
+        """Record a result that arrived after its request left memory; False unless it was still pending"""
+        with self.lock:
+            cursor = self._db.execute(
+                "UPDATE requests SET status = 'completed', result = ?, content = NULL, updated = ? "
+                "WHERE request_id = ? AND status = 'pending_chatgpt'",
+                (result, time.time(), request_id))
+        return cursor.rowcount > 0
+
+    def get_result(self, request_id):
+        """Return (status, result) of a finished request, or None"""
+        with self.lock:
+            row = self._db.execute(
+                "SELECT status, result FROM requests WHERE request_id = ? AND status IN ('completed', 'error')",
+                (request_id,)).fetchone()
+        return row
+
+    def pending(self):
+        """Requests that were waiting for ChatGPT, oldest first"""
+        with self.lock:
+            rows = self._db.execute(
+                "SELECT request_id, prompt, content, view_in_chatgpt, cache_key, created FROM requests "
+                "WHERE status = 'pending_chatgpt' ORDER BY created").fetchall()
+        return [{
+            'requestId': row[0],
+            'prompt': row[1],
+            'content': row[2],
+            'view_in_chatgpt': bool(row[3]),
+            'cache_key': row[4],
+            'timestamp': row[5]
+        } for row in rows]
+
+    def add_fingerprint(self, request_id, fingerprint, prompt_key, created=None):
+        """Record the SimHash of a completed request's content"""
+        with self.lock:
+            # SQLite integers are signed 64-bit
+            self._db.execute(
+                "INSERT OR REPLACE INTO fingerprints (request_id, fingerprint, prompt_key, created) VALUES (?, ?, ?, ?)",
+                (request_id, fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint, prompt_key,
+                 created or time.time()))
+
+    def cache_entries(self, since=0):
+        """(cache_key, request_id, updated) of answers to cacheable requests stored after `since`"""
+        with self.lock:
+            rows = self._db.execute(
+                "SELECT cache_key, request_id, updated FROM requests WHERE status = 'completed' "
+                "AND cache_key IS NOT NULL AND view_in_chatgpt = 0 AND updated > ? ORDER BY updated",
+                (since,)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def fingerprints(self, since=0):
+        """(request_id, fingerprint, prompt_key, created) of all fingerprints newer than `since`"""
+        with self.lock:
+            rows = self._db.execute(
+                "SELECT request_id, fingerprint, prompt_key, created FROM fingerprints WHERE created >= ? "
+                "ORDER BY created", (since,)).fetchall()
+        return [(row[0], row[1] & ((1 << 64) - 1), row[2], row[3]) for row in rows]
+
+    def save_snapshot(self, url, request_id, prompt_key, blocks, hashes, answer=None):
+        """Record the blocks of the latest page seen at a URL, replacing the previous snapshot"""
+        with self.lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO snapshots (url, request_id, prompt_key, blocks, hashes, answer, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, request_id, prompt_key, '\n'.join(blocks), ' '.join(hashes), answer, time.time()))
+
+    def set_snapshot_answer(self, url, request_id, answer):
+        """Attach the answer to a snapshot, unless a newer request for the URL has replaced it"""
+        with self.lock:
+            self._db.execute("UPDATE snapshots SET answer = ?, updated = ? WHERE url = ? AND request_id = ?",
+                             (answer, time.time(), url, request_id))
+
+    def get_snapshot(self, url):
+        """The snapshot of a URL as a dict, or None"""
+        with self.lock:
+            row = self._db.execute(
+                "SELECT request_id, prompt_key, blocks, hashes, answer, updated FROM snapshots WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'requestId': row[0],
+            'promptKey': row[1],
+            'blocks': row[2].split('\n') if row[2] else [],
+            'hashes': row[3].split() if row[3] else [],
+            'answer': row[4],
+            'updated': row[5]
+        }
+
+    def compact(self, now=None):
+        """Delete requests and snapshots past the retention period or over max_rows and reclaim the space
+
+        Returns the number of requests deleted.
+        """
+        now = now or time.time()
+        with self.lock:
+            deleted = self._db.execute("DELETE FROM requests WHERE updated < ?", (now - self.retention,)).rowcount
+            deleted += self._db.execute(
+                "DELETE FROM requests WHERE request_id IN (SELECT request_id FROM requests "
+                "ORDER BY updated DESC LIMIT -1 OFFSET ?)", (self.max_rows,)).rowcount
+            self._db.execute(
+                "DELETE FROM fingerprints WHERE request_id NOT IN (SELECT request_id FROM requests)")
+            # Snapshots of pages not re-analyzed within the retention period
+            snapshots = self._db.execute("DELETE FROM snapshots WHERE updated < ?", (now - self.retention,)).rowcount
+            snapshots += self._db.execute(
+                "DELETE FROM snapshots WHERE url IN (SELECT url FROM snapshots "
+                "ORDER BY updated DESC LIMIT -1 OFFSET ?)", (self.max_rows,)).rowcount
+            if deleted or snapshots:
+                self._db.execute("PRAGMA incremental_vacuum")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+    def import_legacy_files(self, cache_dir):
+        """Move results from the old per-request JSON files into the database"""
+        imported = 0
+        for result_file in cache_dir.glob("result_*.json"):
+            try:
+                with open(result_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                with self.lock:
+                    self._db.execute(
+                        "INSERT OR IGNORE INTO requests (request_id, status, result, created, updated) "
+                        "VALUES (?, 'completed', ?, ?, ?)",
+                        (data['requestId'], data['response'], data['timestamp'], data['timestamp']))
+                imported += 1
+            except (OSError, ValueError, KeyError):
+                continue
+            result_file.unlink()
+
+        # Content files are only snapshots of requests already handled
+        for content_file in cache_dir.glob("content_*.json"):
+            content_file.unlink()
+
+        return imported
+
+    def stats(self):
+        with self.lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM requests GROUP BY status").fetchall()
+        return {
+            'rows': sum(count for _, count in rows),
+            'byStatus': dict(rows),
+            'bytes': self.path.stat().st_size if self.path.exists() else 0
+        }
+
+    def close(self):
+        with self.lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """LRU cache of ChatGPT answers keyed on page content and prompt, backed by an on-disk index
+
+    Answers live in the ResultStore with every other result; the index maps a content key to
+    the request whose stored result holds the answer. Hot answers are kept in memory up to
+    max_bytes. The index is loaded after startup by load() and saved in the warm-state snapshot.
+    """
+
+    def __init__(self, cache_dir, store, max_entries=5000, max_bytes=20 * 1024 * 1024, ttl=86400):
+        self.store = store
+        self.index_file = cache_dir / "response-cache.json"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # Seconds an answer stays valid
+
+        self.lock = threading.RLock()
+        self._index = OrderedDict()  # key -> {'requestId', 'timestamp'}, least recently used first
+        self._memory = OrderedDict()  # key -> response text
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.loaded = threading.Event()
+        self.load_wait = 2  # Seconds a lookup waits for the index to load before it counts as a miss
+        self.version = 0  # Bumped on every change so unchanged state isn't saved again
+
+    def load(self, entries=None, since=0):
+        """Load the index from warm-state entries (key, request_id, timestamp), or from the legacy JSON index,
+        then the answers stored since the snapshot was taken (all of them without a snapshot)"""
+        try:
+            if entries is None:
+                entries = self._read_legacy_index()
+
+            now = time.time()
+            entries = list(entries) + self.store.cache_entries(since=max(since, now - self.ttl))
+            with self.lock:
+                # Answers cached since the server started are newer than anything loaded, so loaded
+                # entries go in front of them, oldest first
+                for key, request_id, timestamp in sorted(entries, key=lambda entry: entry[2], reverse=True):
+                    if now - timestamp <= self.ttl and key not in self._index:
+                        self._index[key] = {'requestId': request_id, 'timestamp': timestamp}
+                        self._index.move_to_end(key, last=False)
+
+                while len(self._index) > self.max_entries:
+                    self._drop(next(iter(self._index)))
+        finally:
+            self.loaded.set()
+
+    def snapshot(self):
+        """The index as (key, request_id, timestamp) tuples, least recently used first"""
+        with self.lock:
+            return [(key, entry['requestId'], entry['timestamp']) for key, entry in self._index.items()]
+
+    @staticmethod
+    def make_key(content, prompt):
+        """Hash of the whitespace-normalized content and prompt"""
+        normalized = re.sub(r'\s+', ' ', content).strip()
+        digest = hashlib.sha256()
+        digest.update(re.sub(r'\s+', ' ', prompt or '').strip().lower().encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(normalized.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached answer for a key, or None"""
+        self.loaded.wait(self.load_wait)
+        with self.lock:
+            entry = self._index.get(key)
+            if entry is None or time.time() - entry['timestamp'] > self.ttl:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+
+            self._index.move_to_end(key)
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return response
+
+        # Not in memory, load it from the result store
+        row = self.store.get_result(entry['requestId'])
+        if row is None or row[0] != 'completed':
+            with self.lock:
+                self._drop(key)
+                self.misses += 1
+            return None
+
+        response = row[1]
+        with self.lock:
+            self._remember(key, response)
+            self.hits += 1
+        return response
+
+    def put(self, key, request_id, response):
+        """Cache the answer for a key; request_id names the stored result holding it"""
+        with self.lock:
+            self._index[key] = {'requestId': request_id, 'timestamp': time.time()}
+            self._index.move_to_end(key)
+            self._remember(key, response)
+
+            while len(self._index) > self.max_entries:
+                self._drop(next(iter(self._index)))
+            self.version += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self._index),
+                'memoryEntries': len(self._memory),
+                'memoryBytes': self.memory_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def _remember(self, key, response):
+        if key in self._memory:
+            self.memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = response
+        self.memory_bytes += len(response)
+
+        while self.memory_bytes > self.max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _drop(self, key):
+        if self._index.pop(key, None) is not None:
+            self.version += 1
+        if key in self._memory:
+            self.memory_bytes -= len(self._memory.pop(key))
+
+    def _read_legacy_index(self):
+        """Entries of the JSON index older versions rewrote on every change"""
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return [(key, entry['requestId'], entry['timestamp']) for key, entry in entries.items()]
+
+
+class DispatchQueue:
+    """Queue of requests waiting for a ChatGPT connector, handed out under leases
+
+    A connector leases the next request from /content and acknowledges it by posting to
+    /response. Leases that are not acknowledged within lease_timeout are put back on the
+    queue. View mode requests are exclusive: they go to the freshly opened foreground tab,
+    never to a pooled background connector. They are handed off without a lease, since the
+    answer is read in that tab and never posted back.
+    """
+
+    def __init__(self, lease_timeout=300, max_attempts=3):
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+
+        self.cond = threading.Condition()
+        self._shared = []  # heap of (priority, sequence, request_id)
+        self._exclusive = []
+        self._queued = set()
+        self._leases = {}  # request_id -> (lease_id, expiry)
+        self._attempts = {}
+        self._sequence = itertools.count()
+        self.idle_connectors = 0  # Pooled connectors currently waiting for work
+
+    def put(self, request_id, priority=1, exclusive=False):
+        """Queue a request; returns True if no idle connector is available to take it"""
+        with self.cond:
+            if request_id in self._queued or request_id in self._leases:
+                return False
+
+            heapq.heappush(self._exclusive if exclusive else self._shared,
+                           (priority, next(self._sequence), request_id))
+            self._queued.add(request_id)
+            self.cond.notify_all()
+
+            return exclusive or len(self._shared) > self.idle_connectors
+
+    def lease(self, wait=0, pooled=False):
+        """Take the next request, waiting up to `wait` seconds; returns (request_id, lease_id) or None"""
+        deadline = time.time() + wait
+        with self.cond:
+            if pooled:
+                self.idle_connectors += 1
+            try:
+                while True:
+                    heap = self._shared if pooled or not self._exclusive else self._exclusive
+                    while heap:
+                        _, _, request_id = heapq.heappop(heap)
+                        if request_id in self._queued:
+                            self._queued.discard(request_id)
+                            lease_id = f"{request_id}:{next(self._sequence)}"
+                            if heap is self._shared:
+                                self._leases[request_id] = (lease_id, time.time() + self.lease_timeout)
+                                self._attempts[request_id] = self._attempts.get(request_id, 0) + 1
+                            return request_id, lease_id
+                    if heap is not self._shared and self._shared:
+                        # The exclusive heap only held stale entries, so pick again
+                        continue
+
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self.cond.wait(remaining)
+            finally:
+                if pooled:
+                    self.idle_connectors -= 1
+
+    def ack(self, request_id):
+        """Mark a request as done, whether it was leased or still queued"""
+        with self.cond:
+            self._queued.discard(request_id)
+            self._attempts.pop(request_id, None)
+            return self._leases.pop(request_id, None) is not None
+
+    def requeue_expired(self, now=None):
+        """Put requests with expired leases back on the queue
+
+        Returns (requeued, abandoned): abandoned requests used up max_attempts and are dropped.
+        """
+        now = now or time.time()
+        requeued, abandoned = [], []
+        with self.cond:
+            for request_id, (_, expiry) in list(self._leases.items()):
+                if expiry > now:
+                    continue
+                del self._leases[request_id]
+                if self._attempts.get(request_id, 0) >= self.max_attempts:
+                    self._attempts.pop(request_id, None)
+                    abandoned.append(request_id)
+                else:
+                    requeued.append(request_id)
+        return requeued, abandoned
+
+    def depth(self):
+        with self.cond:
+            return len(self._queued)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'queued': len(self._queued),
+                'leased': len(self._leases),
+                'idleConnectors': self.idle_connectors
+            }
+
+
+class EventLog:
+    """Structured event log written by a background thread
+
+    Handlers only put events on a bounded queue, so a slow terminal or log file never holds up a
+    request; when the queue is full, events are dropped and counted instead of blocking. Events are
+    rendered to the console, to a JSON-lines file, or both.
+    """
+
+    LEVELS = {'debug': 10, 'info': 20, 'notice': 25, 'warning': 30, 'error': 40}
+    COLORS = {'debug': Style.DIM, 'info': Fore.CYAN, 'notice': Fore.GREEN, 'warning': Fore.YELLOW, 'error': Fore.RED}
+
+    def __init__(self, console=True, json_path=None, level='info', sample_every=1, max_queued=10000):
+        self.console = console
+        self.json_path = json_path
+        self.level = self.LEVELS[level]
+        self.sample_every = max(sample_every, 1)  # Keep one in this many sampled (per-chunk) events
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._sample_counts = Counter()
+        self.dropped = 0
+        self._json_file = open(json_path, 'a', encoding='utf-8', buffering=1024 * 1024) if json_path else None
+        self._writer = threading.Thread(target=self._write_loop, name='web-assistant-log', daemon=True)
+        self._writer.start()
+
+    def log(self, level, event, message, sampled=False, **fields):
+        """Queue an event; `message` is for the console, `fields` for the JSON log"""
+        if self.LEVELS[level] < self.level:
+            return
+        if sampled:
+            self._sample_counts[event] += 1
+            if (self._sample_counts[event] - 1) % self.sample_every:
+                return
+        try:
+            self._queue.put_nowait((time.time(), level, event, message, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event, message, **fields):
+        self.log('debug', event, message, **fields)
+
+    def info(self, event, message, **fields):
+        self.log('info', event, message, **fields)
+
+    def notice(self, event, message, **fields):
+        self.log('notice', event, message, **fields)
+
+    def warning(self, event, message, **fields):
+        self.log('warning', event, message, **fields)
+
+    def error(self, event, message, **fields):
+        self.log('error', event, message, **fields)
+
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Write out queued events and stop the writer"""
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+        if self._json_file:
+            self._json_file.close()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._write(item)
+
+            # Flush once the burst is written, not after every event
+            if self._queue.empty():
+                if self.console:
+                    sys.stdout.flush()
+                if self._json_file:
+                    self._json_file.flush()
+
+    def _write(self, item):
+        timestamp, level, event, message, fields = item
+        try:
+            if self.console:
+                sys.stdout.write(f"{self.COLORS[level]}[{time.strftime('%H:%M:%S', time.localtime(timestamp))}] "
+                                 f"{message}{Style.RESET_ALL}\n")
+            if self._json_file:
+                record = {'time': round(timestamp, 3), 'level': level, 'event': event, 'message': message}
+                record.update(fields)
+                self._json_file.write(json.dumps(record, default=str) + '\n')
+        except (OSError, ValueError):
+            # A closed or broken output must not take the writer down
+            self.dropped += 1
+
+
+class Metrics:
+    """Counters, gauges and histograms rendered in the Prometheus text exposition format"""
+
+    TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = OrderedDict()  # name -> (type, help)
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # name -> {'buckets', 'counts', 'sum', 'count'}
+        self._gauges = {}  # name -> callback returning the current value
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ('counter', help_text)
+
+    def histogram(self, name, help_text, buckets=TIME_BUCKETS):
+        self._metrics[name] = ('histogram', help_text)
+        self._histograms[name] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+
+    def gauge(self, name, help_text, callback):
+        self._metrics[name] = ('gauge', help_text)
+        self._gauges[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value):
+        histogram = self._histograms[name]
+        with self.lock:
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = dict(self._counters)
+            histograms = {name: dict(h, counts=list(h['counts'])) for name, h in self._histograms.items()}
+
+        for name, (kind, help_text) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            if kind == 'counter':
+                for (counter_name, labels), value in counters.items():
+                    if counter_name == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+            elif kind == 'gauge':
+                try:
+                    lines.append(f"{name} {self._gauges[name]()}")
+                except Exception:
+                    pass
+            else:
+                histogram = histograms[name]
+                cumulative = 0
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {histogram["count"]}')
+                lines.append(f"{name}_sum {histogram['sum']}")
+                lines.append(f"{name}_count {histogram['count']}")
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def simhash(text, shingle_size=3):
+    """64-bit SimHash of a text's word shingles; returns (fingerprint, number of shingles)"""
+    words = WORD_PATTERN.findall(text.lower())
+    blake2b = hashlib.blake2b
+    digests = b''.join(blake2b(' '.join(words[i:i + shingle_size]).encode('utf-8'), digest_size=8).digest()
+                       for i in range(max(len(words) - shingle_size + 1, 1)))
+    count = len(digests) // 8
+
+    # Count set bits column by column: each byte position of the digests is tallied at C speed
+    fingerprint = 0
+    for position in range(8):
+        byte_counts = Counter(digests[position::8])
+        for bit in range(8):
+            ones = sum(n for value, n in byte_counts.items() if value >> bit & 1)
+            if ones * 2 > count:
+                fingerprint |= 1 << (position * 8 + bit)
+    return fingerprint, count
+
+
+class SimilarityIndex:
+    """SimHash index that finds previously answered pages within a Hamming distance
+
+    Fingerprints are split into max_distance + 1 bands; two fingerprints within max_distance
+    bits of each other must agree on at least one band, so a lookup only compares against
+    the entries sharing a band bucket. Entries are persisted in the ResultStore and loaded
+    after startup by load(), from the warm-state snapshot when there is one.
+    """
+
+    MIN_SHINGLES = 50  # Shorter texts give unreliable fingerprints
+
+    def __init__(self, store, max_distance=3, ttl=86400):
+        self.store = store
+        self.max_distance = max_distance
+        self.ttl = ttl
+
+        self.bands = max_distance + 1
+        self.band_bits = 64 // self.bands
+        self.lock = threading.Lock()
+        self._buckets = {}  # (prompt_key, band, band value) -> [(fingerprint, request_id, created)]
+        self._request_ids = set()
+        self.entries = 0
+        self.hits = 0
+
+        self.loaded = threading.Event()
+        self.load_wait = 2  # Seconds a lookup waits for the index to load before it counts as a miss
+        self.version = 0  # Bumped on every change so unchanged state isn't saved again
+
+    def load(self, entries=None, since=0):
+        """Load (request_id, fingerprint, prompt_key, created) entries saved in the warm-state snapshot,
+        then the fingerprints stored since the snapshot was taken (all of them without a snapshot)"""
+        try:
+            oldest = time.time() - self.ttl
+            rows = list(entries or ()) + self.store.fingerprints(since=max(since, oldest))
+            with self.lock:
+                for request_id, fingerprint, prompt_key, created in rows:
+                    if created >= oldest and request_id not in self._request_ids:
+                        self._insert(request_id, fingerprint, prompt_key, created)
+        finally:
+            self.loaded.set()
+
+    def snapshot(self):
+        """All entries as (request_id, fingerprint, prompt_key, created) tuples"""
+        with self.lock:
+            return [(request_id, fingerprint, prompt_key, created)
+                    for (prompt_key, band, _), entries in self._buckets.items() if band == 0
+                    for fingerprint, request_id, created in entries]
+
+    @staticmethod
+    def prompt_key(prompt):
+        normalized = re.sub(r'\s+', ' ', prompt or '').strip().lower()
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:16]
+
+    def fingerprint(self, content):
+        """Fingerprint of the content, or None if it's too short to compare reliably"""
+        fingerprint, shingles = simhash(content)
+        return fingerprint if shingles >= self.MIN_SHINGLES else None
+
+    def add(self, request_id, fingerprint, prompt):
+        prompt_key = self.prompt_key(prompt)
+        created = time.time()
+        self.store.add_fingerprint(request_id, fingerprint, prompt_key, created)
+        with self.lock:
+            if request_id not in self._request_ids:
+                self._insert(request_id, fingerprint, prompt_key, created)
+                self.version += 1
+
+    def lookup(self, fingerprint, prompt):
+        """Closest stored (request_id, distance) with the same prompt, or None"""
+        self.loaded.wait(self.load_wait)
+        prompt_key = self.prompt_key(prompt)
+        oldest = time.time() - self.ttl
+        best = None
+        with self.lock:
+            for band, value in self._band_values(fingerprint):
+                for candidate, request_id, created in self._buckets.get((prompt_key, band, value), ()):
+                    if created < oldest:
+                        continue
+                    distance = bin(candidate ^ fingerprint).count('1')
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (request_id, distance)
+            if best is not None:
+                self.hits += 1
+        return best
+
+    def prune(self):
+        """Drop entries older than the TTL"""
+        oldest = time.time() - self.ttl
+        with self.lock:
+            for key in list(self._buckets):
+                fresh = [entry for entry in self._buckets[key] if entry[2] >= oldest]
+                if fresh:
+                    self._buckets[key] = fresh
+                else:
+                    del self._buckets[key]
+            # Every entry sits in exactly one bucket per band
+            self._request_ids = {request_id for (_, band, _), entries in self._buckets.items() if band == 0
+                                 for _, request_id, _ in entries}
+            self.entries = len(self._request_ids)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': self.entries, 'hits': self.hits, 'maxDistance': self.max_distance}
+
+    def _insert(self, request_id, fingerprint, prompt_key, created):
+        for band, value in self._band_values(fingerprint):
+            self._buckets.setdefault((prompt_key, band, value), []).append((fingerprint, request_id, created))
+        self._request_ids.add(request_id)
+        self.entries += 1
+
+    def _band_values(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, fingerprint >> (band * self.band_bits) & mask) for band in range(self.bands)]
+
+
+WARM_STATE_MAGIC = b'WAWS'
+WARM_STATE_VERSION = 1
+
+
+def save_warm_state(path, saved_at, cache_entries, similarity_entries):
+    """Write the cache index and similarity index to a compact binary file.
+
+    Layout: magic, version and saved_at, then a zlib-compressed body of two counts followed by
+    fixed-size records, each ending with its length-prefixed request id.
+    """
+    body = bytearray(struct.pack('<II', len(cache_entries), len(similarity_entries)))
+    for key, request_id, timestamp in cache_entries:
+        request_id = request_id.encode('utf-8')
+        body += bytes.fromhex(key) + struct.pack('<dH', timestamp, len(request_id)) + request_id
+    for request_id, fingerprint, prompt_key, created in similarity_entries:
+        request_id = request_id.encode('utf-8')
+        body += struct.pack('<Q', fingerprint) + bytes.fromhex(prompt_key) + \
+            struct.pack('<dH', created, len(request_id)) + request_id
+
+    # Write to a temporary file first so a crash never leaves a truncated snapshot
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(WARM_STATE_MAGIC + struct.pack('<Hd', WARM_STATE_VERSION, saved_at))
+        f.write(zlib.compress(bytes(body)))
+    os.replace(tmp_path, path)
+
+
+def load_warm_state(path):
+    """Read a file written by save_warm_state as (saved_at, cache_entries, similarity_entries), or None"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:4] != WARM_STATE_MAGIC:
+            return None
+        version, saved_at = struct.unpack_from('<Hd', data, 4)
+        if version != WARM_STATE_VERSION:
+            return None
+
+        body = zlib.decompress(data[4 + struct.calcsize('<Hd'):])
+        cache_count, similarity_count = struct.unpack_from('<II', body)
+        offset = 8
+
+        cache_entries = []
+        for _ in range(cache_count):
+            key = body[offset:offset + 32].hex()
+            timestamp, length = struct.unpack_from('<dH', body, offset + 32)
+            offset += 42
+            cache_entries.append((key, body[offset:offset + length].decode('utf-8'), timestamp))
+            offset += length
+
+        similarity_entries = []
+        for _ in range(similarity_count):
+            fingerprint, = struct.unpack_from('<Q', body, offset)
+            prompt_key = body[offset + 8:offset + 16].hex()
+            created, length = struct.unpack_from('<dH', body, offset + 16)
+            offset += 26
+            similarity_entries.append((body[offset:offset + length].decode('utf-8'), fingerprint, prompt_key, created))
+            offset += length
+    except (OSError, ValueError, struct.error, zlib.error):
+        return None
+
+    return saved_at, cache_entries, similarity_entries
+
+
+class WarmUp:
+    """Progress of the state loaded in the background once the server is accepting connections"""
+
+    def __init__(self, steps):
+        self.lock = threading.Lock()
+        self.steps = OrderedDict((step, 'pending') for step in steps)
+        self.source = None  # 'snapshot' if the warm-state snapshot was used, 'disk' if state was rebuilt
+        self.started = None
+        self.finished = None
+
+    def mark(self, step, state):
+        with self.lock:
+            self.steps[step] = state
+
+    @property
+    def ready(self):
+        return self.finished is not None
+
+    def stats(self):
+        with self.lock:
+            done = sum(1 for state in self.steps.values() if state not in ('pending', 'loading'))
+            return {
+                'ready': self.ready,
+                'progress': done / len(self.steps),
+                'source': self.source,
+                'steps': dict(self.steps),
+                'seconds': (self.finished or time.time()) - self.started if self.started else 0.0
+            }
+
+
+def build_chat_prompt(prompt, content, segment=None, view_in_chatgpt=False):
+    """The message sent for a request: typed into ChatGPT by the connector, which gets it from /content,
+    or sent to an API backend"""
+    prompt = prompt or "Analyze this page content"
+    stage = segment['stage'] if segment else None
+
+    if stage == 'map':
+        # One part of a long page; notes from all parts are merged in a final prompt
+        return (f'User prompt: "{prompt}"\n\n'
+                f"I'll share part {segment['index'] + 1} of {segment['total']} of a long webpage below.\n"
+                "Extract everything in this part that helps answer the user's prompt, as brief factual notes.\n"
+                'If nothing in this part is relevant, reply only with "Nothing relevant".\n\n'
+                f"Page content (part {segment['index'] + 1} of {segment['total']}):\n{content}\n")
+    if stage == 'batch':
+        # Several pages sent together; the server splits the answer at the page markers
+        return (f'User prompt: "{prompt}"\n\n'
+                f"I'll share {segment['total']} webpages below, each starting with a marker like [[PAGE 1]].\n"
+                "Answer the user's prompt separately for each page, based only on that page's content.\n"
+                "If a page doesn't contain information to answer the prompt, say so for that page.\n\n"
+                "IMPORTANT: Start each answer with the marker of its page, exactly as written "
+                "(for example [[PAGE 1]]),\n"
+                "answer every page in order, and keep each answer concise (ideally under 200 characters).\n\n"
+                f"Pages:\n{content}\n\n"
+                "Remember to start each page's answer with its [[PAGE n]] marker.\n")
+    if stage == 'delta':
+        # A page analyzed before; only what changed since is sent, with the previous answer
+        return (f'User prompt: "{prompt}"\n\n'
+                "You answered this prompt for the webpage below before, and the page has changed since.\n"
+                "I'll share your previous answer and only the parts of the page that were removed or added.\n"
+                "Give an updated answer to the user's prompt for the page as it is now.\n\n"
+                "IMPORTANT: Your response will be displayed in a small status bar, so please:\n"
+                "1. Keep your response concise and to the point (ideally under 200 characters)\n"
+                "2. Focus on what the changes mean for the answer\n\n"
+                f"{content}\n")
+    if view_in_chatgpt:
+        return (f'User prompt: "{prompt}"\n\n'
+                "I'll share content from a webpage below. Please answer the user's prompt based on this content.\n"
+                "If the content doesn't contain information to answer the prompt, please state that clearly.\n\n"
+                f"Page content:\n{content}\n")
+    return (f'User prompt: "{prompt}"\n\n'
+            "I'll share content from a webpage below. Please answer the user's prompt based on this content.\n"
+            "If the content doesn't contain information to answer the prompt, please state that clearly.\n\n"
+            "IMPORTANT: Your response will be displayed in a small status bar, so please:\n"
+            "1. Keep your response concise and to the point (ideally under 200 characters)\n"
+            "2. Format it to be easily readable in a small space\n"
+            "3. Focus on the most important insights or actionable information\n"
+            "4. Avoid unnecessary explanations or verbosity\n\n"
+            f"Page content:\n{content}\n\n"
+            "Remember to provide ONLY the final, concise response formatted for display in a small status bar.\n")
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to one server, reused most recently released first"""
+
+    def __init__(self, url, size=4, timeout=300):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.size = size  # Idle connections kept open
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self._idle = []
+        self._open = set()
+        self.created = 0
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request; returns (connection, response), to be handed to release() when done"""
+        for attempt in range(2):
+            with self.lock:
+                connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+                    self.created += 1
+                    reused = False
+                else:
+                    reused = True
+                self._open.add(connection)
+
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers or {})
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                self._discard(connection)
+                # The server may have closed an idle connection just as it was reused; retry once on a new one
+                if not (reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError,
+                                                  BrokenPipeError))) or attempt:
+                    raise
+
+    def release(self, connection, response):
+        """Keep a connection for reuse if its response was read to the end and the server keeps it open"""
+        if response.will_close or not response.isclosed():
+            self._discard(connection)
+            return
+        with self.lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        self._discard(connection)
+
+    def stats(self):
+        with self.lock:
+            return {'idle': len(self._idle), 'open': len(self._open), 'created': self.created}
+
+    def close(self):
+        """Close every connection, interrupting requests still reading a response"""
+        with self.lock:
+            connections, self._open, self._idle = self._open, set(), []
+        for connection in connections:
+            connection.close()
+
+    def _discard(self, connection):
+        connection.close()
+        with self.lock:
+            self._open.discard(connection)
+
+
+class CompletionBackend:
+    """Where requests ready for ChatGPT are sent; the answer comes back through server.complete_request"""
+
+    name = None
+
+    def __init__(self, server):
+        self.server = server
+
+    def submit(self, request_id, view_in_chatgpt=False):
+        raise NotImplementedError
+
+    def depth(self):
+        """Requests waiting for the backend to start on them"""
+        return 0
+
+    def stats(self):
+        return {'name': self.name}
+
+    def close(self):
+        pass
+
+
+class BrowserBackend(CompletionBackend):
+    """ChatGPT in the browser: connector userscripts lease requests on /content, and a tab is opened if none is idle"""
+
+    name = 'browser'
+
+    def submit(self, request_id, view_in_chatgpt=False):
+        server = self.server
+        needs_connector = server.dispatch_queue.put(request_id, exclusive=view_in_chatgpt)
+        server.metrics.inc('web_assistant_dispatch_total',
+                           outcome='browser_opened' if needs_connector else 'connector_reused')
+
+        if needs_connector:
+            # Open ChatGPT in foreground or background based on mode
+            server.log.warning('browser_opening',
+                               f"Opening ChatGPT for request {request_id} (View mode: {view_in_chatgpt})",
+                               requestId=request_id, viewInChatGPT=view_in_chatgpt)
+
+            # Use the browser opening method that supports background opening
+            server.open_browser_in_background("https://chatgpt.com/", view_in_chatgpt)
+        else:
+            server.log.info('queued', f"Queued request {request_id} for an open ChatGPT connector",
+                            requestId=request_id)
+
+    def depth(self):
+        return self.server.dispatch_queue.depth()
+
+    def stats(self):
+        return {'name': self.name, **self.server.dispatch_queue.stats()}
+
+
+class PooledBackend(CompletionBackend):
+    """A backend the server calls itself, answering up to `concurrency` requests at the same time.
+
+    Subclasses implement complete(), which calls on_text with each piece of the answer as it is
+    generated so /results can show it before the answer is complete.
+    """
+
+    def __init__(self, server, concurrency=4):
+        super().__init__(server)
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'{self.name}-backend')
+
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+
+    def complete(self, message, content, segment, on_text):
+        """Answer a prompt message; content and segment are the parts the message was built from"""
+        raise NotImplementedError
+
+    def submit(self, request_id, view_in_chatgpt=False):
+        with self.lock:
+            self.queued += 1
+        self.server.metrics.inc('web_assistant_dispatch_total', outcome=self.name)
+        self.server.log.info('queued', f"Queued request {request_id} for the {self.name} backend",
+                             requestId=request_id, backend=self.name)
+        self.executor.submit(self._run, request_id)
+
+    def depth(self):
+        with self.lock:
+            return self.queued
+
+    def stats(self):
+        with self.lock:
+            return {'name': self.name, 'queued': self.queued, 'active': self.active,
+                    'concurrency': self.concurrency, 'completed': self.completed, 'failed': self.failed}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, request_id):
+        server = self.server
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+
+        try:
+            with server.lock:
+                request_info = server.pending_requests.get(request_id)
+                if request_info is None or request_info['status'] != 'pending_chatgpt':
+                    # Evicted or failed while it was queued
+                    return
+                started = request_info['leased_at'] = time.time()
+                request_info['partial'] = ''
+                prompt, content = request_info['prompt'], request_info['content']
+                segment = server.segment_info(request_info)
+            server.metrics.observe('web_assistant_queue_wait_seconds',
+                                   started - request_info.get('queued_at', started))
+
+            try:
+                response_text = self.complete(build_chat_prompt(prompt, content, segment), content, segment,
+                                              lambda text: server.append_partial(request_id, text))
+                is_error = False
+            except Exception as e:
+                server.log.error('backend_failed', f"The {self.name} backend failed on request {request_id}: {e}",
+                                 requestId=request_id, backend=self.name, error=str(e))
+                response_text, is_error = f"Error: {e}", True
+
+            server.log.notice('response_received', f"Received {self.name} backend response for request {request_id}",
+                              requestId=request_id, chars=len(response_text), error=is_error)
+            server.metrics.inc('web_assistant_responses_total', error=str(is_error).lower())
+            server.complete_request(request_id, response_text, is_error)
+            with self.lock:
+                if is_error:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class HTTPBackend(PooledBackend):
+    """An OpenAI-compatible chat completions endpoint (llama.cpp, Ollama, vLLM, LM Studio...), streamed"""
+
+    name = 'http'
+
+    def __init__(self, server, url, model, api_key=None, concurrency=4, timeout=300):
+        super().__init__(server, concurrency)
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.pool = ConnectionPool(url, size=concurrency, timeout=timeout)
+
+    def complete(self, message, content, segment, on_text):
+        body = json.dumps({
+            'model': self.model,
+            'messages': [{'role': 'user', 'content': message}],
+            'stream': True
+        }).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+
+        connection, response = self.pool.request('POST', '/chat/completions', body, headers)
+        try:
+            if response.status != 200:
+                detail = response.read(500).decode('utf-8', 'replace')
+                raise RuntimeError(f"{self.url} answered {response.status}: {detail}")
+
+            if response.getheader('Content-Type', '').startswith('application/json'):
+                # Endpoints that ignore "stream" answer in one piece
+                text = json.loads(response.read())['choices'][0]['message']['content'] or ''
+                on_text(text)
+                return text
+
+            # Server-sent events, one JSON chunk per "data:" line
+            pieces = []
+            for line in response:
+                line = line.strip()
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[5:].strip()
+                if data == b'[DONE]':
+                    break
+                choices = json.loads(data).get('choices') or [{}]
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    pieces.append(text)
+                    on_text(text)
+            # Read to the end of the stream so the connection can be reused
+            response.read()
+            return ''.join(pieces)
+        finally:
+            self.pool.release(connection, response)
+
+    def stats(self):
+        return {**super().stats(), 'url': self.url, 'model': self.model, 'pool': self.pool.stats()}
+
+    def close(self):
+        super().close()
+        self.pool.close()
+
+
+class MockBackend(PooledBackend):
+    """Deterministic answers made from a digest of the request, for tests and benchmarks"""
+
+    name = 'mock'
+
+    def __init__(self, server, concurrency=4, latency=0.0):
+        super().__init__(server, concurrency)
+        self.latency = latency  # Seconds each answer takes, spread over its words
+
+    def complete(self, message, content, segment, on_text):
+        if segment and segment['stage'] == 'batch':
+            pages = PAGE_MARKER.split(content)[2::2]
+            answer = ' '.join(f"[[PAGE {number}]] {self._answer(page)}" for number, page in enumerate(pages, 1))
+        else:
+            answer = self._answer(message)
+
+        words = answer.split(' ')
+        for index, word in enumerate(words):
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            on_text(word if index == 0 else ' ' + word)
+        return answer
+
+    @staticmethod
+    def _answer(text):
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+        return f"Mock answer {digest}: {len(WORD_PATTERN.findall(text))} words."
+
 
 class LocalServer:
     """HTTP server to receive webpage content and provide AI suggestions"""
 
-    def __init__(self, port=8765, timeout=600):
+    def __init__(self, port=8765, timeout=600, workers=16, max_requests=500, max_request_memory=200,
+                 receiving_ttl=120, completed_ttl=600, eviction_interval=15, cache_ttl=86400,
+                 cache_entries=5000, cache_memory=20, lease_timeout=300, max_content_chars=50000, cache_dir=None,
+                 retention_days=7, max_stored_requests=10000, compaction_interval=3600, segment_tokens=8000,
+                 max_segments=8, similarity_distance=3, keepalive_timeout=5, batch_pack_size=10, log_file=None,
+                 log_level='info', log_console=True, log_chunk_sample=1, max_body_size=16, max_request_size=64,
+                 max_total_chunks=1000, max_in_flight=50, max_queue_depth=100, retry_after=5, delta_max_change=0.5,
+                 warm_state_interval=60, backend='browser', backend_url='http://localhost:11434/v1',
+                 backend_model=None, backend_api_key=None, backend_concurrency=4, backend_timeout=300,
+                 mock_latency=0.0):
         self.port = port
-        self.timeout = timeout  # Maximum runtime in seconds
+        self.timeout = timeout  # Seconds a request may wait for ChatGPT before it is dropped
+        self.workers = workers  # Number of threads serving requests concurrently
+        self.keepalive_timeout = keepalive_timeout  # Seconds an idle kept-alive connection holds a worker
         self.server = None
         self.start_time = None
 
-        # Dictionary to store pending requests and their chunks
-        self.pending_requests = {}
+        # Handlers queue log events; a background thread writes them to the console and/or a JSON-lines file
+        self.log = EventLog(console=log_console, json_path=log_file, level=log_level, sample_every=log_chunk_sample)
+
+        # Store for pending requests and their chunks, bounded in size and age.
+        # Handlers run on several worker threads, so every access goes through the lock.
+        self.pending_requests = RequestStore(
+            max_entries=max_requests,
+            max_bytes=max_request_memory * 1024 * 1024,
+            ttls={
+                'receiving': receiving_ttl,
+                'complete': timeout,
+                'pending_chatgpt': timeout,
+                'completed': completed_ttl,
+                'error': completed_ttl
+            }
+        )
+        self.lock = self.pending_requests.lock
+
+        # Character budget for the page text sent to ChatGPT, and what the reduction saved so far
+        self.max_content_chars = max_content_chars
+        self.reduction_totals = {'bytesIn': 0, 'bytesOut': 0}
+
+        # Pages over segment_tokens are split and analyzed by up to max_segments connectors in parallel
+        self.segment_tokens = segment_tokens
+        self.max_segments = max_segments
+
+        # Requests ready for ChatGPT, leased to connector tabs through /content
+        self.dispatch_queue = DispatchQueue(lease_timeout=lease_timeout)
+        self.max_content_wait = 30  # Longest time a single /content call may block, in seconds
+        self.eviction_interval = eviction_interval
+        self.stopped = threading.Event()
+
+        # Signalled whenever a request gets its result, waking long-polling /results calls
+        self.results_ready = threading.Condition(self.lock)
+        self.max_result_wait = 30  # Longest time a single /results call may block, in seconds
+
+        # Long-polls hold a worker while they block, so a few workers are always left for the
+        # /response and /analyze calls that wake them; long-polls over the limit return at once
+        self.max_waiters = max(0, workers - max(1, workers // 4))
+        self.waiters = 0
 
         # Create cache directory if it doesn't exist
-        self.cache_dir = Path.home() / ".web-assistant-cache"
+        self.cache_dir = Path(cache_dir) if cache_dir else Path.home() / ".web-assistant-cache"
         self.cache_dir.mkdir(exist_ok=True)
 
+        # Dispatched requests and their results, kept across restarts
+        self.store = ResultStore(
+            self.cache_dir / "web-assistant.db",
+            retention=retention_days * 86400,
+            max_rows=max_stored_requests
+        )
+        self.compaction_interval = compaction_interval
+        self.last_compaction = time.time()
+
+        # Answers to previously analyzed content, reused instead of opening ChatGPT again
+        self.response_cache = None
+        if cache_ttl > 0:
+            self.response_cache = ResponseCache(
+                self.cache_dir,
+                self.store,
+                max_entries=cache_entries,
+                max_bytes=cache_memory * 1024 * 1024,
+                ttl=cache_ttl
+            )
+
+        # Admission control: bodies and requests over these sizes get 413, new requests over the
+        # in-flight limit 429 and over the queue depth 503, so a burst can't starve running requests
+        self.max_body_bytes = max_body_size * 1024 * 1024
+        self.max_request_bytes = max_request_size * 1024 * 1024
+        self.max_total_chunks = max_total_chunks
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.retry_after = retry_after
+
+        # Batches pack several pages into one prompt, up to the segment budget and this many pages
+        self.batch_pack_size = batch_pack_size
+
+        # Pages re-analyzed in delta mode send ChatGPT only the changes and the previous answer,
+        # as long as no more than this fraction of the page changed
+        self.delta_max_change = delta_max_change
+
+        # Near-duplicates of answered pages (same prompt, nearly the same content) reuse the answer
+        self.similarity_index = None
+        if cache_ttl > 0 and similarity_distance >= 0:
+            self.similarity_index = SimilarityIndex(self.store, max_distance=similarity_distance, ttl=cache_ttl)
+
+        # The cache index, similarity index and interrupted requests are loaded in the background
+        # after the server starts listening; the indexes are saved to a binary snapshot every
+        # warm_state_interval seconds (when they changed) and on shutdown, so startup needn't rebuild them
+        self.warmup = WarmUp(['snapshot', 'cache', 'similarity', 'recovery'])
+        self.warm_state_file = self.cache_dir / "warm-state.bin"
+        self.warm_state_interval = warm_state_interval
+        self.last_warm_state_save = time.time()
+        self._saved_versions = None
+
+        # Requests ready for ChatGPT are answered by the backend. View mode always goes to the
+        # browser, since the user wants to see the conversation.
+        self.browser_backend = BrowserBackend(self)
+        if backend == 'http':
+            self.backend = HTTPBackend(self, backend_url, backend_model, api_key=backend_api_key,
+                                       concurrency=backend_concurrency, timeout=backend_timeout)
+        elif backend == 'mock':
+            self.backend = MockBackend(self, concurrency=backend_concurrency, latency=mock_latency)
+        else:
+            self.backend = self.browser_backend
+
+        # Advertised in /status so clients only use what this server understands
+        self.features = ['long-poll', 'keep-alive', 'gzip', 'batch', 'delta', 'streaming'] + \
+            (['zstd'] if zstd is not None else [])
+
+        self.metrics = Metrics()
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Declare the metrics exposed on /metrics, one per stage of a request's life"""
+        metrics = self.metrics
+        metrics.counter('web_assistant_chunks_received_total', 'Content chunks received on /analyze')
+        metrics.histogram('web_assistant_chunk_receive_seconds', 'Time to read and store one chunk')
+        metrics.histogram('web_assistant_request_body_bytes', 'Size of POST bodies as sent', Metrics.SIZE_BUCKETS)
+        metrics.histogram('web_assistant_response_body_bytes', 'Size of response bodies as sent', Metrics.SIZE_BUCKETS)
+        metrics.histogram('web_assistant_assembly_seconds', 'Time from first chunk to a fully assembled request')
+        metrics.counter('web_assistant_dispatch_total', 'Assembled requests by how they were dispatched')
+        metrics.counter('web_assistant_rejected_total', 'Requests refused by admission control, by HTTP status')
+        metrics.gauge('web_assistant_in_flight_requests', 'Pages and batches being uploaded or waiting for ChatGPT',
+                      self.in_flight_requests)
+        metrics.counter('web_assistant_batch_documents_total', 'Pages submitted in batches by how they were answered')
+        metrics.counter('web_assistant_delta_total', 'Delta-mode pages by how they compared with their snapshot')
+        metrics.histogram('web_assistant_dispatch_seconds', 'Time to format, look up and dispatch a request')
+        metrics.histogram('web_assistant_queue_wait_seconds', 'Time a request waited before a connector leased it')
+        metrics.counter('web_assistant_content_served_total', 'Requests served to connectors on /content')
+        metrics.histogram('web_assistant_chatgpt_seconds', 'Time from lease to the connector posting /response')
+        metrics.counter('web_assistant_responses_total', 'Responses received from connectors')
+        metrics.histogram('web_assistant_end_to_end_seconds', 'Time from first chunk to the result being delivered')
+        metrics.counter('web_assistant_results_delivered_total', 'Results delivered on /results')
+        metrics.gauge('web_assistant_queue_depth', 'Requests waiting for a connector or backend', self.queue_depth)
+        metrics.gauge('web_assistant_pending_requests', 'Requests held in memory', lambda: len(self.pending_requests))
+        metrics.gauge('web_assistant_pending_requests_bytes', 'Approximate memory held by requests',
+                      lambda: self.pending_requests.total_bytes)
+        metrics.gauge('web_assistant_cache_entries', 'Answers in the response cache',
+                      lambda: self.response_cache.stats()['entries'] if self.response_cache else 0)
+        metrics.gauge('web_assistant_cache_memory_bytes', 'Memory held by cached answers',
+                      lambda: self.response_cache.memory_bytes if self.response_cache else 0)
+        metrics.gauge('web_assistant_log_queued', 'Log events waiting for the writer', lambda: self.log.queued)
+        metrics.gauge('web_assistant_log_dropped', 'Log events dropped because the writer fell behind',
+                      lambda: self.log.dropped)
+        metrics.gauge('web_assistant_similarity_entries', 'Fingerprints in the near-duplicate index',
+                      lambda: self.similarity_index.entries if self.similarity_index else 0)
+        metrics.gauge('web_assistant_warmup_progress', 'Fraction of the startup state loaded so far',
+                      lambda: self.warmup.stats()['progress'])
+
+    def save_result(self, request_id, response_text, status='completed'):
+        """Store a result so it survives eviction from memory and restarts"""
+        self.store.save_result(request_id, response_text, status)
+
+    def recover_requests(self):
+        """Requeue requests that were waiting for ChatGPT when the server last stopped"""
+        imported = self.store.import_legacy_files(self.cache_dir)
+        if imported:
+            self.log.info('legacy_import', f"Imported {imported} result file(s) into the result store", count=imported)
+
+        recovered = 0
+        for row in self.store.pending():
+            if time.time() - row['timestamp'] > self.timeout:
+                self.store.save_result(row['requestId'], "Error: server restarted before ChatGPT responded", 'error')
+                continue
+
+            with self.lock:
+                self.pending_requests[row['requestId']] = {
+                    'prompt': row['prompt'],
+                    'content': row['content'],
+                    'cache_key': row['cache_key'],
+                    'timestamp': row['timestamp'],
+                    'status': 'pending_chatgpt',
+                    'result': None,
+                    'total_chunks': 0,
+                    'view_in_chatgpt': row['view_in_chatgpt']
+                }
+            self.dispatch_request(row['requestId'])
+            recovered += 1
+
+        if recovered:
+            self.log.info('recovered', f"Recovered {recovered} pending request(s)", count=recovered)
+
+    def _warm_up(self):
+        """Load state from disk while the server already accepts connections"""
+        warmup = self.warmup
+        warmup.started = time.time()
+
+        warmup.mark('snapshot', 'loading')
+        state = load_warm_state(self.warm_state_file)
+        warmup.source = 'snapshot' if state is not None else 'disk'
+        warmup.mark('snapshot', 'ready' if state is not None else 'skipped')
+        saved_at, cache_entries, similarity_entries = state or (0, None, None)
+
+        steps = [
+            ('cache', (lambda: self.response_cache.load(cache_entries, since=saved_at))
+                if self.response_cache else None),
+            ('similarity', (lambda: self.similarity_index.load(similarity_entries, since=saved_at))
+                if self.similarity_index else None),
+            ('recovery', self.recover_requests)
+        ]
+        for step, load in steps:
+            if not load:
+                warmup.mark(step, 'skipped')
+                continue
+            warmup.mark(step, 'loading')
+            try:
+                load()
+                warmup.mark(step, 'ready')
+            except Exception as e:
+                warmup.mark(step, 'failed')
+                self.log.error('warmup_failed', f"Error loading {step} state: {e}", step=step, error=str(e))
+
+        # Nothing new to save until the loaded state changes
+        if state is not None:
+            self._saved_versions = self._state_versions()
+        warmup.finished = time.time()
+        self.log.info('warmed_up', f"Loaded saved state from {warmup.source} in "
+                                   f"{warmup.finished - warmup.started:.2f} seconds",
+                      source=warmup.source, seconds=warmup.finished - warmup.started)
+
+    def _state_versions(self):
+        return (self.response_cache.version if self.response_cache else None,
+                self.similarity_index.version if self.similarity_index else None)
+
+    def persist_warm_state(self):
+        """Save the cache and similarity indexes to the warm-state snapshot if they changed"""
+        # A half-loaded state would overwrite a good snapshot
+        if not self.warmup.ready or self._state_versions() == self._saved_versions:
+            return
+
+        versions = self._state_versions()
+        saved_at = time.time()
+        save_warm_state(self.warm_state_file, saved_at,
+                        self.response_cache.snapshot() if self.response_cache else [],
+                        self.similarity_index.snapshot() if self.similarity_index else [])
+        self._saved_versions = versions
+
+        # The snapshot replaces the JSON index older versions kept
+        if self.response_cache:
+            self.response_cache.index_file.unlink(missing_ok=True)
+
     def start(self):
         """Start the local server and listen for requests"""
         handler = self._create_handler()
 
-        # Enable socket reuse to prevent "Address already in use" errors
-        socketserver.TCPServer.allow_reuse_address = True
-
         try:
-            self.server = socketserver.TCPServer(("", self.port), handler)
+            # Socket reuse is enabled on ThreadPoolServer to prevent "Address already in use" errors
+            self.server = ThreadPoolServer(("", self.port), handler, workers=self.workers)
             self.start_time = time.time()
 
+            # Expire old requests in the background
+            threading.Thread(target=self._evict_loop, daemon=True).start()
+
             # Print server info with colors
             print(f"\n{Fore.GREEN}{'=' * 80}{Style.RESET_ALL}")
             print(f"{Fore.CYAN}Web Page Assistant Server (Background mode){Style.RESET_ALL}")
             print(f"{Fore.GREEN}{'-' * 80}{Style.RESET_ALL}")
             print(f"{Fore.YELLOW}Server started at{Style.RESET_ALL} http://localhost:{self.port}")
-            print(f"{Fore.YELLOW}Timeout:{Style.RESET_ALL} {self.timeout} seconds")
+            print(f"{Fore.YELLOW}Request timeout:{Style.RESET_ALL} {self.timeout} seconds")
+            print(f"{Fore.YELLOW}Workers:{Style.RESET_ALL} {self.workers}")
+            print(f"{Fore.YELLOW}Backend:{Style.RESET_ALL} {self.backend.name}")
             print(f"{Fore.GREEN}{'-' * 80}{Style.RESET_ALL}")
             print(f"{Fore.CYAN}Ready to receive requests from browser extension...{Style.RESET_ALL}")
             print(f"{Fore.GREEN}{'=' * 80}{Style.RESET_ALL}")
 
+            # Load saved state and pick up requests interrupted by the last shutdown in the background,
+            # so connections are accepted right away
+            threading.Thread(target=self._warm_up, daemon=True).start()
+
             # Run server indefinitely
             self.server.serve_forever()
 
@@ -73,15 +2197,512 @@ class LocalServer:
             else:
                 print(f"\n\n{Fore.RED}Server error: {e}{Style.RESET_ALL}")
         finally:
+            self.stopped.set()
             if self.server:
                 self.server.server_close()
+            self.backend.close()
+            try:
+                self.persist_warm_state()
+            except OSError as e:
+                self.log.error('warm_state_failed', f"Error saving warm state: {e}", error=str(e))
+            self.store.close()
+            self.log.close()
+
+    def _evict_loop(self):
+        """Periodically drop expired requests so a long-running server doesn't keep growing"""
+        while not self.stopped.wait(self.eviction_interval):
+            with self.lock:
+                expired = self.pending_requests.evict_expired()
+                if expired:
+                    # Wake long-polling /results calls waiting on evicted requests
+                    self.results_ready.notify_all()
+
+            for request_id, entry in expired.items():
+                self.dispatch_queue.ack(request_id)
+
+                # A page that timed out before it was answered reports an error instead of disappearing,
+                # and isn't dispatched again after a restart. Segments and packs report through their parent.
+                status = entry.get('status')
+                if status in ('receiving', 'complete', 'pending_chatgpt') \
+                        and 'parent' not in entry and 'batch_documents' not in entry:
+                    message = "Error: the page upload did not finish in time" if status == 'receiving' \
+                        else "Error: ChatGPT did not respond in time"
+                    try:
+                        self.save_result(request_id, message, 'error')
+                    except sqlite3.Error as e:
+                        self.log.error('store_failed', f"Error saving result for request {request_id}: {e}",
+                                       requestId=request_id, error=str(e))
+
+            if expired:
+                self.log.warning('evicted', f"Evicted {len(expired)} expired request(s)", requestIds=list(expired))
+
+            # Hand requests whose connector went away to another connector
+            requeued, abandoned = self.dispatch_queue.requeue_expired()
+            for request_id in requeued:
+                request_info = self.pending_requests.get(request_id)
+                if request_info is not None:
+                    self.log.warning('lease_expired', f"Lease expired for request {request_id}, requeueing",
+                                     requestId=request_id)
+                    self.enqueue_request(request_id, request_info.get('view_in_chatgpt', False))
+            for request_id in abandoned:
+                self.fail_request(request_id, "Error: ChatGPT did not respond")
+
+            # Apply retention limits to the result store
+            if time.time() - self.last_compaction > self.compaction_interval:
+                self.last_compaction = time.time()
+                deleted = self.store.compact()
+                if self.similarity_index:
+                    self.similarity_index.prune()
+                if deleted:
+                    self.log.info('compacted', f"Removed {deleted} old request(s) from the result store",
+                                  count=deleted)
+
+            # Keep the warm-state snapshot recent in case the server doesn't get to save it on shutdown
+            if self.warm_state_interval and time.time() - self.last_warm_state_save > self.warm_state_interval:
+                self.last_warm_state_save = time.time()
+                try:
+                    self.persist_warm_state()
+                except OSError as e:
+                    self.log.error('warm_state_failed', f"Error saving warm state: {e}", error=str(e))
+
+    def in_flight_requests(self):
+        """Number of pages and batches being uploaded or waiting for ChatGPT"""
+        with self.lock:
+            return sum(1 for _, entry in self.pending_requests.items()
+                       if entry.get('status') in ('receiving', 'complete', 'pending_chatgpt')
+                       and 'parent' not in entry and 'batch_documents' not in entry)
+
+    def admit_request(self):
+        """Raise AdmissionError if a new request can't be taken on right now"""
+        depth = self.queue_depth()
+        if self.max_queue_depth and depth >= self.max_queue_depth:
+            raise AdmissionError(503, f"Server is busy: {depth} requests are waiting for ChatGPT", self.retry_after)
+
+        in_flight = self.in_flight_requests()
+        if self.max_in_flight and in_flight >= self.max_in_flight:
+            raise AdmissionError(429, f"Too many requests in progress ({in_flight})", self.retry_after)
+
+    @contextlib.contextmanager
+    def wait_slot(self, wait):
+        """Let a long-poll block for up to `wait` seconds, or not at all if too many workers already are"""
+        with self.lock:
+            granted = wait > 0 and self.waiters < self.max_waiters and not self.server.busy
+            if granted:
+                self.waiters += 1
+        try:
+            yield wait if granted else 0
+        finally:
+            if granted:
+                with self.lock:
+                    self.waiters -= 1
+
+    def queue_depth(self):
+        """Requests waiting for a connector or for the backend"""
+        depth = self.browser_backend.depth()
+        if self.backend is not self.browser_backend:
+            depth += self.backend.depth()
+        return depth
+
+    def enqueue_request(self, request_id, view_in_chatgpt=False):
+        """Hand a request to the backend, or to a browser connector in view mode"""
+        with self.lock:
+            request_info = self.pending_requests.get(request_id)
+            if request_info is not None:
+                request_info['queued_at'] = time.time()
+
+        backend = self.browser_backend if view_in_chatgpt else self.backend
+        backend.submit(request_id, view_in_chatgpt)
+
+    def content_budget(self, view_in_chatgpt=False):
+        """Characters of page content kept for ChatGPT; pages that can be split get room for every segment"""
+        if self.segment_tokens and self.max_content_chars and not view_in_chatgpt:
+            return max(self.max_content_chars, self.segment_tokens * CHARS_PER_TOKEN * self.max_segments)
+        return self.max_content_chars
+
+    def segment_info(self, request_info):
+        """What part of a page, or how many pages, a request's content covers; None for a whole page"""
+        if 'parent' in request_info:
+            return {'stage': request_info['stage'], 'index': request_info['segment_index'],
+                    'total': request_info['segment_total']}
+        if len(request_info.get('batch_documents', ())) > 1:
+            return {'stage': 'batch', 'index': None, 'total': len(request_info['batch_documents'])}
+        if request_info.get('delta_prompt'):
+            return {'stage': 'delta', 'index': None, 'total': None}
+        return None
+
+    def append_partial(self, request_id, text):
+        """Add streamed text to the answer of a request still being answered, waking /results calls"""
+        with self.lock:
+            request_info = self.pending_requests.get(request_id)
+            if request_info is not None and request_info['status'] == 'pending_chatgpt':
+                request_info['partial'] = request_info.get('partial', '') + text
+                self.results_ready.notify_all()
+
+    def dispatch_request(self, request_id):
+        """Send a formatted request to ChatGPT, split into parallel segments if it's too large"""
+        request_info = self.pending_requests[request_id]
+        content = request_info['content']
+        view_in_chatgpt = request_info.get('view_in_chatgpt', False)
+
+        segments = []
+        if self.segment_tokens and not view_in_chatgpt and not request_info.get('delta_prompt') \
+                and len(content) > self.segment_tokens * CHARS_PER_TOKEN:
+            max_chars = max(self.segment_tokens * CHARS_PER_TOKEN, -(-len(content) // self.max_segments))
+            segments = split_into_segments(content, max_chars)
+
+            # Boundaries rarely line up with the budget, so grow segments until they fit in max_segments
+            while len(segments) > self.max_segments:
+                max_chars = int(max_chars * 1.25)
+                segments = split_into_segments(content, max_chars)
+
+        if len(segments) < 2:
+            self.enqueue_request(request_id, view_in_chatgpt)
+            return
+
+        # Map: each segment is analyzed by its own connector; the reduce step is queued once all are done
+        self.log.info('segmented', f"Splitting request {request_id} into {len(segments)} segments",
+                      requestId=request_id, segments=len(segments), chars=len(content))
+        self.metrics.inc('web_assistant_dispatch_total', outcome='segmented')
+        with self.lock:
+            request_info['segments'] = {'stage': 'map', 'total': len(segments), 'completed': 0,
+                                        'results': [None] * len(segments)}
+            self.pending_requests.touch(request_id)
+
+        for index, segment in enumerate(segments):
+            self._enqueue_segment(request_id, f"{request_id}.part{index + 1}", segment, 'map', index)
+
+    def _enqueue_segment(self, parent_id, segment_id, content, stage, index=None):
+        parent = self.pending_requests[parent_id]
+        with self.lock:
+            self.pending_requests[segment_id] = {
+                'prompt': parent['prompt'],
+                'content': content,
+                'timestamp': time.time(),
+                'status': 'pending_chatgpt',
+                'result': None,
+                'total_chunks': 0,
+                'view_in_chatgpt': False,
+                'parent': parent_id,
+                'stage': stage,
+                'segment_index': index,
+                'segment_total': parent['segments']['total']
+            }
+        self.enqueue_request(segment_id)
+
+    def complete_request(self, request_id, response_text, is_error=False):
+        """Store a connector's response; returns False if the request is unknown"""
+        with self.lock:
+            request_info = self.pending_requests.get(request_id)
+            if request_info is None:
+                return False
+
+            if 'leased_at' in request_info:
+                self.metrics.observe('web_assistant_chatgpt_seconds', time.time() - request_info['leased_at'])
+            request_info['status'] = 'completed'
+            request_info['result'] = response_text
+            request_info.pop('partial', None)
+            self.pending_requests.touch(request_id)
+            self.results_ready.notify_all()
+
+        if 'parent' in request_info:
+            self._complete_segment(request_info, response_text, is_error)
+            return True
+
+        if 'batch' in request_info:
+            self._complete_pack(request_info, response_text, is_error)
+            return True
+
+        # Save the result for persistence; errors are stored as such so they are never cached on reload
+        self.save_result(request_id, response_text, 'error' if is_error else 'completed')
+
+        # Remember the answer for identical content and prompt
+        cache_key = request_info.get('cache_key')
+        if self.response_cache and cache_key and response_text and not is_error:
+            self.response_cache.put(cache_key, request_id, response_text)
+
+        # ...and for nearly identical content
+        fingerprint = request_info.get('fingerprint')
+        if self.similarity_index and fingerprint is not None and response_text and not is_error:
+            self.similarity_index.add(request_id, fingerprint, request_info['prompt'])
+
+        # ...and as the base the next delta of this URL is compared with
+        if request_info.get('snapshot_url') is not None and response_text and not is_error:
+            self.store.set_snapshot_answer(request_info['snapshot_url'], request_id, response_text)
+
+        return True
+
+    def _complete_segment(self, segment_info, response_text, is_error):
+        parent_id = segment_info['parent']
+        if is_error:
+            # No point analyzing the other segments once one of them failed
+            for index in range(segment_info['segment_total']):
+                self.dispatch_queue.ack(f"{parent_id}.part{index + 1}")
+            self.fail_request(parent_id, response_text)
+            return
+
+        if segment_info['stage'] == 'reduce':
+            # The merged answer is the answer to the whole page
+            self.complete_request(parent_id, response_text)
+            return
+
+        with self.lock:
+            parent = self.pending_requests.get(parent_id)
+            if parent is None:
+                return
+            segments = parent['segments']
+            if segments['results'][segment_info['segment_index']] is None:
+                segments['completed'] += 1
+            segments['results'][segment_info['segment_index']] = response_text
+
+            start_reduce = segments['stage'] == 'map' and segments['completed'] == segments['total']
+            if start_reduce:
+                segments['stage'] = 'reduce'
+            self.pending_requests.touch(parent_id)
+
+        if start_reduce:
+            # Reduce: merge the partial answers in one final prompt
+            notes = '\n\n'.join(f"Notes from part {index + 1} of {segments['total']}:\n{result}"
+                                 for index, result in enumerate(segments['results']))
+            content = ("The page was too long to analyze at once, so it was split into parts. "
+                       "Below are the notes extracted from each part.\n\n" + notes)
+            self._enqueue_segment(parent_id, f"{parent_id}.reduce", content, 'reduce')
+
+    def dispatch_batch(self, batch_id, documents):
+        """Answer a batch of pages with as few ChatGPT prompts as possible
+
+        Pages with the same content share one answer, pages answered before come from the cache,
+        and the rest are packed into prompts that fit the segment budget.
+        """
+        try:
+            batch_info = self.pending_requests[batch_id]
+            batch = batch_info['batch']
+            prompt = batch_info['prompt']
+
+            # Format every page and find the first page with each content
+            contents, keys, first_index = [], [], {}
+            for index, document in enumerate(documents):
+                content, _ = format_page(document, document.get('text', ''), [document.get('html', '')],
+                                         self.max_content_chars)
+                key = ResponseCache.make_key(content, prompt)
+                contents.append(content)
+                keys.append(key)
+                if key in first_index:
+                    with self.lock:
+                        batch['documents'][index]['duplicate_of'] = first_index[key]
+                    self.metrics.inc('web_assistant_batch_documents_total', outcome='duplicate')
+                else:
+                    first_index[key] = index
+
+            # Set before any page is answered from the cache, which completes the batch if every page is
+            with self.lock:
+                batch_info['status'] = 'pending_chatgpt'
+                self.pending_requests.touch(batch_id)
+
+            to_pack = []
+            for index in first_index.values():
+                cached_response = self.response_cache.get(keys[index]) if self.response_cache else None
+                if cached_response is not None:
+                    self.metrics.inc('web_assistant_batch_documents_total', outcome='cache_hit')
+                    self._complete_batch_document(batch_id, index, cached_response, cached=True)
+                else:
+                    self.metrics.inc('web_assistant_batch_documents_total', outcome='packed')
+                    to_pack.append(index)
+
+            # Leave room for the page markers and the instructions around them
+            budget = (self.segment_tokens * CHARS_PER_TOKEN or self.max_content_chars or sys.maxsize) - 500
+            packs = pack_documents([len(contents[index]) + 20 for index in to_pack], budget, self.batch_pack_size)
+
+            with self.lock:
+                batch['packs'] = len(packs)
+                self.pending_requests.touch(batch_id)
+
+            self.log.info('batch_dispatched', f"Batch {batch_id}: {len(documents)} page(s), {len(first_index)} unique, "
+                                              f"{len(first_index) - len(to_pack)} cached, {len(packs)} prompt(s)",
+                          batchId=batch_id, documents=len(documents), unique=len(first_index),
+                          cached=len(first_index) - len(to_pack), prompts=len(packs))
+
+            for pack_number, pack in enumerate(packs, 1):
+                indexes = [to_pack[position] for position in pack]
+                if len(indexes) == 1:
+                    content = contents[indexes[0]]
+                else:
+                    content = ''.join(f"[[PAGE {number}]]\n{contents[index]}\n\n"
+                                      for number, index in enumerate(indexes, 1))
+
+                pack_id = f"{batch_id}.pack{pack_number}"
+                with self.lock:
+                    self.pending_requests[pack_id] = {
+                        'prompt': prompt,
+                        'content': content,
+                        'timestamp': time.time(),
+                        'status': 'pending_chatgpt',
+                        'result': None,
+                        'total_chunks': 0,
+                        'view_in_chatgpt': False,
+                        'batch': batch_id,
+                        'batch_documents': indexes,
+                        'cache_keys': [keys[index] for index in indexes]
+                    }
+                self.dispatch_request(pack_id)
+
+        except Exception as e:
+            self.log.error('batch_failed', f"Error dispatching batch {batch_id}: {e}", batchId=batch_id, error=str(e))
+            for index in range(len(documents)):
+                self._complete_batch_document(batch_id, index, f"Error: {str(e)}", is_error=True)
+
+    def _complete_pack(self, pack_info, response_text, is_error):
+        indexes = pack_info['batch_documents']
+        if is_error or len(indexes) == 1:
+            answers = [response_text] * len(indexes)
+        else:
+            answers = split_batch_response(response_text, len(indexes))
+
+        for index, answer, cache_key in zip(indexes, answers, pack_info['cache_keys']):
+            if answer is None:
+                # ChatGPT didn't label this page's answer; the whole reply is the best we have
+                self._complete_batch_document(pack_info['batch'], index, response_text)
+            else:
+                self._complete_batch_document(pack_info['batch'], index, answer, is_error=is_error,
+                                              cache_key=cache_key)
+
+    def _complete_batch_document(self, batch_id, index, text, is_error=False, cached=False, cache_key=None):
+        """Record the answer for one page of a batch and for every duplicate of it"""
+        with self.lock:
+            batch_info = self.pending_requests.get(batch_id)
+            if batch_info is None:
+                return
+            documents = batch_info['batch']['documents']
+            for document in documents:
+                if document['status'] == 'pending' and (document is documents[index]
+                                                        or document.get('duplicate_of') == index):
+                    document['status'] = 'error' if is_error else 'completed'
+                    document['result'] = text
+                    document['cached'] = cached
+                    batch_info['batch']['completed'] += 1
+
+            finished = batch_info['batch']['completed'] == len(documents)
+            if finished:
+                batch_info['status'] = 'completed'
+            self.pending_requests.touch(batch_id)
+            self.results_ready.notify_all()
+
+        # Each page's answer is stored on its own so the response cache can point at it
+        document_id = f"{batch_id}.doc{index + 1}"
+        self.save_result(document_id, text, 'error' if is_error else 'completed')
+        if self.response_cache and cache_key and text and not is_error:
+            self.response_cache.put(cache_key, document_id, text)
+
+        if finished:
+            self.save_result(batch_id, json.dumps(self.batch_results(batch_id, batch_info)))
+            self.log.notice('batch_completed', f"Batch {batch_id} complete", batchId=batch_id,
+                            seconds=round(time.time() - batch_info['timestamp'], 3))
+
+    def batch_results(self, batch_id, batch_info):
+        """Per-page results of a batch, as returned by GET /batch/<id>"""
+        with self.lock:
+            batch = batch_info['batch']
+            documents = batch['documents']
+            return {
+                'success': True,
+                'batchId': batch_id,
+                'status': batch_info['status'],
+                'total': len(documents),
+                'completed': batch['completed'],
+                'prompts': batch['packs'],
+                'documents': [{
+                    'id': document['id'],
+                    'url': document['url'],
+                    'status': document['status'],
+                    'result': document['result'],
+                    'cached': document['cached'],
+                    'duplicateOf': documents[document['duplicate_of']]['id'] if 'duplicate_of' in document else None
+                } for document in documents]
+            }
+
+    def resolve_delta(self, chunk):
+        """Turn a delta upload into a text chunk, filling in the blocks it refers to from its URL's snapshot"""
+        metadata = chunk.get('metadata', {})
+        snapshot = self.store.get_snapshot(metadata.get('url', ''))
+        known = dict(zip(snapshot['hashes'], snapshot['blocks'])) if snapshot else {}
+
+        blocks = []
+        for block in chunk.get('blocks', []):
+            if isinstance(block, dict):
+                blocks.append(block.get('text', ''))
+            elif block in known:
+                blocks.append(known[block])
+            else:
+                self.metrics.inc('web_assistant_delta_total', outcome='mismatch')
+                raise SnapshotMismatch(f"No snapshot of {metadata.get('url', '')} has block {block}")
+
+        return {'type': 'text', 'metadata': metadata, 'content': '\n'.join(blocks)}
+
+    def plan_delta(self, request_id, request_info, metadata, blocks):
+        """Compare a delta-mode page with its URL's snapshot, then make the page the new snapshot.
+
+        Returns ('unchanged', previous answer) when nothing changed, ('delta', content) when the changes and
+        the previous answer are enough for ChatGPT, or ('full', None) when the page must be analyzed in full.
+        """
+        url = metadata.get('url', '')
+        prompt_key = SimilarityIndex.prompt_key(request_info['prompt'])
+        hashes = [block_hash(block) for block in blocks]
+        snapshot = self.store.get_snapshot(url)
+
+        outcome, value = 'full', None
+        if snapshot and snapshot['answer'] and snapshot['promptKey'] == prompt_key:
+            removed, added = diff_blocks(snapshot['hashes'], hashes)
+            changed = sum(len(snapshot['blocks'][i]) for i in removed) + sum(len(blocks[i]) for i in added)
+            with self.lock:
+                request_info['delta'] = {'removed': len(removed), 'added': len(added), 'blocks': len(blocks)}
+
+            if not removed and not added:
+                outcome, value = 'unchanged', snapshot['answer']
+            elif changed <= self.delta_max_change * sum(len(block) for block in blocks):
+                outcome = 'delta'
+                value = format_delta(metadata, snapshot['answer'], [snapshot['blocks'][i] for i in removed],
+                                     [blocks[i] for i in added], self.max_content_chars)
+
+        self.store.save_snapshot(url, request_id, prompt_key, blocks, hashes,
+                                 answer=value if outcome == 'unchanged' else None)
+        with self.lock:
+            request_info['snapshot_url'] = url
+        self.metrics.inc('web_assistant_delta_total', outcome=outcome)
+        return outcome, value
+
+    def fail_request(self, request_id, message):
+        """Mark a request as failed and wake anyone waiting on its result"""
+        self.dispatch_queue.ack(request_id)
+        self.save_result(request_id, message, 'error')
+        with self.lock:
+            request_info = self.pending_requests.get(request_id)
+            if request_info is not None:
+                request_info['status'] = 'error'
+                request_info['result'] = message
+                self.pending_requests.touch(request_id)
+            self.results_ready.notify_all()
+
+        if request_info is not None and 'batch' in request_info:
+            self._complete_pack(request_info, message, True)
+
+    def hand_off_request(self, request_id):
+        """Finish a view mode request once its ChatGPT tab has taken it; the answer stays in that tab"""
+        message = "Opened in ChatGPT"
+        self.dispatch_queue.ack(request_id)
+        self.save_result(request_id, message)
+        with self.lock:
+            request_info = self.pending_requests.get(request_id)
+            if request_info is not None:
+                request_info['status'] = 'completed'
+                request_info['result'] = message
+                self.pending_requests.touch(request_id)
+            self.results_ready.notify_all()
 
     def open_browser_in_background(self, url, view_in_chatgpt=False):
         """Open a browser tab in the background if possible, foreground if view_in_chatgpt is True"""
         try:
             # If view_in_chatgpt is True, always open in foreground
             if view_in_chatgpt:
-                print(f"{Fore.CYAN}Opening ChatGPT in foreground (view mode){Style.RESET_ALL}")
+                self.log.info('browser_opened', "Opening ChatGPT in foreground (view mode)")
                 webbrowser.open(url)
                 return True
 
@@ -91,7 +2712,7 @@ class LocalServer:
             if platform == 'darwin':  # macOS
                 # Use 'open -g' to open in background
                 subprocess.Popen(['open', '-g', url])
-                print(f"{Fore.CYAN}Opened ChatGPT in background (macOS){Style.RESET_ALL}")
+                self.log.info('browser_opened', "Opened ChatGPT in background (macOS)")
                 return True
 
             elif platform == 'win32':  # Windows
@@ -99,33 +2720,33 @@ class LocalServer:
                 try:
                     # First try with just /b for background
                     subprocess.Popen(['start', '/b', url], shell=True)
-                    print(f"{Fore.CYAN}Opened ChatGPT in background (Windows){Style.RESET_ALL}")
+                    self.log.info('browser_opened', "Opened ChatGPT in background (Windows)")
                     return True
                 except:
                     # If that fails, fall back to standard webbrowser
                     webbrowser.open_new_tab(url)
-                    print(f"{Fore.YELLOW}Opened ChatGPT normally (Windows fallback){Style.RESET_ALL}")
+                    self.log.warning('browser_opened', "Opened ChatGPT normally (Windows fallback)")
                     return True
 
             elif platform.startswith('linux'):  # Linux
                 # For Linux, try xdg-open with output redirection
                 try:
                     subprocess.Popen(['xdg-open', url], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                    print(f"{Fore.CYAN}Opened ChatGPT in background (Linux){Style.RESET_ALL}")
+                    self.log.info('browser_opened', "Opened ChatGPT in background (Linux)")
                     return True
                 except:
                     # Fall back to standard webbrowser
                     webbrowser.open_new_tab(url)
-                    print(f"{Fore.YELLOW}Opened ChatGPT normally (Linux fallback){Style.RESET_ALL}")
+                    self.log.warning('browser_opened', "Opened ChatGPT normally (Linux fallback)")
                     return True
 
             # Default fallback for other platforms
             webbrowser.open_new_tab(url)
-            print(f"{Fore.YELLOW}Opened ChatGPT normally (default method){Style.RESET_ALL}")
+            self.log.warning('browser_opened', "Opened ChatGPT normally (default method)")
             return True
 
         except Exception as e:
-            print(f"{Fore.RED}Error opening browser: {e}{Style.RESET_ALL}")
+            self.log.error('browser_error', f"Error opening browser: {e}", error=str(e))
             return False
 
     def _create_handler(self):
@@ -133,6 +2754,12 @@ class LocalServer:
         server_instance = self  # Reference to the server instance
 
         class CustomHandler(http.server.SimpleHTTPRequestHandler):
+            # Keep connections open between requests; idle ones are closed after keepalive_timeout
+            protocol_version = 'HTTP/1.1'
+            timeout = server_instance.keepalive_timeout
+            # Headers and body go out in separate writes; don't let Nagle hold the body back on a reused connection
+            disable_nagle_algorithm = True
+
             def log_message(self, format, *args):
                 # Suppress default logging to keep console clean
                 return
@@ -141,322 +2768,782 @@ class LocalServer:
                 self.send_response(200)
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+                self.send_header('Access-Control-Allow-Headers', 'Content-Type, Content-Encoding')
+                self.send_header('Content-Length', '0')
                 self.end_headers()
 
+            def read_body(self):
+                """Read the raw request body, which must be fully consumed to keep the connection usable"""
+                content_length = int(self.headers.get('Content-Length', 0))
+                server_instance.metrics.observe('web_assistant_request_body_bytes', content_length)
+                return self.rfile.read(content_length)
+
+            def discard_body(self):
+                """Skip an oversized body without holding it in memory, or drop the connection if it's huge"""
+                remaining = int(self.headers.get('Content-Length', 0))
+                if remaining > 4 * server_instance.max_body_bytes:
+                    self.close_connection = True
+                    return
+                while remaining > 0:
+                    data = self.rfile.read(min(remaining, 64 * 1024))
+                    if not data:
+                        break
+                    remaining -= len(data)
+
+            def decode_body(self, body):
+                """Decompress a body sent with Content-Encoding and decode it as UTF-8"""
+                limit = server_instance.max_body_bytes
+                encoding = self.headers.get('Content-Encoding', 'identity').strip().lower()
+                if encoding not in ('identity', 'gzip') and not (encoding == 'zstd' and zstd is not None):
+                    raise AdmissionError(415, f"Unsupported Content-Encoding: {encoding}")
+                try:
+                    if encoding == 'gzip':
+                        # Stop inflating as soon as the body is over the limit
+                        inflater = zlib.decompressobj(wbits=31)
+                        body = inflater.decompress(body, limit + 1)
+                        if len(body) <= limit and not inflater.eof:
+                            raise ValueError("truncated gzip stream")
+                    elif encoding == 'zstd':
+                        body = inflate_zstd(body, limit + 1)
+                except Exception as e:
+                    raise AdmissionError(400, f"Request body could not be decoded as {encoding}: {e}")
+                if len(body) > limit:
+                    raise AdmissionError(413, f"Request body is larger than {limit} bytes")
+                try:
+                    return body.decode('utf-8')
+                except UnicodeDecodeError as e:
+                    raise AdmissionError(400, f"Request body is not valid UTF-8: {e}")
+
+            def wait_param(self, query, maximum):
+                """Seconds from a ?wait= query parameter, clamped to [0, maximum]; 0 unless it's a finite number"""
+                try:
+                    wait = float(query.get('wait', ['0'])[0])
+                except ValueError:
+                    return 0
+                return min(max(wait, 0), maximum) if math.isfinite(wait) else 0
+
+            def reject(self, error):
+                """Answer a request refused by admission control"""
+                server_instance.metrics.inc('web_assistant_rejected_total', status=str(error.status))
+                server_instance.log.log('warning', 'rejected', f"Rejected {self.path} with {error.status}: {error}",
+                                        sampled=True, status=error.status, path=self.path, error=str(error))
+                self.send_json(error.status, {
+                    'success': False,
+                    'error': str(error),
+                    'retryAfter': error.retry_after
+                }, headers={'Retry-After': str(error.retry_after)} if error.retry_after else None)
+
+            def response_encoding(self):
+                """Best Content-Encoding the client accepts, or None"""
+                accepted = set()
+                for item in self.headers.get('Accept-Encoding', '').split(','):
+                    name, _, params = item.partition(';')
+                    if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                        accepted.add(name.strip().lower())
+                if zstd is not None and 'zstd' in accepted:
+                    return 'zstd'
+                if 'gzip' in accepted:
+                    return 'gzip'
+                return None
+
+            def send_body(self, status, body, content_type='application/json', headers=None):
+                """Send a complete response framed by Content-Length, compressed when the client accepts it"""
+                encoding = self.response_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+                if encoding == 'zstd':
+                    body = zstd.compress(body)
+                elif encoding == 'gzip':
+                    body = gzip.compress(body, compresslevel=5)
+
+                self.send_response(status)
+                self.send_header('Content-type', content_type)
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('Vary', 'Accept-Encoding')
+                if encoding:
+                    self.send_header('Content-Encoding', encoding)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                if server_instance.server.busy:
+                    # Hand the worker to a connection waiting in the queue
+                    self.close_connection = True
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(body)
+                server_instance.metrics.observe('web_assistant_response_body_bytes', len(body))
+
+            def send_json(self, status, payload, headers=None):
+                self.send_body(status, json.dumps(payload).encode(), headers=headers)
+
             def do_POST(self):
+                # Refuse oversized bodies before reading them into memory
+                if int(self.headers.get('Content-Length', 0)) > server_instance.max_body_bytes:
+                    self.discard_body()
+                    self.reject(AdmissionError(
+                        413, f"Request body is larger than {server_instance.max_body_bytes} bytes"))
+                    return
+
                 if self.path == '/analyze':
-                    content_length = int(self.headers['Content-Length'])
-                    post_data = self.rfile.read(content_length)
+                    received_at = time.time()
+                    post_data = self.read_body()
 
                     try:
-                        data = json.loads(post_data.decode('utf-8'))
+                        body = self.decode_body(post_data)
+                        data = json.loads(body)
                         request_id = data.get('requestId', str(time.time()))
                         prompt = data.get('prompt', '')
                         chunk_index = data.get('chunkIndex', 0)
                         total_chunks = data.get('totalChunks', 1)
-                        is_last_chunk = data.get('isLastChunk', False)
                         view_in_chatgpt = data.get('viewInChatGPT', False)
                         chunk = data.get('chunk', {})
 
-                        print(
-                            f"{Fore.CYAN}[{time.strftime('%H:%M:%S')}] Received chunk {chunk_index + 1}/{total_chunks} for request {request_id}{Style.RESET_ALL}")
-
-                        # Initialize request if this is the first chunk
-                        if chunk_index == 0:
-                            server_instance.pending_requests[request_id] = {
-                                'prompt': prompt,
-                                'chunks': [None] * total_chunks,
-                                'timestamp': time.time(),
-                                'status': 'receiving',
-                                'result': None,
-                                'total_chunks': total_chunks,
-                                'view_in_chatgpt': view_in_chatgpt
-                            }
-
-                        # Store this chunk
-                        if request_id in server_instance.pending_requests:
-                            server_instance.pending_requests[request_id]['chunks'][chunk_index] = chunk
-
-                            # Check if this is the last chunk or if we have all chunks
-                            if is_last_chunk or all(
-                                    c is not None for c in server_instance.pending_requests[request_id]['chunks']):
-                                server_instance.pending_requests[request_id]['status'] = 'complete'
-
-                                # Process all chunks with ChatGPT in a separate thread
-                                threading.Thread(
-                                    target=self.process_with_chatgpt,
-                                    args=(request_id,),
-                                    daemon=True
-                                ).start()
+                        # Malformed uploads are turned away before they take an in-flight slot
+                        if not all(isinstance(value, int) and not isinstance(value, bool)
+                                   for value in (chunk_index, total_chunks)):
+                            raise AdmissionError(400, "chunkIndex and totalChunks must be integers")
+                        if total_chunks < 1:
+                            raise AdmissionError(400, "totalChunks must be at least 1")
+                        if not 0 <= chunk_index < total_chunks:
+                            raise AdmissionError(
+                                400, f"Chunk index {chunk_index} out of range for {total_chunks} chunks")
+
+                        if total_chunks > server_instance.max_total_chunks:
+                            raise AdmissionError(
+                                413, f"A request can have at most {server_instance.max_total_chunks} chunks")
+
+                        if chunk.get('type') == 'delta':
+                            # Only changed blocks were sent, the others are taken from the URL's snapshot
+                            if total_chunks != 1:
+                                raise ValueError("A delta upload must be sent as a single chunk")
+                            chunk = server_instance.resolve_delta(chunk)
+
+                        server_instance.log.log('info', 'chunk_received',
+                                                f"Received chunk {chunk_index + 1}/{total_chunks} for request {request_id}",
+                                                sampled=True, requestId=request_id, chunkIndex=chunk_index,
+                                                totalChunks=total_chunks, bytes=len(post_data))
+
+                        with server_instance.lock:
+                            # Initialize request on whichever chunk arrives first
+                            request_info = server_instance.pending_requests.get(request_id)
+                            if request_info is None:
+                                # Chunks of requests already admitted are always accepted
+                                server_instance.admit_request()
+                                request_info = {
+                                    'prompt': prompt,
+                                    'assembler': ChunkAssembler(total_chunks),
+                                    'timestamp': time.time(),
+                                    'status': 'receiving',
+                                    'result': None,
+                                    'total_chunks': total_chunks,
+                                    'view_in_chatgpt': view_in_chatgpt,
+                                    'delta_mode': bool(data.get('delta', False))
+                                }
+                                server_instance.pending_requests[request_id] = request_info
+                            elif request_info['total_chunks'] != total_chunks:
+                                raise ValueError(
+                                    f"Request {request_id} expects {request_info['total_chunks']} chunks, got {total_chunks}")
+                            assembler = request_info.get('assembler')
+
+                        # Store this chunk outside the server lock so uploads don't block each other.
+                        # Chunks arriving after the request was assembled are duplicates of a resend.
+                        if request_info['status'] == 'receiving':
+                            if assembler.bytes_received + len(body) > server_instance.max_request_bytes:
+                                # The page can never fit, so drop what was received so far
+                                message = f"Request is larger than {server_instance.max_request_bytes} bytes"
+                                with server_instance.lock:
+                                    request_info.pop('assembler').close()
+                                server_instance.fail_request(request_id, f"Error: {message}")
+                                raise AdmissionError(413, message)
+                            assembler.add(chunk_index, chunk)
+
+                        ready = False
+                        with server_instance.lock:
+                            # Only the first worker to see completion moves the request on
+                            if request_info['status'] == 'receiving' and assembler.complete:
+                                request_info['status'] = 'complete'
+                                ready = True
+
+                            server_instance.pending_requests.touch(request_id)
+
+                        metrics = server_instance.metrics
+                        metrics.inc('web_assistant_chunks_received_total')
+                        metrics.observe('web_assistant_chunk_receive_seconds', time.time() - received_at)
+                        if ready:
+                            metrics.observe('web_assistant_assembly_seconds', time.time() - request_info['timestamp'])
+
+                        if ready:
+                            # Process all chunks with ChatGPT in a separate thread
+                            threading.Thread(
+                                target=self.process_with_chatgpt,
+                                args=(request_id,),
+                                daemon=True
+                            ).start()
 
                         # Send success response
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-
-                        self.wfile.write(json.dumps({
+                        self.send_json(200, {
                             'success': True,
                             'message': f"Received chunk {chunk_index + 1}/{total_chunks}",
-                            'requestId': request_id
-                        }).encode())
-
+                            'requestId': request_id,
+                            'received': assembler.received_count if assembler else total_chunks,
+                            'complete': request_info['status'] != 'receiving'
+                        })
+
+                    except AdmissionError as e:
+                        self.reject(e)
+                    except SnapshotMismatch as e:
+                        server_instance.log.info('snapshot_mismatch', str(e), error=str(e))
+                        self.send_json(409, {
+                            'success': False,
+                            'error': str(e),
+                            'fullUpload': True
+                        })
                     except Exception as e:
-                        print(f"{Fore.RED}Error processing request: {e}{Style.RESET_ALL}")
-                        self.send_response(500)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-
-                        self.wfile.write(json.dumps({
+                        server_instance.log.error('chunk_failed', f"Error processing request: {e}", error=str(e))
+                        self.send_json(500, {
                             'success': False,
                             'error': str(e)
-                        }).encode())
+                        })
 
                 elif self.path == '/response':
                     # Handle response from ChatGPT connector
-                    content_length = int(self.headers['Content-Length'])
-                    post_data = self.rfile.read(content_length)
+                    post_data = self.read_body()
 
                     try:
-                        data = json.loads(post_data.decode('utf-8'))
+                        data = json.loads(self.decode_body(post_data))
                         response_text = data.get('response', '')
                         request_id = data.get('requestId', '')
+                        is_error = data.get('error', False)
+
+                        server_instance.log.notice('response_received',
+                                                   f"Received ChatGPT response for request {request_id}",
+                                                   requestId=request_id, chars=len(response_text), error=is_error)
+
+                        # Acknowledge the lease so the request isn't handed to another connector
+                        server_instance.dispatch_queue.ack(request_id)
+                        server_instance.metrics.inc('web_assistant_responses_total', error=str(bool(is_error)).lower())
+
+                        # Save the response, even if the request already left memory but is still pending on disk
+                        saved = server_instance.complete_request(request_id, response_text, is_error)
+                        if not saved and not is_error:
+                            saved = server_instance.store.save_late_result(request_id, response_text)
+
+                        if saved:
+                            server_instance.log.notice('response_saved', f"Saved response for request {request_id}",
+                                                       requestId=request_id)
+                            self.send_json(200, {
+                                'success': True
+                            })
+                        else:
+                            self.send_json(404, {
+                                'success': False,
+                                'error': 'Unknown or expired request'
+                            })
 
-                        print(
-                            f"{Fore.GREEN}[{time.strftime('%H:%M:%S')}] Received ChatGPT response for request {request_id}{Style.RESET_ALL}")
-
-                        # Save the response
-                        if request_id in server_instance.pending_requests:
-                            server_instance.pending_requests[request_id]['status'] = 'completed'
-                            server_instance.pending_requests[request_id]['result'] = response_text
+                    except AdmissionError as e:
+                        self.reject(e)
+                    except Exception as e:
+                        server_instance.log.error('response_failed', f"Error processing ChatGPT response: {e}",
+                                                  error=str(e))
+                        self.send_json(500, {
+                            'success': False,
+                            'error': str(e)
+                        })
+                elif self.path == '/batch':
+                    # Many pages analyzed with the same prompt, answered together
+                    post_data = self.read_body()
 
-                            # Save to file for persistence
-                            result_file = server_instance.cache_dir / f"result_{request_id}.json"
-                            with open(result_file, 'w', encoding='utf-8') as f:
-                                json.dump({
-                                    'requestId': request_id,
-                                    'response': response_text,
-                                    'timestamp': time.time()
-                                }, f)
+                    try:
+                        data = json.loads(self.decode_body(post_data))
+                        batch_id = data.get('batchId') or str(time.time())
+                        documents = data.get('documents')
+                        if not isinstance(documents, list) or not documents:
+                            raise ValueError("A batch needs a non-empty list of documents")
+                        if len(documents) > server_instance.max_total_chunks:
+                            raise AdmissionError(
+                                413, f"A batch can have at most {server_instance.max_total_chunks} documents")
+
+                        with server_instance.lock:
+                            if batch_id in server_instance.pending_requests:
+                                raise ValueError(f"Batch {batch_id} already exists")
+                            server_instance.admit_request()
+                            server_instance.pending_requests[batch_id] = {
+                                'prompt': data.get('prompt', ''),
+                                'timestamp': time.time(),
+                                'status': 'complete',
+                                'result': None,
+                                'total_chunks': 0,
+                                'batch': {
+                                    'documents': [{
+                                        'id': str(document.get('id') or document.get('url') or index + 1),
+                                        'url': document.get('url', ''),
+                                        'status': 'pending',
+                                        'result': None,
+                                        'cached': False
+                                    } for index, document in enumerate(documents)],
+                                    'completed': 0,
+                                    'packs': 0
+                                }
+                            }
 
-                            print(f"{Fore.GREEN}Saved response for request {request_id}{Style.RESET_ALL}")
+                        server_instance.log.info('batch_received',
+                                                 f"Received batch {batch_id} with {len(documents)} page(s)",
+                                                 batchId=batch_id, documents=len(documents), bytes=len(post_data))
 
-                        # Send success response
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
+                        threading.Thread(
+                            target=server_instance.dispatch_batch,
+                            args=(batch_id, documents),
+                            daemon=True
+                        ).start()
 
-                        self.wfile.write(json.dumps({
-                            'success': True
-                        }).encode())
+                        self.send_json(200, {
+                            'success': True,
+                            'batchId': batch_id,
+                            'documents': len(documents)
+                        })
 
+                    except AdmissionError as e:
+                        self.reject(e)
                     except Exception as e:
-                        print(f"{Fore.RED}Error processing ChatGPT response: {e}{Style.RESET_ALL}")
-                        self.send_response(500)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-
-                        self.wfile.write(json.dumps({
+                        server_instance.log.error('batch_failed', f"Error processing batch: {e}", error=str(e))
+                        self.send_json(500, {
                             'success': False,
                             'error': str(e)
-                        }).encode())
+                        })
                 else:
-                    self.send_response(404)
-                    self.end_headers()
-                    self.wfile.write(b'Not found')
+                    self.read_body()
+                    self.send_body(404, b'Not found', 'text/plain')
 
             def do_GET(self):
                 if self.path == '/status':
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-
                     uptime = time.time() - server_instance.start_time
 
-                    self.wfile.write(json.dumps({
+                    self.send_json(200, {
                         'status': 'running',
-                        'uptime': uptime
-                    }).encode())
+                        'uptime': uptime,
+                        'workers': server_instance.workers,
+                        'features': server_instance.features,
+                        'limits': {
+                            'maxBodyBytes': server_instance.max_body_bytes,
+                            'maxRequestBytes': server_instance.max_request_bytes,
+                            'maxTotalChunks': server_instance.max_total_chunks,
+                            'maxInFlight': server_instance.max_in_flight,
+                            'maxQueueDepth': server_instance.max_queue_depth,
+                            'maxWaiters': server_instance.max_waiters,
+                            'inFlight': server_instance.in_flight_requests(),
+                            'waiters': server_instance.waiters
+                        },
+                        'requests': server_instance.pending_requests.stats(),
+                        'cache': server_instance.response_cache.stats() if server_instance.response_cache else None,
+                        'queue': server_instance.dispatch_queue.stats(),
+                        'backend': server_instance.backend.stats(),
+                        'reduction': server_instance.reduction_totals,
+                        'store': server_instance.store.stats(),
+                        'similarity': server_instance.similarity_index.stats() if server_instance.similarity_index else None,
+                        'warmup': server_instance.warmup.stats()
+                    })
+
+                elif self.path == '/metrics':
+                    self.send_body(200, server_instance.metrics.render().encode(), 'text/plain; version=0.0.4')
+
+                elif self.path.startswith('/snapshot'):
+                    # Block hashes of the last version of a page, so a delta upload only sends what changed
+                    query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+                    try:
+                        snapshot = server_instance.store.get_snapshot(query.get('url', [''])[0])
+                    except sqlite3.Error:
+                        snapshot = None
+
+                    if snapshot is not None:
+                        self.send_json(200, {
+                            'success': True,
+                            'requestId': snapshot['requestId'],
+                            'hashes': snapshot['hashes'],
+                            'answered': snapshot['answer'] is not None,
+                            'updated': snapshot['updated']
+                        })
+                    else:
+                        self.send_json(404, {
+                            'success': False,
+                            'error': 'No snapshot of this page'
+                        })
+
+                elif self.path.startswith('/analyze/'):
+                    # Upload progress, so a client can resend only the chunks that are missing
+                    request_id = self.path.split('/')[-1]
+                    request_info = server_instance.pending_requests.get(request_id)
+
+                    if request_info is not None:
+                        receiving = request_info['status'] == 'receiving'
+                        assembler = request_info.get('assembler')
+
+                        self.send_json(200, {
+                            'success': True,
+                            'requestId': request_id,
+                            'status': request_info['status'],
+                            'totalChunks': request_info['total_chunks'],
+                            'received': assembler.received_count if receiving else request_info['total_chunks'],
+                            'missing': assembler.missing() if receiving else []
+                        })
+                    else:
+                        self.send_json(404, {
+                            'success': False,
+                            'error': 'Unknown request'
+                        })
+
+                elif self.path.startswith('/batch/'):
+                    url = urllib.parse.urlsplit(self.path)
+                    batch_id = url.path.split('/')[-1]
+
+                    # ?wait=<seconds> long-polls until every page of the batch is answered
+                    query = urllib.parse.parse_qs(url.query)
+                    wait = self.wait_param(query, server_instance.max_result_wait)
+
+                    with server_instance.wait_slot(wait) as wait, server_instance.lock:
+                        deadline = time.time() + wait
+                        while True:
+                            batch_info = server_instance.pending_requests.get(batch_id)
+                            remaining = deadline - time.time()
+                            if batch_info is None or 'batch' not in batch_info \
+                                    or batch_info['status'] == 'completed' or remaining <= 0:
+                                break
+                            server_instance.results_ready.wait(remaining)
+
+                        results = server_instance.batch_results(batch_id, batch_info) \
+                            if batch_info is not None and 'batch' in batch_info else None
+
+                    if results is None:
+                        # Finished batches are stored as a whole once their last page is answered
+                        try:
+                            stored = server_instance.store.get_result(batch_id)
+                        except sqlite3.Error:
+                            stored = None
+                        if stored is not None and stored[0] == 'completed':
+                            results = json.loads(stored[1])
+
+                    if results is not None:
+                        self.send_json(200, results)
+                    else:
+                        self.send_json(404, {
+                            'success': False,
+                            'error': 'Unknown batch'
+                        })
 
                 elif self.path.startswith('/content'):
                     # This endpoint will be called by the ChatGPT connector script
-                    path_parts = self.path.split('/')
+                    url = urllib.parse.urlsplit(self.path)
+                    path_parts = url.path.split('/')
                     request_id = path_parts[-1] if len(path_parts) > 2 else None
+                    lease_id = None
 
                     if not request_id or request_id == 'content':
-                        # Find the most recent pending request
-                        pending = [req_id for req_id, req in server_instance.pending_requests.items()
-                                   if req['status'] == 'pending_chatgpt']
-                        if pending:
-                            # Sort by timestamp (newest first) and get the request ID
-                            pending.sort(key=lambda req_id: -server_instance.pending_requests[req_id]['timestamp'])
-                            request_id = pending[0]
-
-                    if request_id and request_id in server_instance.pending_requests:
-                        request_info = server_instance.pending_requests[request_id]
-
-                        # Format data for ChatGPT
-                        formatted_content = self.format_content_for_chatgpt(request_id, request_info)
-
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-
-                        self.wfile.write(json.dumps({
+                        # Lease the next queued request. ?wait=<seconds> blocks until one is ready,
+                        # and ?pool=1 marks an idle connector tab waiting to be reused.
+                        query = urllib.parse.parse_qs(url.query)
+                        wait = self.wait_param(query, server_instance.max_content_wait)
+                        pooled = query.get('pool', ['0'])[0] == '1'
+
+                        request_info = None
+                        with server_instance.wait_slot(wait) as wait:
+                            while request_info is None:
+                                lease = server_instance.dispatch_queue.lease(wait=wait, pooled=pooled)
+                                if lease is None:
+                                    request_id = None
+                                    break
+                                request_id, lease_id = lease
+                                request_info = server_instance.pending_requests.get(request_id)
+                                if request_info is None:
+                                    # Evicted while queued
+                                    server_instance.dispatch_queue.ack(request_id)
+                    else:
+                        request_info = server_instance.pending_requests.get(request_id)
+
+                    # Format data for ChatGPT, unless it was already formatted at dispatch. Batch parents have
+                    # no content of their own, and a request's chunks may be released while they are read.
+                    formatted_content = None
+                    if request_info is not None:
+                        try:
+                            formatted_content = request_info.get('content') or (
+                                self.format_content_for_chatgpt(request_id, request_info)
+                                if request_info.get('assembler') is not None else None)
+                        except (KeyError, ValueError, OSError):
+                            formatted_content = request_info.get('content')
+
+                    if formatted_content is not None:
+                        if lease_id is not None:
+                            request_info['leased_at'] = time.time()
+                            server_instance.metrics.observe('web_assistant_queue_wait_seconds', request_info[
+                                'leased_at'] - request_info.get('queued_at', request_info['leased_at']))
+                        server_instance.metrics.inc('web_assistant_content_served_total')
+
+                        view_in_chatgpt = request_info.get('view_in_chatgpt', False)
+                        segment = server_instance.segment_info(request_info)
+
+                        self.send_json(200, {
                             'content': formatted_content,
                             'prompt': request_info['prompt'],
                             'requestId': request_id,
                             'timestamp': request_info['timestamp'],
-                            'viewInChatGPT': request_info.get('view_in_chatgpt', False)
-                        }).encode())
-
-                        print(
-                            f"{Fore.CYAN}Served content for request {request_id} to ChatGPT connector{Style.RESET_ALL}")
+                            'viewInChatGPT': view_in_chatgpt,
+                            'leaseId': lease_id,
+                            'leaseTimeout': server_instance.dispatch_queue.lease_timeout,
+                            'features': server_instance.features,
+                            'segment': segment,
+                            # What the connector types into ChatGPT
+                            'message': build_chat_prompt(request_info['prompt'], formatted_content, segment,
+                                                         view_in_chatgpt)
+                        })
+
+                        server_instance.log.info('content_served',
+                                                 f"Served content for request {request_id} to ChatGPT connector",
+                                                 requestId=request_id, chars=len(formatted_content),
+                                                 leased=lease_id is not None)
+
+                        # The connector never posts view mode answers back, so the request is done here
+                        if lease_id is not None and view_in_chatgpt:
+                            server_instance.hand_off_request(request_id)
                     else:
-                        self.send_response(404)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-
-                        self.wfile.write(json.dumps({
+                        self.send_json(404, {
                             'success': False,
                             'error': 'No pending request found'
-                        }).encode())
+                        })
 
                 elif self.path.startswith('/results/'):
-                    request_id = self.path.split('/')[-1]
+                    url = urllib.parse.urlsplit(self.path)
+                    request_id = url.path.split('/')[-1]
 
-                    # Check if we have results for this request
-                    if request_id in server_instance.pending_requests and server_instance.pending_requests[request_id][
-                        'status'] == 'completed':
-                        result = server_instance.pending_requests[request_id]['result']
+                    # Optional ?wait=<seconds> turns this into a long-poll that returns as soon as
+                    # the connector posts the answer instead of making the page poll repeatedly
+                    query = urllib.parse.parse_qs(url.query)
+                    wait = self.wait_param(query, server_instance.max_result_wait)
 
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
+                    # With ?partial=<characters already shown>, a long-poll also returns as soon as
+                    # more of a streamed answer has arrived
+                    try:
+                        seen = int(query['partial'][0]) if 'partial' in query else None
+                    except ValueError:
+                        seen = None
 
-                        self.wfile.write(json.dumps({
+                    # Check if we have results for this request
+                    with server_instance.wait_slot(wait) as wait, server_instance.lock:
+                        deadline = time.time() + wait
+                        while True:
+                            request_info = server_instance.pending_requests.get(request_id)
+                            completed = request_info is not None and request_info['status'] == 'completed'
+                            remaining = deadline - time.time()
+                            if completed or request_info is None or request_info['status'] == 'error' \
+                                    or remaining <= 0:
+                                break
+                            if seen is not None and len(request_info.get('partial') or '') > seen:
+                                break
+                            server_instance.results_ready.wait(remaining)
+
+                        partial = request_info.get('partial') if request_info is not None else None
+
+                        failed = request_info is not None and request_info['status'] == 'error'
+                        result = request_info['result'] if completed or failed else None
+
+                        # Progress of a page split into segments
+                        segments = request_info.get('segments') if request_info is not None else None
+                        progress = {key: segments[key] for key in ('stage', 'total', 'completed')} if segments else None
+
+                        # Count each result once, however many times the page asks for it
+                        first_delivery = completed and not request_info.get('delivered')
+                        if first_delivery:
+                            request_info['delivered'] = True
+
+                    if first_delivery:
+                        server_instance.metrics.inc('web_assistant_results_delivered_total')
+                        server_instance.metrics.observe('web_assistant_end_to_end_seconds',
+                                                        time.time() - request_info['timestamp'])
+
+                    if completed:
+                        self.send_json(200, {
                             'success': True,
                             'response': result,
+                            'requestId': request_id,
+                            'cached': request_info.get('cached', False),
+                            'approximate': request_info.get('approximate'),
+                            'delta': request_info.get('delta'),
+                            'segments': progress
+                        })
+                    elif failed:
+                        self.send_json(500, {
+                            'success': False,
+                            'error': result,
                             'requestId': request_id
-                        }).encode())
+                        })
                     else:
-                        # Check if there's a saved result file
-                        result_file = server_instance.cache_dir / f"result_{request_id}.json"
-                        if result_file.exists():
-                            try:
-                                with open(result_file, 'r', encoding='utf-8') as f:
-                                    result_data = json.load(f)
-
-                                self.send_response(200)
-                                self.send_header('Content-type', 'application/json')
-                                self.send_header('Access-Control-Allow-Origin', '*')
-                                self.end_headers()
-
-                                self.wfile.write(json.dumps({
-                                    'success': True,
-                                    'response': result_data['response'],
-                                    'requestId': request_id
-                                }).encode())
-                            except Exception as e:
-                                self.send_response(500)
-                                self.send_header('Content-type', 'application/json')
-                                self.send_header('Access-Control-Allow-Origin', '*')
-                                self.end_headers()
-
-                                self.wfile.write(json.dumps({
-                                    'success': False,
-                                    'error': f'Error reading result file: {str(e)}'
-                                }).encode())
+                        # Check if there's a stored result
+                        try:
+                            stored = server_instance.store.get_result(request_id)
+                        except sqlite3.Error as e:
+                            stored = ('error', f'Error reading result store: {str(e)}')
+
+                        if stored is not None and stored[0] == 'completed':
+                            self.send_json(200, {
+                                'success': True,
+                                'response': stored[1],
+                                'requestId': request_id
+                            })
+                        elif stored is not None:
+                            self.send_json(500, {
+                                'success': False,
+                                'error': stored[1],
+                                'requestId': request_id
+                            })
                         else:
-                            self.send_response(404)
-                            self.send_header('Content-type', 'application/json')
-                            self.send_header('Access-Control-Allow-Origin', '*')
-                            self.end_headers()
-
-                            self.wfile.write(json.dumps({
+                            self.send_json(404, {
                                 'success': False,
-                                'error': 'No results found for this request'
-                            }).encode())
+                                'error': 'No results found for this request',
+                                'segments': progress,
+                                'partial': partial
+                            })
                 else:
-                    self.send_response(404)
-                    self.end_headers()
-                    self.wfile.write(b'Not found')
+                    self.send_body(404, b'Not found', 'text/plain')
 
             def process_with_chatgpt(self, request_id):
-                """Process all content chunks with ChatGPT by opening a browser window"""
+                """Format the assembled page and answer it from the cache or hand it to the backend"""
                 try:
-                    print(f"{Fore.CYAN}Processing request {request_id} with ChatGPT{Style.RESET_ALL}")
-
-                    # Get view_in_chatgpt flag
-                    view_in_chatgpt = server_instance.pending_requests[request_id].get('view_in_chatgpt', False)
+                    server_instance.log.info('processing', f"Processing request {request_id} with ChatGPT",
+                                             requestId=request_id)
 
-                    # Mark this request as pending ChatGPT processing
-                    server_instance.pending_requests[request_id]['status'] = 'pending_chatgpt'
+                    dispatch_start = time.time()
+                    request_info = server_instance.pending_requests[request_id]
 
-                    # Create a file to store the content
-                    content_file = server_instance.cache_dir / f"content_{request_id}.json"
-                    with open(content_file, 'w', encoding='utf-8') as f:
-                        json.dump(server_instance.pending_requests[request_id], f)
-
-                    # Open ChatGPT in foreground or background based on mode
-                    print(
-                        f"{Fore.YELLOW}Opening ChatGPT for request {request_id} (View mode: {view_in_chatgpt}){Style.RESET_ALL}")
-
-                    # Use the browser opening method that supports background opening
-                    server_instance.open_browser_in_background("https://chatgpt.com/", view_in_chatgpt)
+                    # Get view_in_chatgpt flag
+                    view_in_chatgpt = request_info.get('view_in_chatgpt', False)
+
+                    # Format once; the connector is served this same text from /content
+                    formatted_content = self.format_content_for_chatgpt(request_id, request_info)
+                    cache = server_instance.response_cache
+                    cache_key = ResponseCache.make_key(formatted_content, request_info['prompt']) if cache else None
+
+                    # Delta mode compares the page, block by block, with the last version seen at its URL
+                    delta_mode = request_info.get('delta_mode', False) and not view_in_chatgpt
+                    if delta_mode:
+                        assembler = request_info['assembler']
+                        metadata, blocks = assembler.metadata, page_blocks(assembler.text())
+
+                    # The chunks are no longer needed once the content is formatted
+                    with server_instance.lock:
+                        request_info['content'] = formatted_content
+                        request_info.pop('assembler').close()
+                        server_instance.pending_requests.touch(request_id)
+
+                    # Answer straight from the cache when the same content and prompt were seen before.
+                    # View mode always opens ChatGPT since the user wants to see the conversation.
+                    cached_response = cache.get(cache_key) if cache and not view_in_chatgpt else None
+                    outcome = 'cache_hit'
+
+                    # An unchanged page gets its previous answer, a changed one may only need the changes analyzed
+                    delta_outcome = None
+                    if delta_mode:
+                        delta_outcome, delta_value = server_instance.plan_delta(request_id, request_info,
+                                                                                metadata, blocks)
+                        if cached_response is None and delta_outcome == 'unchanged':
+                            cached_response, outcome = delta_value, 'unchanged'
+
+                    # Otherwise look for a nearly identical page answered for the same prompt. Delta mode is
+                    # for pages that change a little at a time, so an older version of the page is no answer.
+                    similarity_index = server_instance.similarity_index
+                    fingerprint = similar = None
+                    if similarity_index and not view_in_chatgpt and cached_response is None and not delta_mode:
+                        fingerprint = similarity_index.fingerprint(formatted_content)
+                        similar = similarity_index.lookup(fingerprint, request_info['prompt']) \
+                            if fingerprint is not None else None
+                        stored = server_instance.store.get_result(similar[0]) if similar else None
+                        if stored is not None and stored[0] == 'completed':
+                            cached_response = stored[1]
+                            outcome = 'similar_hit'
+
+                    if cached_response is not None:
+                        with server_instance.lock:
+                            request_info['status'] = 'completed'
+                            request_info['result'] = cached_response
+                            request_info['cached'] = True
+                            if outcome == 'similar_hit':
+                                request_info['approximate'] = {'similarTo': similar[0], 'distance': similar[1]}
+                            server_instance.pending_requests.touch(request_id)
+                            server_instance.results_ready.notify_all()
+
+                        server_instance.save_result(request_id, cached_response)
+                        if request_info.get('snapshot_url') is not None:
+                            server_instance.store.set_snapshot_answer(request_info['snapshot_url'], request_id,
+                                                                      cached_response)
+                        server_instance.metrics.inc('web_assistant_dispatch_total', outcome=outcome)
+                        server_instance.metrics.observe('web_assistant_dispatch_seconds', time.time() - dispatch_start)
+                        if outcome == 'similar_hit':
+                            server_instance.log.notice(outcome, f"Answered request {request_id} from similar request "
+                                                                f"{similar[0]} (distance {similar[1]})",
+                                                       requestId=request_id, similarTo=similar[0], distance=similar[1])
+                        elif outcome == 'unchanged':
+                            server_instance.log.notice(outcome, f"Answered request {request_id} with the previous "
+                                                                f"answer, the page is unchanged", requestId=request_id)
+                        else:
+                            server_instance.log.notice(outcome, f"Answered request {request_id} from cache",
+                                                       requestId=request_id)
+                        return
+
+                    if delta_outcome == 'delta':
+                        delta = request_info['delta']
+                        server_instance.log.info('delta', f"Sending only the changes of request {request_id}: "
+                                                          f"{delta['added']} block(s) added, {delta['removed']} removed, "
+                                                          f"{len(formatted_content) / 1024:.1f} KB -> "
+                                                          f"{len(delta_value) / 1024:.1f} KB",
+                                                 requestId=request_id, chars=len(delta_value), **delta)
+
+                    with server_instance.lock:
+                        if delta_outcome == 'delta':
+                            request_info['content'] = delta_value
+                            request_info['delta_prompt'] = True
+                        request_info['cache_key'] = cache_key
+                        request_info['fingerprint'] = fingerprint
+
+                        # Mark this request as pending ChatGPT processing
+                        request_info['status'] = 'pending_chatgpt'
+                        server_instance.pending_requests.touch(request_id)
+
+                    # Store the content so the request can be recovered after a restart
+                    server_instance.store.save_pending(
+                        request_id,
+                        request_info['prompt'],
+                        request_info['content'],
+                        view_in_chatgpt=view_in_chatgpt,
+                        cache_key=cache_key,
+                        created=request_info['timestamp']
+                    )
+
+                    # Hand the request to connectors, opening ChatGPT tabs if none are idle
+                    server_instance.dispatch_request(request_id)
+                    server_instance.metrics.observe('web_assistant_dispatch_seconds', time.time() - dispatch_start)
 
                 except Exception as e:
-                    print(f"{Fore.RED}Error opening ChatGPT: {e}{Style.RESET_ALL}")
+                    server_instance.log.error('dispatch_failed', f"Error opening ChatGPT: {e}", requestId=request_id,
+                                              error=str(e))
 
                     # Update request status
-                    server_instance.pending_requests[request_id]['status'] = 'error'
-                    server_instance.pending_requests[request_id]['result'] = f"Error: {str(e)}"
+                    server_instance.fail_request(request_id, f"Error: {str(e)}")
 
             def format_content_for_chatgpt(self, request_id, request_info):
                 """Format the content from all chunks for ChatGPT"""
-                chunks = request_info['chunks']
-                prompt = request_info['prompt'] or "Analyze this page content"
-                view_in_chatgpt = request_info.get('view_in_chatgpt', False)
-
-                # Extract metadata from the first chunk
-                metadata = {}
-                if chunks[0]:
-                    if 'metadata' in chunks[0]:
-                        metadata = chunks[0]['metadata']
-                    elif chunks[0].get('type') == 'complete':
-                        # Single complete content chunk
-                        metadata = {
-                            'url': chunks[0]['content'].get('url', ''),
-                            'title': chunks[0]['content'].get('title', '')
-                        }
-
-                # Combine text content from all chunks
-                text_content = ""
-                for chunk in chunks:
-                    if not chunk:
-                        continue
-
-                    if chunk.get('type') == 'text':
-                        text_content += chunk.get('content', '')
-                    elif chunk.get('type') == 'complete':
-                        text_content += chunk['content'].get('text', '')
+                assembler = request_info['assembler']
 
-                # Format the content for ChatGPT
-                formatted_content = f"URL: {metadata.get('url', '')}\n"
-                formatted_content += f"Title: {metadata.get('title', '')}\n\n"
+                # Metadata comes from the first chunk
+                budget = server_instance.content_budget(request_info.get('view_in_chatgpt', False))
+                formatted_content, source = format_page(assembler.metadata, assembler.text(), assembler.iter_html(),
+                                                        budget)
 
-                if metadata.get('description'):
-                    formatted_content += f"Description: {metadata.get('description')}\n\n"
+                # Record how much the reduction saved
+                bytes_in = assembler.bytes_received
+                bytes_out = len(formatted_content.encode('utf-8'))
+                request_info['reduction'] = {'bytesIn': bytes_in, 'bytesOut': bytes_out, 'source': source}
+                with server_instance.lock:
+                    server_instance.reduction_totals['bytesIn'] += bytes_in
+                    server_instance.reduction_totals['bytesOut'] += bytes_out
 
-                formatted_content += text_content
+                server_instance.log.info('content_reduced', f"Reduced content for request {request_id} from {source}: "
+                                                            f"{bytes_in / 1024:.1f} KB -> {bytes_out / 1024:.1f} KB",
+                                         requestId=request_id, source=source, bytesIn=bytes_in, bytesOut=bytes_out)
 
                 return formatted_content
 
@@ -466,12 +3553,131 @@ class LocalServer:
 def main():
     parser = argparse.ArgumentParser(description="Web Page Assistant Server")
     parser.add_argument("--port", type=int, default=8765, help="Port for the local server")
-    parser.add_argument("--timeout", type=int, default=600, help="Maximum server runtime in seconds")
+    parser.add_argument("--timeout", type=int, default=600,
+                        help="Seconds a request may wait for ChatGPT before it is dropped")
+    parser.add_argument("--workers", type=int, default=16, help="Number of requests handled concurrently")
+    parser.add_argument("--max-requests", type=int, default=500, help="Maximum number of requests kept in memory")
+    parser.add_argument("--max-request-memory", type=int, default=200,
+                        help="Maximum memory used by stored requests, in MB")
+    parser.add_argument("--receiving-ttl", type=int, default=120,
+                        help="Seconds a partially uploaded request is kept without new chunks")
+    parser.add_argument("--completed-ttl", type=int, default=600,
+                        help="Seconds a completed result is kept in memory (it stays available from disk)")
+    parser.add_argument("--cache-ttl", type=int, default=86400,
+                        help="Seconds a cached answer is reused for the same content and prompt (0 disables caching)")
+    parser.add_argument("--cache-entries", type=int, default=5000, help="Maximum number of cached answers")
+    parser.add_argument("--cache-memory", type=int, default=20,
+                        help="Maximum memory used for cached answers, in MB")
+    parser.add_argument("--lease-timeout", type=int, default=300,
+                        help="Seconds a connector has to answer a request before it is handed to another")
+    parser.add_argument("--max-content-chars", type=int, default=50000,
+                        help="Maximum characters of page content sent to ChatGPT (0 for no limit); pages "
+                             "that can be split keep up to --segment-tokens x 4 x --max-segments characters")
+    parser.add_argument("--retention-days", type=int, default=7, help="Days stored requests and results are kept")
+    parser.add_argument("--max-stored-requests", type=int, default=10000,
+                        help="Maximum number of requests kept in the result store")
+    parser.add_argument("--segment-tokens", type=int, default=8000,
+                        help="Estimated tokens above which a page is split across parallel ChatGPT sessions "
+                             "(0 disables splitting)")
+    parser.add_argument("--max-segments", type=int, default=8, help="Maximum number of segments per page")
+    parser.add_argument("--batch-pack-size", type=int, default=10,
+                        help="Maximum number of batch pages packed into one ChatGPT prompt")
+    parser.add_argument("--delta-max-change", type=float, default=0.5,
+                        help="Largest fraction of a page that may change for a delta-mode re-analysis to send "
+                             "ChatGPT only the changes and the previous answer")
+    parser.add_argument("--similarity-distance", type=int, default=3,
+                        help="Reuse the answer of a page whose 64-bit SimHash differs in at most this many bits "
+                             "(negative disables near-duplicate matching)")
+    parser.add_argument("--keepalive-timeout", type=int, default=5,
+                        help="Seconds an idle persistent connection is kept open")
+    parser.add_argument("--max-body-size", type=int, default=16,
+                        help="Largest request body accepted, in MB (after decompression)")
+    parser.add_argument("--max-request-size", type=int, default=64,
+                        help="Largest page accepted across all of its chunks, in MB")
+    parser.add_argument("--max-total-chunks", type=int, default=1000,
+                        help="Most chunks a page, or documents a batch, may have")
+    parser.add_argument("--max-in-flight", type=int, default=50,
+                        help="Pages and batches in progress before new ones are refused with 429 (0 for no limit)")
+    parser.add_argument("--max-queue-depth", type=int, default=100,
+                        help="Requests waiting for ChatGPT before new ones are refused with 503 (0 for no limit)")
+    parser.add_argument("--retry-after", type=int, default=5,
+                        help="Seconds clients are told to wait before retrying a refused request")
+    parser.add_argument("--backend", choices=['browser', 'http', 'mock'], default='browser',
+                        help="Where pages are analyzed: ChatGPT in the browser, an OpenAI-compatible HTTP endpoint, "
+                             "or a deterministic mock for tests and benchmarks")
+    parser.add_argument("--backend-url", default='http://localhost:11434/v1',
+                        help="Base URL of the OpenAI-compatible endpoint (/chat/completions is appended)")
+    parser.add_argument("--backend-model", help="Model name sent to the HTTP backend")
+    parser.add_argument("--backend-api-key", default=os.environ.get('OPENAI_API_KEY'),
+                        help="API key for the HTTP backend (default: $OPENAI_API_KEY)")
+    parser.add_argument("--backend-concurrency", type=int, default=4,
+                        help="Requests the HTTP or mock backend answers at the same time")
+    parser.add_argument("--backend-timeout", type=int, default=300,
+                        help="Seconds the HTTP backend may go without sending data")
+    parser.add_argument("--mock-latency", type=float, default=0.0,
+                        help="Seconds the mock backend takes to answer")
+    parser.add_argument("--warm-state-interval", type=int, default=60,
+                        help="Seconds between saves of the cache and similarity indexes to the warm-state snapshot "
+                             "loaded on startup (it is also saved on shutdown; 0 saves only on shutdown)")
+    parser.add_argument("--log-file", help="Also write structured events to this JSON-lines file")
+    parser.add_argument("--log-level", choices=list(EventLog.LEVELS), default='info',
+                        help="Minimum level of events to log")
+    parser.add_argument("--log-chunk-sample", type=int, default=1,
+                        help="Log only one in this many per-chunk events")
+    parser.add_argument("--no-console-log", action="store_true",
+                        help="Don't write events to the console (the startup banner is still shown)")
+    parser.add_argument("--cache-dir", help="Directory for cached content and results "
+                                            "(default: ~/.web-assistant-cache)")
 
     args = parser.parse_args()
+    if args.backend == 'http' and not args.backend_model:
+        parser.error("--backend-model is required with --backend http")
 
     # Start the server
-    server = LocalServer(port=args.port, timeout=args.timeout)
+    server = LocalServer(
+        port=args.port,
+        timeout=args.timeout,
+        workers=args.workers,
+        max_requests=args.max_requests,
+        max_request_memory=args.max_request_memory,
+        receiving_ttl=args.receiving_ttl,
+        completed_ttl=args.completed_ttl,
+        cache_ttl=args.cache_ttl,
+        cache_entries=args.cache_entries,
+        cache_memory=args.cache_memory,
+        lease_timeout=args.lease_timeout,
+        max_content_chars=args.max_content_chars,
+        cache_dir=args.cache_dir,
+        retention_days=args.retention_days,
+        max_stored_requests=args.max_stored_requests,
+        segment_tokens=args.segment_tokens,
+        max_segments=args.max_segments,
+        similarity_distance=args.similarity_distance,
+        keepalive_timeout=args.keepalive_timeout,
+        batch_pack_size=args.batch_pack_size,
+        log_file=args.log_file,
+        log_level=args.log_level,
+        log_console=not args.no_console_log,
+        log_chunk_sample=args.log_chunk_sample,
+        max_body_size=args.max_body_size,
+        max_request_size=args.max_request_size,
+        max_total_chunks=args.max_total_chunks,
+        max_in_flight=args.max_in_flight,
+        max_queue_depth=args.max_queue_depth,
+        retry_after=args.retry_after,
+        delta_max_change=args.delta_max_change,
+        warm_state_interval=args.warm_state_interval,
+        backend=args.backend,
+        backend_url=args.backend_url,
+        backend_model=args.backend_model,
+        backend_api_key=args.backend_api_key,
+        backend_concurrency=args.backend_concurrency,
+        backend_timeout=args.backend_timeout,
+        mock_latency=args.mock_latency
+    )
+
+    # Stop cleanly on SIGTERM too, so the warm-state snapshot is saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     server.start()
 
 
@@ -21,9 +21,25 @@
         analyzeEndpoint: '/analyze',
         statusEndpoint: '/status',
         resultsEndpoint: '/results',
+        snapshotEndpoint: '/snapshot',
+        // Seconds each long-poll request may wait on the server for the answer
+        longPollSeconds: 25,
+        // Overall time to wait for an answer before giving up
+        resultsTimeout: 120000,
         // Content extraction settings
         extractHTML: true,
         chunkSize: 100000,
+        // Number of chunks uploaded in parallel, and how often missing chunks are resent
+        uploadConcurrency: 4,
+        uploadRetries: 3,
+        // Times a chunk is retried while the server answers 429/503 (busy)
+        busyRetries: 10,
+        // Request bodies smaller than this are sent uncompressed
+        compressMinBytes: 1024,
+        // Re-analyzing a page uploads only the lines that changed since the last analysis,
+        // unless more than this fraction of the page changed
+        deltaUploads: true,
+        deltaMaxChange: 0.5,
         uiSettings: {
             width: '280px',
             height: 'auto',
@@ -60,7 +76,11 @@
         isProcessing: false,
         currentRequestId: null,
         isMinimized: false,
-        lastResponse: null
+        lastResponse: null,
+        supportsLongPoll: false,
+        supportsGzip: false,
+        supportsDelta: false,
+        supportsStreaming: false
     };
 
     // UI Elements
@@ -91,6 +111,19 @@
                 if (response.status === 200) {
                     STATE.isServerAvailable = true;
                     STATE.connectionRetries = 0;
+                    try {
+                        const status = JSON.parse(response.responseText);
+                        const features = status.features || [];
+                        STATE.supportsLongPoll = features.includes('long-poll');
+                        STATE.supportsGzip = features.includes('gzip') && typeof CompressionStream !== 'undefined';
+                        STATE.supportsDelta = features.includes('delta');
+                        STATE.supportsStreaming = features.includes('streaming');
+                    } catch (e) {
+                        STATE.supportsLongPoll = false;
+                        STATE.supportsGzip = false;
+                        STATE.supportsDelta = false;
+                        STATE.supportsStreaming = false;
+                    }
                     updateStatusText('Web Assistant'); // Changed from 'Ready'
                 } else {
                     handleConnectionError();
@@ -442,8 +475,8 @@
             const chunkText = chunks.length > 1 ? ` (${chunks.length} chunks)` : '';
             updateStatusText(`Analyzing${chunkText}...`);
 
-            // Send first chunk to start the process
-            sendContentChunk(requestId, prompt, chunks, 0, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
+            // Send all chunks to start the process
+            startUpload(requestId, prompt, content, chunks, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
         } catch (error) {
             console.error('Error extracting content:', error);
             updateStatusText('Extraction error', true);
@@ -608,7 +641,7 @@
     // REPLACE THIS ENTIRE FUNCTION with a simpler version that just calls handleAnalyzeClick
     function analyzePageContent(prompt, viewInChatGPT) {
         // This function is now just a wrapper that calls handleAnalyzeClick
-        // All the logic has been moved to handleAnalyzeClick and sendContentChunk
+        // All the logic has been moved to handleAnalyzeClick and uploadChunks
         const originalAnalyzeText = 'Analyze';
         const originalChatGPTText = 'Open in ChatGPT';
 
@@ -625,8 +658,8 @@
             const chunkText = chunks.length > 1 ? ` (${chunks.length} chunks)` : '';
             updateStatusText(`Analyzing${chunkText}...`);
 
-            // Send first chunk to start the process with the right parameters
-            sendContentChunk(requestId, prompt, chunks, 0, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
+            // Send all chunks to start the process with the right parameters
+            startUpload(requestId, prompt, content, chunks, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
 
         } catch (error) {
             console.error('Error extracting content:', error);
@@ -636,23 +669,267 @@
             resetUI('Analyze', 'Open in ChatGPT');
         }
     }
-    // REPLACEMENT #3: Modified sendContentChunk to pass through the original button text
-    function sendContentChunk(requestId, prompt, chunks, chunkIndex, viewInChatGPT, originalAnalyzeText, originalChatGPTText) {
-        if (chunkIndex >= chunks.length) {
-            // All chunks sent
-            if (!viewInChatGPT) {
-                // If not viewing in ChatGPT, start polling for results
-                pollForResults(requestId, originalAnalyzeText, originalChatGPTText);
-            } else {
-                // If viewing in ChatGPT, we're done here
-                updateStatusText('Opened in ChatGPT');
-                showResponse('Content is being processed in ChatGPT. Please check the new browser tab.');
+    // Upload only the changed lines when the server has a snapshot of this page, otherwise all chunks
+    function startUpload(requestId, prompt, content, chunks, viewInChatGPT, originalAnalyzeText, originalChatGPTText) {
+        const uploadAll = () => uploadChunks(requestId, prompt, chunks, viewInChatGPT,
+            originalAnalyzeText, originalChatGPTText);
+
+        if (!deltaMode(viewInChatGPT)) {
+            uploadAll();
+            return;
+        }
+
+        const query = new URLSearchParams({ url: content.url }).toString();
+        GM_xmlhttpRequest({
+            method: 'GET',
+            url: `${CONFIG.serverUrl}${CONFIG.snapshotEndpoint}?${query}`,
+            onload: (response) => {
+                let snapshot = null;
+                try {
+                    snapshot = response.status === 200 ? JSON.parse(response.responseText) : null;
+                } catch (e) {
+                    console.error('Error parsing snapshot:', e);
+                }
+                if (!snapshot) {
+                    uploadAll();
+                    return;
+                }
+
+                // Lines the server already has are sent as their hash
+                const known = new Set(snapshot.hashes);
+                const lines = pageBlocks(content.text);
+                let changedChars = 0;
+                const blocks = lines.map((line) => {
+                    const hash = blockHash(line);
+                    if (known.has(hash)) return hash;
+                    changedChars += line.length;
+                    return { text: line };
+                });
+
+                const totalChars = lines.reduce((total, line) => total + line.length, 0);
+                if (changedChars > CONFIG.deltaMaxChange * totalChars) {
+                    uploadAll();
+                    return;
+                }
+
+                updateStatusText('Sending changes...');
+                const deltaChunk = {
+                    type: 'delta',
+                    metadata: { url: content.url, title: content.title, description: content.description || '' },
+                    blocks: blocks
+                };
+                sendContentChunk(requestId, prompt, [deltaChunk], 0, viewInChatGPT, (ok, error, result) => {
+                    if (ok) {
+                        onUploadComplete(requestId, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
+                    } else if (error && !(result && result.fullUpload)) {
+                        console.error('Error sending changes:', error);
+                        updateStatusText('Server error', true);
+                        showResponse(`Error: ${error}`, true);
+                        STATE.isProcessing = false;
+                        resetUI(originalAnalyzeText, originalChatGPTText);
+                    } else {
+                        // The snapshot changed in the meantime or the request failed, send the whole page
+                        uploadAll();
+                    }
+                });
+            },
+            onerror: uploadAll
+        });
+    }
+
+    function deltaMode(viewInChatGPT) {
+        return CONFIG.deltaUploads && STATE.supportsDelta && !viewInChatGPT;
+    }
+
+    // Lines of the page text with whitespace collapsed, split the same way as on the server
+    function pageBlocks(text) {
+        return (text || '').split(/\r\n|\r|\n/)
+            .map((line) => line.replace(/\s+/g, ' ').trim())
+            .filter((line) => line.length > 0);
+    }
+
+    const CRC_TABLE = (() => {
+        const table = new Uint32Array(256);
+        for (let n = 0; n < 256; n++) {
+            let c = n;
+            for (let k = 0; k < 8; k++) {
+                c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1;
+            }
+            table[n] = c;
+        }
+        return table;
+    })();
+
+    // CRC-32 and Adler-32 of the line's UTF-8 bytes as 16 hex digits, the same hash the server computes
+    function blockHash(line) {
+        let crc = 0xffffffff;
+        let a = 1;
+        let b = 0;
+        for (const byte of new TextEncoder().encode(line)) {
+            crc = CRC_TABLE[(crc ^ byte) & 0xff] ^ (crc >>> 8);
+            a = (a + byte) % 65521;
+            b = (b + a) % 65521;
+        }
+        const hex = (value) => (value >>> 0).toString(16).padStart(8, '0');
+        return hex(crc ^ 0xffffffff) + hex((b << 16) | a);
+    }
+
+    // Upload all chunks, several at a time, then resend whatever the server is still missing
+    function uploadChunks(requestId, prompt, chunks, viewInChatGPT, originalAnalyzeText, originalChatGPTText, attempt = 0) {
+        const pending = chunks.map((chunk, index) => index);
+        let sent = 0;
+        let failed = 0;
+        let serverError = null;
+
+        const finish = () => {
+            if (serverError) {
+                console.error('Error sending chunk:', serverError);
+                updateStatusText('Server error', true);
+                showResponse(`Error: ${serverError}`, true);
                 STATE.isProcessing = false;
                 resetUI(originalAnalyzeText, originalChatGPTText);
+            } else if (failed > 0) {
+                resumeUpload(requestId, prompt, chunks, viewInChatGPT, originalAnalyzeText, originalChatGPTText, attempt);
+            } else {
+                onUploadComplete(requestId, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
             }
+        };
+
+        sendChunkList(requestId, prompt, chunks, pending, viewInChatGPT, (ok, error) => {
+            sent++;
+            if (!ok) {
+                failed++;
+                serverError = serverError || error;
+            }
+            if (chunks.length > 1) {
+                updateStatusText(`Sending ${sent}/${chunks.length}...`);
+            } else {
+                updateStatusText('Processing...');
+            }
+        }, finish);
+    }
+
+    // Ask the server which chunks it's missing and resend only those
+    function resumeUpload(requestId, prompt, chunks, viewInChatGPT, originalAnalyzeText, originalChatGPTText, attempt) {
+        const failUpload = () => {
+            updateStatusText('Connection error', true);
+            showResponse('Failed to connect to the server', true);
+            STATE.isProcessing = false;
+            resetUI(originalAnalyzeText, originalChatGPTText);
+        };
+
+        if (attempt >= CONFIG.uploadRetries) {
+            failUpload();
             return;
         }
 
+        GM_xmlhttpRequest({
+            method: 'GET',
+            url: `${CONFIG.serverUrl}${CONFIG.analyzeEndpoint}/${requestId}`,
+            onload: (response) => {
+                // The server has never seen this request, start over
+                let missing = chunks.map((chunk, index) => index);
+                if (response.status === 200) {
+                    try {
+                        const progress = JSON.parse(response.responseText);
+                        missing = [];
+                        for (const [start, end] of progress.missing) {
+                            for (let i = start; i <= end; i++) missing.push(i);
+                        }
+                    } catch (e) {
+                        console.error('Error parsing upload progress:', e);
+                    }
+                }
+
+                if (missing.length === 0) {
+                    onUploadComplete(requestId, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
+                    return;
+                }
+
+                updateStatusText(`Resending ${missing.length} chunk(s)...`);
+                let failed = 0;
+                sendChunkList(requestId, prompt, chunks, missing, viewInChatGPT, (ok) => {
+                    if (!ok) failed++;
+                }, () => {
+                    if (failed > 0) {
+                        setTimeout(() => resumeUpload(requestId, prompt, chunks, viewInChatGPT,
+                            originalAnalyzeText, originalChatGPTText, attempt + 1), 1000);
+                    } else {
+                        onUploadComplete(requestId, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
+                    }
+                });
+            },
+            onerror: () => setTimeout(() => resumeUpload(requestId, prompt, chunks, viewInChatGPT,
+                originalAnalyzeText, originalChatGPTText, attempt + 1), 1000)
+        });
+    }
+
+    // Send the given chunk indexes with at most CONFIG.uploadConcurrency requests in flight
+    function sendChunkList(requestId, prompt, chunks, indexes, viewInChatGPT, onChunkDone, onAllDone) {
+        const queue = indexes.slice();
+        let active = 0;
+        let remaining = queue.length;
+
+        const next = () => {
+            while (active < CONFIG.uploadConcurrency && queue.length > 0) {
+                const chunkIndex = queue.shift();
+                active++;
+                sendContentChunk(requestId, prompt, chunks, chunkIndex, viewInChatGPT, (ok, error) => {
+                    active--;
+                    remaining--;
+                    onChunkDone(ok, error);
+                    if (remaining === 0) {
+                        onAllDone();
+                    } else {
+                        next();
+                    }
+                });
+            }
+        };
+
+        next();
+    }
+
+    // All chunks are on the server
+    function onUploadComplete(requestId, viewInChatGPT, originalAnalyzeText, originalChatGPTText) {
+        if (!viewInChatGPT) {
+            // If not viewing in ChatGPT, start polling for results
+            pollForResults(requestId, originalAnalyzeText, originalChatGPTText);
+        } else {
+            // If viewing in ChatGPT, we're done here
+            updateStatusText('Opened in ChatGPT');
+            showResponse('Content is being processed in ChatGPT. Please check the new browser tab.');
+            STATE.isProcessing = false;
+            resetUI(originalAnalyzeText, originalChatGPTText);
+        }
+    }
+
+    // Gzip a request body when the server accepts it; resolves to { data, headers }
+    function encodeBody(text) {
+        if (!STATE.supportsGzip || text.length < CONFIG.compressMinBytes) {
+            return Promise.resolve({ data: text, headers: { 'Content-Type': 'application/json' } });
+        }
+
+        const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+        return new Response(stream).blob()
+            .then((blob) => ({
+                data: blob,
+                headers: { 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' }
+            }))
+            .catch((error) => {
+                console.warn('Compression failed, sending uncompressed:', error);
+                return { data: text, headers: { 'Content-Type': 'application/json' } };
+            });
+    }
+
+    // Seconds to wait according to a Retry-After header, defaulting to 5
+    function retryAfterSeconds(response) {
+        const match = /^retry-after:\s*(\d+)/im.exec(response.responseHeaders || '');
+        return match ? Math.max(1, parseInt(match[1], 10)) : 5;
+    }
+
+    // Send a single chunk; done(ok, serverError, response) is called when the request settles
+    function sendContentChunk(requestId, prompt, chunks, chunkIndex, viewInChatGPT, done, busyAttempt = 0) {
         const chunk = chunks[chunkIndex];
 
         // Prepare data for this chunk
@@ -663,59 +940,148 @@
             totalChunks: chunks.length,
             isLastChunk: chunkIndex === chunks.length - 1,
             viewInChatGPT: viewInChatGPT,
+            // Lets the server keep a snapshot of the page, so re-analyzing it can send only the changes
+            delta: deltaMode(viewInChatGPT),
             chunk: chunk
         };
 
-        // Update status
-        if (chunks.length > 1) {
-            updateStatusText(`Sending ${chunkIndex + 1}/${chunks.length}...`);
+        // Send to server
+        encodeBody(JSON.stringify(data)).then((body) => {
+            GM_xmlhttpRequest({
+                method: 'POST',
+                url: `${CONFIG.serverUrl}${CONFIG.analyzeEndpoint}`,
+                data: body.data,
+                headers: body.headers,
+                onload: (response) => {
+                    // The server is overloaded: wait as long as it asks, then send the same chunk again
+                    if ((response.status === 429 || response.status === 503) && busyAttempt < CONFIG.busyRetries) {
+                        const delay = retryAfterSeconds(response);
+                        updateStatusText(`Server busy, retrying in ${delay}s...`);
+                        setTimeout(() => sendContentChunk(requestId, prompt, chunks, chunkIndex, viewInChatGPT,
+                            done, busyAttempt + 1), delay * 1000);
+                        return;
+                    }
+                    try {
+                        const result = JSON.parse(response.responseText);
+                        done(result.success, result.success ? null : result.error, result);
+                    } catch (e) {
+                        console.error('Error parsing response:', e);
+                        done(false, null);
+                    }
+                },
+                onerror: (error) => {
+                    console.error('Request error:', error);
+                    done(false, null);
+                }
+            });
+        });
+    }
+    // Wait for results with long-polling, falling back to interval polling on older servers
+    function pollForResults(requestId, originalAnalyzeText, originalChatGPTText) {
+        updateStatusText('Processing...');
+        showResponse('ChatGPT is analyzing the page content...');
+
+        if (STATE.supportsLongPoll) {
+            waitForResults(requestId, Date.now(), originalAnalyzeText, originalChatGPTText);
         } else {
-            updateStatusText('Processing...');
+            pollForResultsInterval(requestId, originalAnalyzeText, originalChatGPTText);
         }
+    }
+
+    // Long-poll the results endpoint; the server answers as soon as ChatGPT's response arrives
+    function waitForResults(requestId, startTime, originalAnalyzeText, originalChatGPTText, partialChars = 0) {
+        const elapsed = Date.now() - startTime;
+        if (elapsed > CONFIG.resultsTimeout) {
+            updateStatusText('Analysis timed out', true);
+            showResponse('The analysis request timed out. Please try again.', true);
+            STATE.isProcessing = false;
+            resetUI(originalAnalyzeText, originalChatGPTText);
+            return;
+        }
+
+        const requestStart = Date.now();
+        let shownChars = partialChars;
+        const retry = () => {
+            // Don't hammer the server if it answered without waiting, unless it sent more of the answer
+            const delay = shownChars === partialChars && Date.now() - requestStart < 1000 ? 2000 : 0;
+            setTimeout(() => waitForResults(requestId, startTime, originalAnalyzeText, originalChatGPTText,
+                shownChars), delay);
+        };
+
+        // Servers that stream answers also return as soon as more of the answer has arrived
+        const partialQuery = STATE.supportsStreaming ? `&partial=${partialChars}` : '';
 
-        // Send to server
         GM_xmlhttpRequest({
-            method: 'POST',
-            url: `${CONFIG.serverUrl}${CONFIG.analyzeEndpoint}`,
-            data: JSON.stringify(data),
-            headers: {
-                'Content-Type': 'application/json'
-            },
+            method: 'GET',
+            url: `${CONFIG.serverUrl}${CONFIG.resultsEndpoint}/${requestId}?wait=${CONFIG.longPollSeconds}${partialQuery}`,
+            timeout: (CONFIG.longPollSeconds + 10) * 1000,
             onload: (response) => {
-                try {
-                    const result = JSON.parse(response.responseText);
-
-                    if (result.success) {
-                        // Send next chunk
-                        sendContentChunk(requestId, prompt, chunks, chunkIndex + 1, viewInChatGPT, originalAnalyzeText, originalChatGPTText);
+                if (response.status === 200) {
+                    try {
+                        const result = JSON.parse(response.responseText);
+                        if (result.success && result.response) {
+                            updateStatusText('Web Assistant');
+                            showResponse(result.response);
+                            STATE.isProcessing = false;
+                            resetUI(originalAnalyzeText, originalChatGPTText);
+                            return;
+                        }
+                    } catch (e) {
+                        console.error('Error parsing long-poll response:', e);
+                    }
+                } else if (response.status === 404) {
+                    let segments = null;
+                    let partial = null;
+                    try {
+                        const progress = JSON.parse(response.responseText);
+                        segments = progress.segments;
+                        partial = progress.partial;
+                    } catch (e) {
+                        // Older servers don't report progress
+                    }
+                    if (partial) {
+                        // The answer so far, while the backend is still writing it
+                        updateStatusText('Answering...');
+                        showResponse(partial);
+                        shownChars = partial.length;
+                    } else if (segments && segments.stage === 'map') {
+                        updateStatusText(`Analyzed ${segments.completed}/${segments.total} parts...`);
+                    } else if (segments) {
+                        updateStatusText('Combining parts...');
                     } else {
-                        console.error('Error sending chunk:', result.error);
-                        updateStatusText('Server error', true);
-                        showResponse(`Error: ${result.error}`, true);
+                        updateStatusText(`Waiting (${Math.round((Date.now() - startTime) / 1000)}s)...`);
+                    }
+                } else {
+                    let error = null;
+                    try {
+                        error = JSON.parse(response.responseText).error;
+                    } catch (e) {
+                        // Not a JSON error body
+                    }
+                    if (error) {
+                        updateStatusText('Analysis failed', true);
+                        showResponse(error, true);
                         STATE.isProcessing = false;
                         resetUI(originalAnalyzeText, originalChatGPTText);
+                        return;
                     }
-                } catch (e) {
-                    console.error('Error parsing response:', e);
-                    updateStatusText('Response error', true);
-                    showResponse('Server returned an invalid response', true);
-                    STATE.isProcessing = false;
-                    resetUI(originalAnalyzeText, originalChatGPTText);
+                    updateStatusText('Server error', true);
                 }
+
+                // No answer yet, wait again
+                retry();
             },
-            onerror: (error) => {
-                console.error('Request error:', error);
-                updateStatusText('Connection error', true);
-                showResponse('Failed to connect to the server', true);
-                STATE.isProcessing = false;
-                resetUI(originalAnalyzeText, originalChatGPTText);
-            }
+            onerror: () => {
+                // Long-polling failed, fall back to regular polling
+                console.warn('Long-poll failed, falling back to polling');
+                pollForResultsInterval(requestId, originalAnalyzeText, originalChatGPTText);
+            },
+            ontimeout: retry
         });
     }
+
     // 2. Modify the pollForResults function to avoid showing "Complete" status
-    function pollForResults(requestId, originalAnalyzeText, originalChatGPTText) {
-        updateStatusText('Processing...');
-        showResponse('ChatGPT is analyzing the page content...');
+    function pollForResultsInterval(requestId, originalAnalyzeText, originalChatGPTText) {
 
         // Start polling with exponential backoff
         const backoff = 2000; // Start with 2 seconds